@@ -10,6 +10,7 @@ from __future__ import division
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy.interpolate as interp
+import scipy.special as ss
 import scipy.ndimage.filters as filter
 try:
     import healpy as hp
@@ -959,8 +960,6 @@ def makeSkyMap(samples, lmax, nside=32, cmap=None, strain=None, tex=True,
 
 def OSupperLimit(psr, GCGnoiseInv, ORF, OSsmbhb, ul_list=None,
                  far=None, drlist=None, tex=True, nlims=60):
-    if tex == True:
-        plt.rcParams['text.usetex'] = True
 
     gam_bkgrd = np.linspace(1.01,6.99,nlims)
     optStatList=[]
@@ -970,42 +969,11 @@ def OSupperLimit(psr, GCGnoiseInv, ORF, OSsmbhb, ul_list=None,
         ct+=1
         print "Finished {0}% of optimal-statistic upper-limit calculations...".format( 100.0*ct/(1.0*nlims) )
 
-    optStatList = np.array(optStatList)
-
-    fig, ax = plt.subplots()
-    stylelist = ['solid','dashed','dotted']
-    if ul_list is not None:
-        for ii in range(len(ul_list)):
-            ax.plot(gam_bkgrd, np.sqrt( optStatList[:,0] + optStatList[:,1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
-                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='$A_h$ {0}$\%$ upper-limit'.format(ul_list[ii]*100))
-            plt.hlines(y=np.sqrt( OSsmbhb[0] + OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
-                       xmin=gam_bkgrd.min(), xmax=13./3., linewidth=3.0, linestyle='solid', color='red')
-            plt.vlines(x=13./3., ymin=0.0, ymax=np.sqrt( OSsmbhb[0] + OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
-                       linewidth=3.0, linestyle='solid', color='red')
-    else:
-        for ii in range(len(drlist)):
-            ax.plot(gam_bkgrd, np.sqrt( optStatList[:,1]*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
-                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='$A_h$ ({0}$\%$ FAR, {1}$\%$ DR)'.format(far*100,drlist[ii]*100))
-            plt.hlines(y=np.sqrt( OSsmbhb*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
-                       xmin=gam_bkgrd.min(), xmax=13./3., linewidth=3.0, linestyle='solid', color='red')
-            plt.vlines(x=13./3., ymin=0.0, ymax=np.sqrt( OSsmbhb*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
-                       linewidth=3.0, linestyle='solid', color='red')
-
-    ax.set_yscale('log')
-    ax.set_xlabel(r'$\gamma\equiv 3-2\alpha$', fontsize=20)
-    ax.set_ylabel(r'$A_h$', fontsize=20)
-    ax.minorticks_on()
-    plt.tick_params(labelsize=18)
-    plt.grid(which='major')
-    plt.grid(which='minor')
-    plt.title('Optimal-statistic bounds')
-    plt.legend(loc='lower left', shadow=True, frameon=True, prop={'size':15})
-    plt.show()
+    OSboundsPlot(gam_bkgrd, np.array(optStatList), OSsmbhb, ul_list=ul_list,
+                 far=far, drlist=drlist, tex=tex, amplabel='$A_h$')
 
 def TF_OSupperLimit(psr, fqs, Tspan, F, GCGnoiseInv, ORF, OSsmbhb,
                     ul_list=None, far=None, drlist=None, tex=True, nlims=70):
-    if tex == True:
-        plt.rcParams['text.usetex'] = True
 
     gam_bkgrd = np.linspace(0.01,6.99,nlims)
     optStatList=[]
@@ -1015,14 +983,34 @@ def TF_OSupperLimit(psr, fqs, Tspan, F, GCGnoiseInv, ORF, OSsmbhb,
         ct+=1
         print "Finished {0}% of optimal-statistic upper-limit calculations...".format( 100.0*ct/(1.0*nlims) )
 
-    optStatList = np.array(optStatList)
+    OSboundsPlot(gam_bkgrd, np.array(optStatList), OSsmbhb, ul_list=ul_list,
+                 far=far, drlist=drlist, tex=tex, amplabel='$A$')
+
+def OSboundsPlot(gam_bkgrd, optStatList, OSsmbhb, ul_list=None,
+                 far=None, drlist=None, tex=True, amplabel='$A_h$'):
+    """
+    Optimal-statistic upper limits (or detection thresholds at a
+    false-alarm rate) on the amplitude as a function of spectral index,
+    e.g. from the spectral-index grid of NX01_optstat.
+
+    @param gam_bkgrd: spectral indices
+    @param optStatList: (Opt, sigma, snr) at each spectral index
+    @param OSsmbhb: (Opt, sigma) at gamma = 13/3
+    @param ul_list: upper-limit levels
+    @param far: false-alarm rate, with drlist instead of ul_list
+    @param drlist: detection rates
+
+    """
+
+    if tex == True:
+        plt.rcParams['text.usetex'] = True
 
     fig, ax = plt.subplots()
     stylelist = ['solid','dashed','dotted']
     if ul_list is not None:
         for ii in range(len(ul_list)):
             ax.plot(gam_bkgrd, np.sqrt( optStatList[:,0] + optStatList[:,1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
-                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='{0}$\%$ upper-limit'.format(ul_list[ii]*100))
+                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='{0} {1}$\%$ upper-limit'.format(amplabel,ul_list[ii]*100))
             plt.hlines(y=np.sqrt( OSsmbhb[0] + OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
                        xmin=gam_bkgrd.min(), xmax=13./3., linewidth=3.0, linestyle='solid', color='red')
             plt.vlines(x=13./3., ymin=0.0, ymax=np.sqrt( OSsmbhb[0] + OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*(1.-ul_list[ii])) ) ),
@@ -1030,15 +1018,15 @@ def TF_OSupperLimit(psr, fqs, Tspan, F, GCGnoiseInv, ORF, OSsmbhb,
     else:
         for ii in range(len(drlist)):
             ax.plot(gam_bkgrd, np.sqrt( optStatList[:,1]*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
-                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='$A$ ({0}$\%$ FAR, {1}$\%$ DR)'.format(far*100,drlist[ii]*100))
-            plt.hlines(y=np.sqrt( OSsmbhb*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
+                    linestyle=stylelist[ii], color='black', linewidth=3.0, label='{0} ({1}$\%$ FAR, {2}$\%$ DR)'.format(amplabel,far*100,drlist[ii]*100))
+            plt.hlines(y=np.sqrt( OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
                        xmin=gam_bkgrd.min(), xmax=13./3., linewidth=3.0, linestyle='solid', color='red')
-            plt.vlines(x=13./3., ymin=0.0, ymax=np.sqrt( OSsmbhb*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
+            plt.vlines(x=13./3., ymin=0.0, ymax=np.sqrt( OSsmbhb[1]*np.sqrt(2.0)*( ss.erfcinv(2.0*far) - ss.erfcinv(2.0*drlist[ii]) ) ),
                        linewidth=3.0, linestyle='solid', color='red')
 
     ax.set_yscale('log')
     ax.set_xlabel(r'$\gamma\equiv 3-2\alpha$', fontsize=20)
-    ax.set_ylabel(r'$A$', fontsize=20)
+    ax.set_ylabel(amplabel, fontsize=20)
     ax.minorticks_on()
     plt.tick_params(labelsize=18)
     plt.grid(which='major')
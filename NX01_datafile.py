@@ -410,3 +410,133 @@ class DataFile(object):
         self.h5file = None
 
    
+
+    """
+    Add the white-noise sufficient statistics of a pulsar to a compressed
+    HDF5 file. Only the pulsar meta-data needed to set up a run is stored,
+    together with one subgroup per model configuration holding the
+    products T^T N^-1 T, T^T N^-1 r, log|N| and r^T N^-1 r. These are all
+    the likelihood needs when the white noise is held fixed. The noise
+    values, phase shifts and data digest they were computed with are
+    stored alongside, to be checked when they are read back.
+
+    @param psr:         Pulsar object (PsrObjFromH5)
+    @param configkey:   String identifying the basis configuration
+    @param TtNT:        T^T N^-1 T
+    @param d:           T^T N^-1 r
+    @param logdet_N:    log determinant of N
+    @param dtNdt:       r^T N^-1 r
+    @param pshift_vals: Random phase shifts of the red-noise basis
+    @param overwrite:   Whether the data should be overwritten if it exists
+    """
+    def addCompressedPulsar(self, psr, configkey, TtNT, d, logdet_N, dtNdt,
+                            pshift_vals=None, overwrite=True):
+        if self.filename is None:
+            raise RuntimeError, "HDF5 filename not provided"
+
+        # 'a' means: read/write if exists, create otherwise
+        self.h5file = h5.File(self.filename, 'a')
+
+        psrGroup = self.getPulsarGroup(str(psr.name), delete=False)
+
+        # Save the pulsar meta-data
+        self.writeData(psrGroup, 'name', psr.name, overwrite=overwrite)
+        self.writeData(psrGroup, 'psrlocs', psr.psr_locs, overwrite=overwrite)
+        self.writeData(psrGroup, 'raj', psr.raj, overwrite=overwrite)
+        self.writeData(psrGroup, 'decj', psr.decj, overwrite=overwrite)
+        self.writeData(psrGroup, 'elong', psr.elong, overwrite=overwrite)
+        self.writeData(psrGroup, 'elat', psr.elat, overwrite=overwrite)
+        self.writeData(psrGroup, 'ntoa', len(psr.toas), overwrite=overwrite)
+        self.writeData(psrGroup, 'tmin', psr.toas.min(), overwrite=overwrite)    # Days
+        self.writeData(psrGroup, 'tmax', psr.toas.max(), overwrite=overwrite)    # Days
+
+        # Save the single-pulsar noise properties (used for starting values)
+        for field in ['parRedamp', 'parRedind', 'parDMamp', 'parDMind',
+                      'Redamp', 'Redind', 'DMamp', 'DMind']:
+            self.writeData(psrGroup, field, getattr(psr, field),
+                           overwrite=overwrite)
+
+        # Save the products for this model configuration
+        configGroup = psrGroup.require_group(configkey)
+        self.writeData(configGroup, 'TtNT', TtNT, overwrite=overwrite)
+        self.writeData(configGroup, 'd', d, overwrite=overwrite)
+        self.writeData(configGroup, 'logdet_N', logdet_N, overwrite=overwrite)
+        self.writeData(configGroup, 'dtNdt', dtNdt, overwrite=overwrite)
+        self.writeData(configGroup, 'ntm', psr.Gc.shape[1], overwrite=overwrite)
+
+        # Save what the products were computed with
+        for field in ['efacs', 'equads', 'ecorrs']:
+            vals = getattr(psr, field)
+            if vals is None:
+                vals = {}
+            self.writeData(configGroup, field+'_sys',
+                           np.array(vals.keys(), dtype=str), overwrite=overwrite)
+            self.writeData(configGroup, field,
+                           np.array(vals.values(), dtype=np.double), overwrite=overwrite)
+        if pshift_vals is not None:
+            self.writeData(configGroup, 'pshift_vals', pshift_vals, overwrite=overwrite)
+        self.writeData(configGroup, 'datadigest', psr.data_digest(), overwrite=overwrite)
+
+        # Close the HDF5 file
+        self.h5file.close()
+        self.h5file = None
+
+    """
+    Write products to the cache group with name key (typically a hash of
+    the inputs from which the products were computed)
+
+    @param key:         Name of the cache group
+    @param products:    Dictionary of field name and data
+    """
+    def addCacheProducts(self, key, products):
+        if self.filename is None:
+            raise RuntimeError, "HDF5 filename not provided"
+
+        # 'a' means: read/write if exists, create otherwise
+        self.h5file = h5.File(self.filename, 'a')
+
+        cacheGroup = self.h5file.require_group(key)
+        for field in products:
+            self.writeData(cacheGroup, field, products[field], overwrite=True)
+
+        self.h5file.close()
+        self.h5file = None
+
+    """
+    Read products from the cache group with name key. Contiguous datasets are
+    memory-mapped (copy-on-write) rather than read into memory. Returns None
+    if the file or the group does not exist.
+
+    @param key:         Name of the cache group
+    """
+    def getCacheProducts(self, key):
+        if self.filename is None:
+            raise RuntimeError, "HDF5 filename not provided"
+
+        if not os.path.isfile(self.filename):
+            return None
+
+        # 'r' means: read file, must exist
+        self.h5file = h5.File(self.filename, 'r')
+
+        if key not in self.h5file:
+            self.h5file.close()
+            self.h5file = None
+            return None
+
+        products = {}
+        for field in self.h5file[key]:
+            dset = self.h5file[key][field]
+            offset = dset.id.get_offset()
+            if len(dset.shape) > 0 and offset is not None and \
+              dset.chunks is None and dset.compression is None:
+                products[field] = np.memmap(self.filename, mode='c',
+                                            dtype=dset.dtype, shape=dset.shape,
+                                            offset=offset)
+            else:
+                products[field] = dset.value
+
+        self.h5file.close()
+        self.h5file = None
+
+        return products
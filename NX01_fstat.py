@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+
+"""
+NX01_fstat.py
+
+Frequency-domain detection statistics for continuous GWs from
+circular SMBHBs: the coherent F_e-statistic (Earth term only,
+maximized over the four extrinsic amplitudes) and the incoherent
+F_p-statistic (pulsar by pulsar, so it also picks up pulsar terms),
+as in Ellis, Siemens & Creighton (2012) and Babak & Sesana (2012).
+
+Pulsars come from hdf5 files, with their single-pulsar noise
+(EFAC/EQUAD/ECORR and power-law red and DM noise) held fixed. The
+noise-weighted sine and cosine projections of each pulsar are
+computed once per frequency; the sky scan is then batched linear
+algebra on 2x2 and 4x4 matrices. Frequency chunks can be spread
+over several processes.
+
+"""
+
+from __future__ import division
+import numpy as np
+import os, optparse, time
+from multiprocessing import Pool
+import h5py as h5
+from scipy import linalg as sl
+
+import NX01_psr
+import rankreduced as rr
+
+f1yr = 1.0/(365.25*86400.0)
+
+
+def noiseModel(psr, Tmax, nmodes_red, incDM=False, nmodes_dm=None, noEcorr=False):
+    """
+    Basis and prior of a pulsar's fixed noise model: timing model,
+    power-law red noise (and DM variations) from the single-pulsar
+    noise analysis, and ECORR as one basis column per epoch.
+
+    @param psr: pulsar object, after grab_all_vars
+    @param Tmax: time span of the array [s]
+    @param nmodes_red: number of red-noise frequencies
+    @param incDM: include DM variations
+    @param nmodes_dm: number of DM-variation frequencies (default nmodes_red)
+    @param noEcorr: ignore ECORR
+
+    @return: T: basis, (nTOA x nbasis)
+    @return: phiinv: inverse prior variances (0 for the timing model)
+
+    """
+
+    fqs_red, wgts_red = rr.linBinning(Tmax, 0, 1/Tmax, nmodes_red, 0)
+    fqs_dm, wgts_dm = None, None
+    if incDM:
+        if nmodes_dm is None:
+            nmodes_dm = nmodes_red
+        fqs_dm, wgts_dm = rr.linBinning(Tmax, 0, 1/Tmax, nmodes_dm, 0)
+
+    psr.makeTe(Ttot=Tmax, fqs_red=fqs_red, wgts_red=wgts_red,
+               makeDM=incDM, fqs_dm=fqs_dm, wgts_dm=wgts_dm)
+
+    # same spectra as a --fixRed / --fixDM run of NX01_master
+    Ared = np.max([psr.Redamp, psr.parRedamp])
+    gam_red = np.max([psr.Redind, psr.parRedind])
+    kappa = np.repeat(Ared**2/12/np.pi**2 * f1yr**(gam_red-3) * \
+                      fqs_red**(-gam_red), 2)
+    if incDM:
+        Adm = np.max([psr.DMamp, psr.parDMamp])
+        gam_dm = np.max([psr.DMind, psr.parDMind])
+        kappa = np.append(kappa, np.repeat(Adm**2 * f1yr**(gam_dm-3) * \
+                                           fqs_dm**(-gam_dm), 2))
+
+    T = psr.Te
+    phiinv = np.append(np.zeros(psr.Gc.shape[1]), 1.0/kappa)
+
+    if not noEcorr and psr.ecorrs is not None and len(psr.ecorrs)>0:
+        Jamp = np.ones(len(psr.epflags))
+        for sysname in psr.sysflagdict['nano-f'].keys():
+            Jamp[np.where(psr.epflags==sysname)] *= psr.ecorrs[sysname]**2.0
+
+        T = np.append(T, psr.Umat, axis=1)
+        phiinv = np.append(phiinv, 1.0/Jamp)
+
+    return T, phiinv
+
+
+class FstatPulsar(object):
+    """
+    Fixed-noise quantities of one pulsar needed for the sinusoid
+    projections: N^-1 r, T^T N^-1 T + Phi^-1 (factorized) and its
+    solve against T^T N^-1 r.
+
+    """
+
+    def __init__(self, psr, T, phiinv, tref):
+
+        self.name = psr.name
+        self.t = (psr.toas - tref) * 86400.0
+        self.Nvec = psr.toaerrs**2.0
+        self.T = T
+
+        self.Nr = psr.res / self.Nvec
+        TN = T.T / self.Nvec
+        self.cf = sl.cho_factor(np.dot(TN, T) + np.diag(phiinv))
+        self.Sid = sl.cho_solve(self.cf, np.dot(TN, psr.res))
+
+        # pulsar unit vector
+        ptheta = np.pi/2 - psr.psr_locs[1]
+        pphi = psr.psr_locs[0]
+        self.phat = np.array([np.sin(ptheta)*np.cos(pphi),
+                              np.sin(ptheta)*np.sin(pphi),
+                              np.cos(ptheta)])
+
+    def projections(self, freqs):
+        """
+        Noise-weighted inner products (x|y) = x^T C^-1 y of the residuals
+        with sin and cos(2 pi f t), and between the two, for each GW
+        frequency f. C^-1 is applied through the Woodbury identity.
+
+        @param freqs: GW frequencies [Hz]
+
+        @return: X: [(r|s), (r|c)], (nfreq x 2)
+        @return: Y: [[(s|s), (s|c)], [(c|s), (c|c)]], (nfreq x 2 x 2)
+
+        """
+
+        nf = len(freqs)
+        arg = 2.0*np.pi * np.outer(self.t, freqs)
+        A = np.append(np.sin(arg), np.cos(arg), axis=1)
+        NA = (A.T / self.Nvec).T
+
+        TNA = np.dot(self.T.T, NA)
+        Z = sl.cho_solve(self.cf, TNA)
+
+        rA = np.dot(self.Nr, A) - np.dot(TNA.T, self.Sid)
+
+        def inner(ii, jj):
+            return np.sum(A[:,ii] * NA[:,jj], axis=0) - \
+              np.sum(TNA[:,ii] * Z[:,jj], axis=0)
+
+        s, c = slice(0, nf), slice(nf, 2*nf)
+        ss, sc, cc = inner(s, s), inner(s, c), inner(c, c)
+
+        X = np.array([rA[s], rA[c]]).T
+        Y = np.array([[ss, sc], [sc, cc]]).transpose(2,0,1)
+
+        return X, Y
+
+
+def antennaPatterns(phat, gwtheta, gwphi):
+    """
+    Quadrupolar antenna patterns of all pulsars for a grid of sky
+    locations, with the conventions of NX01_utils.fplus_fcross.
+
+    @param phat: pulsar unit vectors, (npsr x 3)
+    @param gwtheta: polar angles of the GW source [radians]
+    @param gwphi: azimuthal angles of the GW source [radians]
+
+    @return: fplus, fcross, (nsky x npsr)
+
+    """
+
+    cosgwtheta, cosgwphi = np.cos(gwtheta), np.cos(gwphi)
+    singwtheta, singwphi = np.sin(gwtheta), np.sin(gwphi)
+
+    m = np.array([singwphi, -cosgwphi, np.zeros(len(gwphi))]).T
+    n = np.array([-cosgwtheta*cosgwphi, -cosgwtheta*singwphi, singwtheta]).T
+    omhat = np.array([-singwtheta*cosgwphi, -singwtheta*singwphi, -cosgwtheta]).T
+
+    mp, nph, omp = np.dot(m, phat.T), np.dot(n, phat.T), np.dot(omhat, phat.T)
+
+    fplus = 0.5 * (mp**2 - nph**2) / (1+omp)
+    fcross = (mp*nph) / (1+omp)
+
+    return fplus, fcross
+
+
+def fpStat(X, Y):
+    """
+    Incoherent F_p-statistic, sum over pulsars of X^T Y^-1 X / 2.
+
+    @param X: sinusoid projections, (npsr x nfreq x 2)
+    @param Y: sinusoid inner products, (npsr x nfreq x 2 x 2)
+
+    @return: F_p at each frequency
+
+    """
+
+    YiX = np.linalg.solve(Y, X[...,None])[...,0]
+
+    return 0.5 * np.sum(X * YiX, axis=(0,2))
+
+
+def feStat(X, Y, fplus, fcross):
+    """
+    Coherent Earth-term F_e-statistic, N^T M^-1 N / 2, for every
+    frequency and sky location. The four amplitudes multiply
+    F+ sin, F+ cos, Fx sin and Fx cos.
+
+    @param X: sinusoid projections, (npsr x nfreq x 2)
+    @param Y: sinusoid inner products, (npsr x nfreq x 2 x 2)
+    @param fplus: antenna patterns, (nsky x npsr)
+    @param fcross: antenna patterns, (nsky x npsr)
+
+    @return: F_e, (nfreq x nsky)
+
+    """
+
+    N = np.append(np.einsum('ka,afi->fki', fplus, X),
+                  np.einsum('ka,afi->fki', fcross, X), axis=2)
+
+    Mpp = np.einsum('ka,afij->fkij', fplus**2, Y)
+    Mpc = np.einsum('ka,afij->fkij', fplus*fcross, Y)
+    Mcc = np.einsum('ka,afij->fkij', fcross**2, Y)
+    M = np.append(np.append(Mpp, Mpc, axis=3),
+                  np.append(Mpc, Mcc, axis=3), axis=2)
+
+    MiN = np.linalg.solve(M, N[...,None])[...,0]
+
+    return 0.5 * np.sum(N * MiN, axis=2)
+
+
+# pulsars and sky grid of a scan, inherited by forked workers
+scan_data = {}
+
+def fstatChunk(freqs):
+    """
+    F_e over the sky grid and F_p for a chunk of frequencies,
+    using the pulsars and sky grid in scan_data.
+
+    """
+
+    proj = [sp.projections(freqs) for sp in scan_data['psrs']]
+    X = np.array([pp[0] for pp in proj])
+    Y = np.array([pp[1] for pp in proj])
+
+    return feStat(X, Y, scan_data['fplus'], scan_data['fcross']), fpStat(X, Y)
+
+
+def fstatScan(fpsrs, freqs, gwtheta, gwphi, nproc=1, chunk=32):
+    """
+    F_e and F_p over a (frequency x sky) grid.
+
+    @param fpsrs: list of FstatPulsar objects
+    @param freqs: GW frequencies [Hz]
+    @param gwtheta: polar angles of the sky grid [radians]
+    @param gwphi: azimuthal angles of the sky grid [radians]
+    @param nproc: number of processes, each taking chunks of frequencies
+    @param chunk: number of frequencies per chunk
+
+    @return: F_e (nfreq x nsky), F_p (nfreq)
+
+    """
+
+    phat = np.array([sp.phat for sp in fpsrs])
+
+    scan_data['psrs'] = fpsrs
+    scan_data['fplus'], scan_data['fcross'] = antennaPatterns(phat, gwtheta, gwphi)
+
+    chunks = [freqs[ii:ii+chunk] for ii in range(0, len(freqs), chunk)]
+
+    if nproc > 1:
+        pool = Pool(nproc)
+        out = pool.map(fstatChunk, chunks)
+        pool.close()
+        pool.join()
+    else:
+        out = [fstatChunk(cc) for cc in chunks]
+
+    Fe = np.concatenate([oo[0] for oo in out], axis=0)
+    Fp = np.concatenate([oo[1] for oo in out])
+
+    return Fe, Fp
+
+
+if __name__ == '__main__':
+
+    parser = optparse.OptionParser(description = "NX01 - F-statistic scan for continuous GWs")
+
+    parser.add_option('--psrlist', dest='psrlist', action='store', type=str, default=None,
+                      help='Provide path to file containing list of pulsars and their respective hdf5 files (default = None)')
+    parser.add_option('--psrStartIndex', dest='psrStartIndex', action='store', type=int, default=0,
+                      help='From your pulsar list, which pulsar index do you want to start with? (default = 0)')
+    parser.add_option('--psrEndIndex', dest='psrEndIndex', action='store', type=int, default=18,
+                      help='From your pulsar list, which pulsar index do you want to end with? (default = 18)')
+    parser.add_option('--psrIndices', dest='psrIndices', action='store', type=str, default=None,
+                      help='Provide a sequence of indices from your pulsar list as a comma delimited string (default = None)')
+    parser.add_option('--sysflag_target', dest='sysflag_target', action='store', type=str, default=None,
+                      help='If you are supplying pulsar noise files, then specify which system flag you want to target (default = None)')
+    parser.add_option('--nmodes', dest='nmodes', action='store', type=int, default=30,
+                      help='Number of red-noise Fourier modes (default = 30)')
+    parser.add_option('--incDM', dest='incDM', action='store_true', default=False,
+                      help='Do you want to include DM variations in the noise model? (default = False)')
+    parser.add_option('--noEcorr', dest='noEcorr', action='store_true', default=False,
+                      help='Do you want to ignore correlated white noise terms in noise matrix? (default = False)')
+    parser.add_option('--fmin', dest='fmin', action='store', type=float, default=None,
+                      help='Lowest GW frequency in Hz (default = 1/Tspan)')
+    parser.add_option('--fmax', dest='fmax', action='store', type=float, default=1e-7,
+                      help='Highest GW frequency in Hz (default = 1e-7)')
+    parser.add_option('--oversample', dest='oversample', action='store', type=float, default=2.0,
+                      help='Frequency spacing is 1/(oversample*Tspan) (default = 2)')
+    parser.add_option('--nsky', dest='nsky', action='store', type=int, default=16,
+                      help='Number of cos(theta) bins in the sky grid, with twice as many in phi (default = 16)')
+    parser.add_option('--nproc', dest='nproc', action='store', type=int, default=1,
+                      help='Number of processes over which to spread frequency chunks (default = 1)')
+    parser.add_option('--chunk', dest='chunk', action='store', type=int, default=32,
+                      help='Number of frequencies per chunk (default = 32)')
+    parser.add_option('--dirExt', dest='dirExt', action='store', type=str, default='./fstat_results/',
+                      help='Where do you want to put the results? (default = ./fstat_results/)')
+
+    (args, x) = parser.parse_args()
+
+    psr_pathinfo = np.genfromtxt(args.psrlist, dtype=str, skip_header=2)
+
+    if args.psrIndices is not None:
+        psr_inds = [int(item) for item in args.psrIndices.split(',')]
+    else:
+        psr_inds = range(args.psrStartIndex, args.psrEndIndex)
+
+    psr = [NX01_psr.PsrObjFromH5(h5.File(psr_pathinfo[ii,1], 'r')[psr_pathinfo[ii,0]])
+           for ii in psr_inds]
+    [p.grab_all_vars(rescale=True, sysflag_target=args.sysflag_target) for p in psr]
+
+    tref = np.min([p.toas.min() for p in psr])
+    Tmax = (np.max([p.toas.max() for p in psr]) - tref) * 86400.0
+
+    fpsrs = []
+    for p in psr:
+        T, phiinv = noiseModel(p, Tmax, args.nmodes, incDM=args.incDM,
+                               noEcorr=args.noEcorr)
+        fpsrs.append(FstatPulsar(p, T, phiinv, tref))
+
+    fmin = args.fmin if args.fmin is not None else 1/Tmax
+    freqs = np.arange(fmin, args.fmax, 1/(args.oversample*Tmax))
+
+    costh = -1.0 + (np.arange(args.nsky) + 0.5) * 2.0 / args.nsky
+    phi = (np.arange(2*args.nsky) + 0.5) * np.pi / args.nsky
+    gwtheta = np.repeat(np.arccos(costh), len(phi))
+    gwphi = np.tile(phi, len(costh))
+
+    print "\n Scanning {0} frequencies x {1} sky locations for {2} pulsars\n".format(len(freqs),
+                                                                                   len(gwphi),
+                                                                                   len(psr))
+    tstart = time.time()
+    Fe, Fp = fstatScan(fpsrs, freqs, gwtheta, gwphi, nproc=args.nproc, chunk=args.chunk)
+    print "\n Done in {0} seconds\n".format(time.time() - tstart)
+
+    if not os.path.exists(args.dirExt):
+        os.makedirs(args.dirExt)
+
+    best = np.argmax(Fe, axis=1)
+    np.savetxt(args.dirExt+'/fstat.txt',
+               np.column_stack((freqs, Fe[np.arange(len(freqs)),best],
+                                gwtheta[best], gwphi[best], Fp)),
+               header='freq Fe_max gwtheta gwphi Fp')
+    np.savez(args.dirExt+'/fstat_skymaps.npz', freqs=freqs, gwtheta=gwtheta,
+             gwphi=gwphi, Fe=Fe, Fp=Fp, psrs=[p.name for p in psr])
+
+    jj = np.argmax(Fe[np.arange(len(freqs)),best])
+    print "\n Loudest F_e = {0} at f = {1} Hz, (theta, phi) = ({2}, {3})\n".format(Fe[jj,best[jj]],
+                                                                                   freqs[jj],
+                                                                                   gwtheta[best[jj]],
+                                                                                   gwphi[best[jj]])
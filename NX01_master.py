@@ -37,6 +37,7 @@ import libstempo as T2
 import NX01_AnisCoefficients as anis
 import NX01_utils as utils
 import NX01_psr
+import NX01_datafile
 import rankreduced as rr
 
 try:
@@ -93,6 +94,16 @@ parser.add_option('--from-h5', dest='from_h5', action='store_true', default = Fa
                    help='Do you want to read in pulsars from hdf5 files instead of directly via libstempo? (default = False)')
 parser.add_option('--psrlist', dest='psrlist', action='store', type=str, default = None,
                    help='Provide path to file containing list of pulsars and their respective par/tim paths')
+parser.add_option('--storeCompressed', dest='storeCompressed', action='store', type=str, default = None,
+                   help='Provide path to an hdf5 file in which to store the fixed-white-noise sufficient statistics of each pulsar (default = None)')
+parser.add_option('--fromCompressed', dest='fromCompressed', action='store', type=str, default = None,
+                   help='Provide path to an hdf5 file of compressed pulsars (from --storeCompressed) to start the run from (default = None)')
+parser.add_option('--wnCache', dest='wnCache', action='store', type=str, default = None,
+                   help='Provide path to an hdf5 file used as a persistent cache of basis matrices and white-noise products across runs (default = None)')
+parser.add_option('--outOfCore', dest='outOfCore', action='store_true', default = False,
+                   help='Do you want to accumulate the white-noise products from hdf5 in chunks of TOAs, without holding the full basis in memory? (default = False)')
+parser.add_option('--oocChunk', dest='oocChunk', action='store', type=int, default = 10000,
+                   help='Approximate number of TOAs per chunk when using --outOfCore (default = 10000)')
 parser.add_option('--sysflag_target', dest='sysflag_target', action='store', type=str, default = 'f',
                    help='If you are supplying pulsar noise files, then specify which system flag you want to target (default = f)')
 parser.add_option('--parfile', dest='parfile', action='store', type=str, default = None,
@@ -233,6 +244,10 @@ parser.add_option('--use_gpu', dest='use_gpu', action='store_true', default=Fals
                   help='Do you want to use the GPU for accelerated linear algebra? (default = False)')
 parser.add_option('--sparse_cholesky', dest='sparse_cholesky', action='store_true', default=False,
                   help='Do you want to use a sparse cholesky solver? (default = False)')
+parser.add_option('--margTM', dest='margTM', action='store_true', default=False,
+                  help='Do you want to analytically project out the timing model before factorizing Sigma? (default = False)')
+parser.add_option('--cacheFactors', dest='cacheFactors', action='store_true', default=False,
+                  help='Do you want to reuse Sigma factorizations (per pulsar, or of the whole array in correlated runs) when their parameters have not changed? (default = False)')
 parser.add_option('--fix_slope', dest='fix_slope', action='store', type=float, default=None,
                   help='Do you want to fix the slope of the GWB spectrum? (default = None)')
 parser.add_option('--gwbAmpRange', dest='gwbAmpRange', action='store', type=str, default=None,
@@ -287,6 +302,16 @@ parser.add_option('--bwm_search', dest='bwm_search', action='store_true', defaul
                   help='Do you want to search for GW burst with memory (BWM)? (default = False)')
 parser.add_option('--bwm_antenna', dest='bwm_antenna', action='store', type=str, default='quad',
                   help='What kind of antenna pattern do you want to use for a BWM? (default = quad)')
+parser.add_option('--bwmScan', dest='bwmScan', action='store_true', default=False,
+                  help='Do you want to scan BWM burst epochs with a detection statistic at fixed noise, instead of sampling? (default = False)')
+parser.add_option('--bwmScanEpochs', dest='bwmScanEpochs', action='store', type=int, default=1000,
+                  help='How many trial burst epochs do you want in the BWM scan? (default = 1000)')
+parser.add_option('--bwmScanSky', dest='bwmScanSky', action='store', type=int, default=16,
+                  help='How many cos(theta) bins do you want in the BWM-scan sky grid (twice as many in phi)? (default = 16)')
+parser.add_option('--bwmScanPol', dest='bwmScanPol', action='store', type=int, default=8,
+                  help='How many polarization angles do you want in the BWM scan? (default = 8)')
+parser.add_option('--bwmScanHmax', dest='bwmScanHmax', action='store', type=float, default=1e-11,
+                  help='Upper limit of the uniform BWM strain prior in the marginalized scan statistic (default = 1e-11)')
 parser.add_option('--bwm_model_select', dest='bwm_model_select', action='store_true', default=False,
                   help='Do you want to compute the Bayes Factor for BWM+noise versus noise-only? (default = False)')
 parser.add_option('--cgw_search', dest='cgw_search', action='store_true', default=False,
@@ -299,8 +324,18 @@ parser.add_option('--ecc_search', dest='ecc_search', action='store_true', defaul
                   help='Do you want to search for an eccentric binary? (default = False)')
 parser.add_option('--epochTOAs', dest='epochTOAs', action='store_true', default=False,
                   help='Do you want to compute CGW waveforms with the averaged TOAs? (default = False)')
+parser.add_option('--epochProject', dest='epochProject', action='store_true', default=False,
+                  help='With --epochTOAs, project the noise-weighted basis onto the epochs so that CGW and physical-ephemeris signals are never expanded to the TOAs? (default = False)')
 parser.add_option('--psrTerm', dest='psrTerm', action='store_true', default=False,
                   help='Do you want to include the pulsar term in the continuous wave search? (default = False)')
+parser.add_option('--cgwEvolveTable', dest='cgwEvolveTable', action='store_true', default=False,
+                  help='Do you want to look up the pulsar-term binary evolution from a table instead of solving the ODEs? (default = False)')
+parser.add_option('--cgwFreqEvolve', dest='cgwFreqEvolve', action='store_true', default=False,
+                  help='Do you want circular binaries to chirp across the TOAs? (default = False)')
+parser.add_option('--cgwMargPhase', dest='cgwMargPhase', action='store_true', default=False,
+                  help='Do you want to integrate the pulsar-term phases out of the likelihood instead of sampling them? (default = False)')
+parser.add_option('--cgwMargPhaseGrid', dest='cgwMargPhaseGrid', action='store', type=int, default=64,
+                  help='Number of phase samples in the pulsar-term phase integral (default = 64)')
 parser.add_option('--periEv', dest='periEv', action='store_true', default=False,
                   help='Do you want to model the binary periapsis evolution? (default = False)')
 parser.add_option('--cgwPrior', dest='cgwPrior', action='store', type=str, default='uniform',
@@ -337,6 +372,8 @@ parser.add_option('--eph_dirichlet_alpha', dest='eph_dirichlet_alpha', action='s
                   help='What value of the dirichlet concentration do you want to use? (default = 1.0)')
 parser.add_option('--eph_physmodel', dest='eph_physmodel', action='store_true', default=False,
                   help='Do you want to use frame rotation, Jupiter+Saturn+Uranus+Neptune mass perturbations, and Jupiter orbit perturbation? (default = False)')
+parser.add_option('--ephPhysLinear', dest='ephPhysLinear', action='store_true', default=False,
+                  help='Use the precomputed, linearized physical ephemeris model instead of evaluating it exactly? (default = False)')
 parser.add_option('--incJuporb', dest='incJuporb', action='store_true', default=False,
                   help='Include Jupiter orbital perturbations in solar-system ephemeris physical model? (default = False)')
 parser.add_option('--jup_orbmodel', dest='jup_orbmodel', action='store', type=str, default='orbelements',
@@ -353,6 +390,14 @@ parser.add_option('--eph_roemermix_dx', dest='eph_roemermix_dx', action='store_t
                   help='Do you want to include an arbitrarily-weighted mixture of Roemer delay offsets from the mean? (default = False)')
 parser.add_option('--eph_de_rotated', dest='eph_de_rotated', action='store_true', default=False,
                   help='Do you want to use the rotated ephemerides for consistent ICRF? (default = False)')
+parser.add_option('--linearDetSig', dest='linearDetSig', action='store_true', default=False,
+                  help='Do you want to precompute the noise-weighted projections of linear deterministic signals (eph_quadratic, eph_planetmass, eph_roemermix[_dx])? (default = False)')
+parser.add_option('--margEphLinear', dest='margEphLinear', action='store_true', default=False,
+                  help='Do you want to analytically marginalize over the eph_quadratic and eph_roemermix[_dx] parameters with Gaussian priors? (default = False)')
+parser.add_option('--ephQuadPriorSig', dest='ephQuadPriorSig', action='store', type=float, default=1e-8,
+                  help='Standard deviation of the Gaussian prior on the marginalized eph_quadratic amplitudes (default = 1e-8)')
+parser.add_option('--ephRoemerPriorSig', dest='ephRoemerPriorSig', action='store', type=float, default=1.0,
+                  help='Standard deviation of the Gaussian prior on the marginalized Roemer-mixture weights (default = 1.0)')
 parser.add_option('--incGWline', dest='incGWline', action='store_true', default=False,
                   help='Do you want to include a single-frequency line in the GW spectrum? (default = False)')
 parser.add_option('--gwlinePrior', dest='gwlinePrior', action='store', type=str, default='uniform',
@@ -478,7 +523,6 @@ if args.use_gpu:
     culinalg.init()
 
 if args.sparse_cholesky:
-    import scipy.sparse as sps
     import sksparse.cholmod as sks
 
 if args.sampler == 'mnest':
@@ -497,7 +541,32 @@ if args.psrlist is not None:
     # name, hdf5-path, par-path, tim-path
     psr_pathinfo = np.genfromtxt(args.psrlist, dtype=str, skip_header=2)
 
-if args.from_h5:
+if args.storeCompressed is not None and not args.from_h5:
+    raise ValueError("Compressed pulsars are checked against their hdf5 files "
+                     "when read back: --storeCompressed needs --from-h5")
+
+if args.fromCompressed is not None:
+
+    if args.varyWhite or args.det_signal or args.pshift or args.outOfCore or \
+      args.bwmScan or args.epochTOAs or args.epochProject:
+        raise ValueError("Compressed pulsars only hold fixed-white-noise products, "
+                         "not the TOAs: cannot use with varyWhite, det_signal, pshift, "
+                         "outOfCore, bwmScan, epochTOAs or epochProject")
+
+    tmp_psr = []
+    compressed_file = h5.File(args.fromCompressed, 'r')
+
+    if args.psrIndices is not None:
+        psr_inds = [int(item) for item in args.psrIndices.split(',')]
+    else:
+        psr_inds = range(args.psrStartIndex,args.psrEndIndex)
+
+    for tmp_name in psr_pathinfo[psr_inds,0]:
+        tmp_psr.append(compressed_file[tmp_name])
+
+    psr = [NX01_psr.PsrObjCompressed(p) for p in tmp_psr]
+
+elif args.from_h5:
 
     tmp_psr = []
 
@@ -516,6 +585,9 @@ if args.from_h5:
 
 else:
 
+    if args.outOfCore:
+        raise ValueError("Out-of-core accumulation needs pulsars from hdf5 files")
+
     print 'Are you sure you do not want to use hdf5 files (recommended)?'
     ## Performing a single pulsar analysis
 
@@ -553,7 +625,8 @@ if args.psrlist is not None:
     if args.varyWhite:
         [p.grab_all_vars(rescale=False, sysflag_target=args.sysflag_target) for p in psr]
     elif not args.varyWhite:
-        [p.grab_all_vars(rescale=True, sysflag_target=args.sysflag_target) for p in psr]
+        [p.grab_all_vars(rescale=True, sysflag_target=args.sysflag_target,
+                         lowmem=args.outOfCore) for p in psr]
 elif args.parfile is not None and args.timfile is not None:
     [p.grab_all_vars(jitterbin=args.jitterbin, makeGmat=False,
                      fastDesign=not(args.svdDesign), planetssb=args.grab_planets) for p in psr]
@@ -794,12 +867,19 @@ if args.incDip and args.incCorr:
 # GETTING MAXIMUM TIME, COMPUTING FOURIER DESIGN MATRICES, AND GETTING MODES
 #############################################################################
 
+if args.fromCompressed is not None:
+    # compressed pulsars only keep their first and last TOA
+    toa_first = np.array([p.tmin for p in psr])
+    toa_last = np.array([p.tmax for p in psr])
+else:
+    toa_first = np.array([p.toas.min() for p in psr])
+    toa_last = np.array([p.toas.max() for p in psr])
+
 if args.TmaxType == 'pta':
-    Tmax = np.max([p.toas.max() for p in psr]) - \
-      np.min([p.toas.min() for p in psr])
+    Tmax = np.max(toa_last) - np.min(toa_first)
     Tmax *= 86400.0
 else:
-    Tmax = np.max([p.toas.max() - p.toas.min() for p in psr])
+    Tmax = np.max(toa_last - toa_first)
     Tmax *= 86400.0
 
 ### Define number of red noise modes and set sampling frequencies
@@ -860,6 +940,17 @@ if args.incBand:
     elif args.bands is not None:
         bands = np.array([float(item) for item in args.bands.split(',')])
 
+### Define number of sampled pulsar-term parameters per pulsar
+### (distance, gamma0, l0), or just the distance when the
+### pulsar-term phase is integrated out of the likelihood
+npterm = 3
+if args.cgwMargPhase:
+    if not (args.det_signal and args.cgw_search and args.psrTerm) or \
+      args.ecc_search or args.incCorr or args.epochProject or args.margTM:
+        raise ValueError('--cgwMargPhase needs a circular cgw_search with --psrTerm, '
+                         'and no --incCorr, --epochProject or --margTM')
+    npterm = 1
+
 #############################################################################
 # DEFINING A UNIQUE FILE TAG FOR BOOK-KEEPING
 #############################################################################
@@ -955,6 +1046,8 @@ if args.det_signal:
             file_tag += '_ccgw'+args.cgwPrior+cgwtag
         if args.psrTerm:
             file_tag += 'psrTerm'
+            if args.cgwMargPhase:
+                file_tag += 'MargPhase'
         if args.cgwModelSelect:
             file_tag += 'ModSct'
     if args.bwm_search:
@@ -983,6 +1076,8 @@ if args.det_signal:
         file_tag += '_ephroemermix_dx'
         if args.eph_de_rotated:
             file_tag += '_derotate'
+    if args.margEphLinear:
+        file_tag += 'Marg'
 if args.fixRed:
     red_tag = '_redFix'+'nm{0}'.format(nmodes_red)
 elif not args.fixRed:
@@ -1037,14 +1132,81 @@ elif not args.pshift:
     for ii in range(len(psr)):
         ranphase.append(np.zeros(len(fqs_red)))
 
+### Key identifying the basis and white-noise configuration,
+### used to look up compressed pulsar products
+compress_key = 'Tspan{0:.6e}_fmin{1}_log{2}{3}_red{4}'.format(Tmax, args.fmin,
+                                                              args.logmode, args.nmodes_log,
+                                                              nmodes_red)
+if args.incDM:
+    compress_key += '_dm{0}'.format(nmodes_dm)
+if args.incEph:
+    if args.jplBasis:
+        compress_key += '_ephJPLbasis'
+    elif args.ephFreqs is not None:
+        compress_key += '_ephFreqs'+args.ephFreqs
+    else:
+        compress_key += '_eph{0}'.format(nmodes_eph)
+if args.incClk and args.clkDesign:
+    compress_key += '_clkDesign'
+if args.incBand:
+    compress_key += '_band{0}_'.format(nmodes_band) + \
+      '-'.join([str(item) for item in bands])
+compress_key += '_sys'+args.sysflag_target
+if args.noEcorr:
+    compress_key += '_noEcorr'
+
+if args.outOfCore and (args.varyWhite or args.det_signal):
+    raise ValueError("Out-of-core accumulation only provides fixed-white-noise products: "
+                     "cannot use with varyWhite or det_signal")
+
+### Look up products from previous runs with identical inputs
+use_wnCache = args.wnCache is not None and args.fromCompressed is None \
+  and not args.outOfCore
+wn_cache_keys = [None for p in psr]
+wn_cached = [None for p in psr]
+if use_wnCache:
+    wn_cache = NX01_datafile.DataFile(args.wnCache)
+    for ii,p in enumerate(psr):
+        wn_cache_keys[ii] = utils.whiteNoiseHash(p, compress_key, ranphase[ii])
+        wn_cached[ii] = wn_cache.getCacheProducts(wn_cache_keys[ii])
+        if wn_cached[ii] is not None:
+            print 'Reading cached products for {0}...'.format(p.name)
+
 ### Make the basis matrices for all rank-reduced processes in model
-[p.makeTe(Ttot=Tmax, fqs_red=fqs_red, wgts_red=wgts_red,
-          makeDM=args.incDM, fqs_dm=fqs_dm, wgts_dm=wgts_dm,
-          makeEph=args.incEph, jplBasis=args.jplBasis,
-          fqs_eph=fqs_eph, wgts_eph=wgts_eph, ephFreqs=args.ephFreqs,
-          makeClk=args.incClk, clkDesign=args.clkDesign,
-          makeBand=args.incBand, bands=args.bands,
-          phaseshift=args.pshift, pshift_vals=ranphase[ii]) for ii,p in enumerate(psr)]
+### (out-of-core runs build them chunk by chunk further down)
+if args.fromCompressed is None and not args.outOfCore:
+    for ii,p in enumerate(psr):
+        if wn_cached[ii] is not None:
+            p.Te = wn_cached[ii]['Te']
+        else:
+            p.makeTe(Ttot=Tmax, fqs_red=fqs_red, wgts_red=wgts_red,
+                     makeDM=args.incDM, fqs_dm=fqs_dm, wgts_dm=wgts_dm,
+                     makeEph=args.incEph, jplBasis=args.jplBasis,
+                     fqs_eph=fqs_eph, wgts_eph=wgts_eph, ephFreqs=args.ephFreqs,
+                     makeClk=args.incClk, clkDesign=args.clkDesign,
+                     makeBand=args.incBand, bands=args.bands,
+                     phaseshift=args.pshift, pshift_vals=ranphase[ii])
+            if use_wnCache and rank == 0:
+                try:
+                    wn_cache.addCacheProducts(wn_cache_keys[ii], {'Te': p.Te})
+                except IOError:
+                    print 'Could not write to cache {0}'.format(args.wnCache)
+elif args.fromCompressed is not None:
+    # check the stored noise values, phase shifts and data digest
+    # against the pulsar files, reading only their meta-data
+    for ii,jj in enumerate(psr_inds):
+        with h5.File(psr_pathinfo[jj,1], 'r') as psr_file:
+            src_psr = NX01_psr.PsrObjFromH5(psr_file[psr_pathinfo[jj,0]])
+            src_psr.grab_noise_vars()
+            psr[ii].grab_compressed_vars(compress_key, src_psr,
+                                         pshift_vals=ranphase[ii])
+    compressed_file.close()
+
+### Number of timing-model columns in the basis of each pulsar
+if args.fromCompressed is not None:
+    psr_ntm = [p.ntm for p in psr]
+else:
+    psr_ntm = [p.Gc.shape[1] for p in psr]
 
 if args.det_signal:
     # find reference time for all pulsars
@@ -1167,20 +1329,60 @@ if not args.varyWhite:
     TtNT = []
     d = []
     Jamp = []
+    tm_proj = []
     for ii,p in enumerate(psr):
 
         # compute ( T.T * N^-1 * T )
         # & log determinant of N
-        new_err = (p.toaerrs).copy()
-        if not args.noEcorr:
-
-            if p.ecorrs is not None and len(p.ecorrs)>0:
+        if args.fromCompressed is None:
+            new_err = (p.toaerrs).copy()
 
+            if not args.noEcorr and p.ecorrs is not None and len(p.ecorrs)>0:
                 Jamp.append(np.ones(len(p.epflags)))
                 for jj,nano_sysname in enumerate(p.sysflagdict['nano-f'].keys()):
                     Jamp[ii][np.where(p.epflags==nano_sysname)] *= \
                       p.ecorrs[nano_sysname]**2.0
 
+        if args.fromCompressed is not None:
+
+            # products were stored by an earlier run (--storeCompressed)
+            TtNT.append(p.TtNT)
+            d.append(p.d)
+            logdet_N.append(p.logdet_N)
+            dtNdt = p.dtNdt
+
+        elif wn_cached[ii] is not None and 'TtNT' in wn_cached[ii]:
+
+            # products were cached by an earlier run (--wnCache)
+            TtNT.append(wn_cached[ii]['TtNT'])
+            d.append(wn_cached[ii]['d'])
+            logdet_N.append(wn_cached[ii]['logdet_N'])
+            dtNdt = wn_cached[ii]['dtNdt']
+
+        elif args.outOfCore:
+
+            if not args.noEcorr and p.ecorrs is not None and len(p.ecorrs)>0:
+                Jamp_ooc = Jamp[ii]
+            else:
+                Jamp_ooc = None
+
+            TtNT_dummy, d_dummy, logdet_N_dummy, dtNdt = \
+              p.accumulateTtNT(Jamp=Jamp_ooc, chunksize=args.oocChunk,
+                               Ttot=Tmax, fqs_red=fqs_red, wgts_red=wgts_red,
+                               makeDM=args.incDM, fqs_dm=fqs_dm, wgts_dm=wgts_dm,
+                               makeEph=args.incEph, jplBasis=args.jplBasis,
+                               fqs_eph=fqs_eph, wgts_eph=wgts_eph, ephFreqs=args.ephFreqs,
+                               makeClk=args.incClk, clkDesign=args.clkDesign,
+                               makeBand=args.incBand, bands=args.bands,
+                               phaseshift=args.pshift, pshift_vals=ranphase[ii])
+            TtNT.append(TtNT_dummy)
+            d.append(d_dummy)
+            logdet_N.append(logdet_N_dummy)
+
+        elif not args.noEcorr:
+
+            if p.ecorrs is not None and len(p.ecorrs)>0:
+
                 Nx = jitter.cython_block_shermor_0D(p.res, new_err**2.,
                                                     Jamp[ii], p.Uinds)
                 d.append(np.dot(p.Te.T, Nx))
@@ -1223,9 +1425,56 @@ if not args.varyWhite:
 
         loglike1 += -0.5 * (logdet_N[ii] + dtNdt)
 
-    bigTtNT = sl.block_diag(*TtNT)
+        if args.storeCompressed is not None and rank == 0:
+            NX01_datafile.DataFile(args.storeCompressed).addCompressedPulsar(
+                p, compress_key, TtNT[ii], d[ii], logdet_N[ii], dtNdt,
+                pshift_vals=ranphase[ii])
 
-bigTtNT_shape = tuple(np.repeat(np.sum([p.Te.shape[1] for p in psr]), 2))
+        if use_wnCache and rank == 0 and \
+          (wn_cached[ii] is None or 'TtNT' not in wn_cached[ii]):
+            try:
+                wn_cache.addCacheProducts(wn_cache_keys[ii],
+                                          {'TtNT': TtNT[ii], 'd': d[ii],
+                                           'logdet_N': logdet_N[ii], 'dtNdt': dtNdt})
+            except IOError:
+                print 'Could not write to cache {0}'.format(args.wnCache)
+
+        if args.margTM:
+            # condition on the timing model (Schur complement)
+            TtNT[ii], d[ii], lnlike_tm, tm_dummy = \
+              utils.marginalizeTimingModel(TtNT[ii], d[ii], psr_ntm[ii])
+            tm_proj.append(tm_dummy)
+            loglike1 += lnlike_tm
+
+# offset of the stochastic-basis columns in each Sigma block
+if args.margTM:
+    tm_offset = [0 for p in psr]
+elif not args.margTM:
+    tm_offset = list(psr_ntm)
+
+# number of basis columns of each pulsar
+if args.fromCompressed is not None:
+    psr_nbasis = [p.nbasis for p in psr]
+else:
+    psr_nbasis = [p.Te.shape[1] for p in psr]
+
+# block-sparse layout of the correlated Sigma matrix
+sigma_layout = utils.BlockSigma(sizes=[psr_nbasis[ii] - psr_ntm[ii] + tm_offset[ii]
+                                       for ii in range(len(psr))],
+                                offsets=tm_offset,
+                                mode_count=psr_nbasis[0] - psr_ntm[0])
+
+# memory of per-pulsar white-noise products and Sigma factors,
+# and of the correlated Sigma factor (a single entry list)
+if args.cacheFactors:
+    white_cache = utils.PsrFactorCache(len(psr))
+    factor_cache = utils.PsrFactorCache(len(psr))
+    corr_cache = utils.PsrFactorCache(1)
+
+# with --margEphLinear the eph_quadratic and eph_roemermix[_dx]
+# parameters are integrated out of the likelihood, so they are
+# neither sampled nor subtracted from the residuals
+eph_marg_linear = args.margEphLinear
 
 ##########################
 # SETTING UP PRIOR RANGES
@@ -1404,8 +1653,9 @@ if args.det_signal:
         if args.psrTerm:
             # psr distances, pterm-gamm0, pterm-l0
             pmin = np.append(pmin,0.001*np.ones(len(psr)))
-            pmin = np.append(pmin,np.zeros(len(psr)))
-            pmin = np.append(pmin,np.zeros(len(psr)))
+            if not args.cgwMargPhase:
+                pmin = np.append(pmin,np.zeros(len(psr)))
+                pmin = np.append(pmin,np.zeros(len(psr)))
         if args.cgwModelSelect:
             pmin = np.append(pmin,-0.5)
     if args.bwm_search:
@@ -1413,7 +1663,7 @@ if args.det_signal:
                                -18.0,0.0,-1.0,0.0])
         if args.bwm_model_select:
             pmin = np.append(pmin,-0.5)
-    if args.eph_quadratic:
+    if args.eph_quadratic and not eph_marg_linear:
         pmin = np.append(pmin,-1e-8*np.ones(9)) # amps
         #pmin = np.append(pmin,np.tile([-10.0,-10.0],3)) # amps
         #pmin = np.append(pmin,np.tile([-1.0,-1.0],3)) # signs
@@ -1455,7 +1705,7 @@ if args.det_signal:
         else:
             num_ephs = len(args.which_ephs.split(','))
             ephnames = args.which_ephs.split(',')
-        if num_ephs > 1:
+        if num_ephs > 1 and not eph_marg_linear:
             pmin = np.append(pmin,np.zeros(num_ephs-1)) # weights
     elif args.eph_physmodel:
         # mass priors are 10x larger than IAU uncertainties
@@ -1488,7 +1738,7 @@ if args.det_signal:
         else:
             num_ephs = len(args.which_ephs.split(','))
             ephnames = args.which_ephs.split(',')
-        if num_ephs > 1:
+        if num_ephs > 1 and not eph_marg_linear:
             pmin = np.append(pmin,-50.0*np.ones(num_ephs)) # weights
 
 
@@ -1631,8 +1881,9 @@ if args.det_signal:
         if args.psrTerm:
             # psr distances, pterm-gamma0, pterm-l0
             pmax = np.append(pmax,10.0*np.ones(len(psr)))
-            pmax = np.append(pmax,2.0*np.pi*np.ones(len(psr)))
-            pmax = np.append(pmax,2.0*np.pi*np.ones(len(psr)))
+            if not args.cgwMargPhase:
+                pmax = np.append(pmax,2.0*np.pi*np.ones(len(psr)))
+                pmax = np.append(pmax,2.0*np.pi*np.ones(len(psr)))
         if args.cgwModelSelect:
             pmax = np.append(pmax,1.5)
     if args.bwm_search:
@@ -1640,7 +1891,7 @@ if args.det_signal:
                                -11.0,2.0*np.pi,1.0,np.pi])
         if args.bwm_model_select:
             pmax = np.append(pmax,1.5)
-    if args.eph_quadratic:
+    if args.eph_quadratic and not eph_marg_linear:
         pmax = np.append(pmax,1e-8*np.ones(9)) # amps
         #pmax = np.append(pmax,np.tile([0.0,0.0],3)) # amps
         #pmax = np.append(pmax,np.tile([1.0,1.0],3)) # signs
@@ -1659,7 +1910,7 @@ if args.det_signal:
         if args.eph_planetoffset:
             pmax = np.append(pmax,1e8*np.ones(3*num_planets)) # x,y,z displacements [km]
     elif args.eph_roemermix:
-        if num_ephs > 1:
+        if num_ephs > 1 and not eph_marg_linear:
             pmax = np.append(pmax,np.ones(num_ephs-1)) # weights
     elif args.eph_physmodel:
         # mass priors are 10x larger than IAU uncertainties
@@ -1678,7 +1929,7 @@ if args.det_signal:
             elif args.sat_orbmodel == 'orbelements':
                 pmax = np.append(pmax,5e-1*np.ones(6))
     elif args.eph_roemermix_dx:
-        if num_ephs > 1:
+        if num_ephs > 1 and not eph_marg_linear:
             pmax = np.append(pmax,50.0*np.ones(num_ephs)) # weights
 
 ##################################################################################
@@ -1713,6 +1964,129 @@ if ((args.det_signal and args.eph_roemermix and args.eph_de_rotated) or
 
 ##################################################################################
 
+## Projections of each planet's SSB position onto the pulsar direction,
+## (nTOA x nplanet x neph) per pulsar, for the planet-mass perturbations
+if args.det_signal and args.eph_planetdelta and args.eph_planetmass:
+
+    planet_proj = []
+    for ii,p in enumerate(psr):
+        planet_proj.append(np.array([np.einsum('tpj,tj->tp',
+                                               p.planet_ssb[key][:,planet_tags-1,:3],
+                                               p.psrPos)
+                                     for key in ephnames]).transpose(1,2,0))
+
+##################################################################################
+
+## Deterministic signals that are linear in their parameters,
+## detres = res + c + B * a, only need the noise-weighted
+## projections of c and B. Precompute those once.
+if args.linearDetSig and args.margEphLinear:
+    raise ValueError('--linearDetSig and --margEphLinear are exclusive')
+
+if args.linearDetSig:
+
+    if not args.det_signal or args.varyWhite or args.cgw_search or \
+      args.bwm_search or args.eph_physmodel or \
+      (args.eph_planetdelta and (args.eph_planetoffset or not args.eph_planetmass
+                                 or num_ephs > 1)):
+        raise ValueError('--linearDetSig needs fixed white noise and only '
+                         'linear deterministic signals '
+                         '(eph_quadratic, eph_planetmass with one ephemeris, '
+                         'eph_roemermix, eph_roemermix_dx)')
+
+if args.margEphLinear:
+
+    if not args.det_signal or args.varyWhite or args.cgw_search or \
+      args.bwm_search or args.eph_physmodel or args.eph_planetdelta or \
+      args.eph_roemerwgts_fix is not None or args.margTM or args.use_gpu or \
+      not (args.eph_quadratic or args.eph_roemermix or args.eph_roemermix_dx) or \
+      (not args.eph_quadratic and num_ephs == 1):
+        raise ValueError('--margEphLinear needs fixed white noise, no --margTM or --use_gpu, '
+                         'and only eph_quadratic, eph_roemermix or eph_roemermix_dx '
+                         'deterministic signals')
+
+if args.linearDetSig or args.margEphLinear:
+
+    lin_d0 = []
+    lin_TNB = []
+    lin_r0Nr0 = []
+    lin_BNr0 = []
+    lin_BNB = []
+    toa_ct = 0
+    for ii,p in enumerate(psr):
+
+        offset = np.zeros(len(p.toas))
+        basis = []
+
+        if args.eph_quadratic:
+            basis.append(-(ephem_design*ephem_norm)[toa_ct:toa_ct+len(p.toas),:])
+
+        if args.eph_planetdelta:
+            basis.append(-planet_proj[ii][:,:,0])
+
+        elif args.eph_roemermix or args.eph_roemermix_dx:
+            if not args.eph_de_rotated:
+                roemer_fit = p.roemer[p.ephemname]
+                roemers = np.array([p.roemer[key] for key in ephnames])
+            elif args.eph_de_rotated:
+                roemer_fit = psr_roemer_orig[p.name][p.ephemname]
+                roemers = np.array([psr_roemer_rot[p.name][key] for key in ephnames])
+
+            offset -= roemer_fit
+            if args.eph_roemermix_dx or args.margEphLinear:
+                # weights are offsets from the mean Roemer delay,
+                # which is where the marginalization prior is centred
+                roemer_mean = np.mean(roemers,axis=0)
+                offset += roemer_mean
+                roemers -= roemer_mean
+            if not args.margEphLinear or num_ephs > 1:
+                basis.append(roemers.T)
+
+        toa_ct += len(p.toas)
+        basis = np.hstack(basis)
+        res0 = p.res + offset
+
+        # N^-1 applied to the constant part and the signal basis
+        if not args.noEcorr and p.ecorrs is not None and len(p.ecorrs)>0:
+            Nr0 = jitter.cython_block_shermor_0D(res0, p.toaerrs**2.,
+                                                 Jamp[ii], p.Uinds)
+            NB = np.array([jitter.cython_block_shermor_0D(np.ascontiguousarray(bb),
+                                                          p.toaerrs**2.,
+                                                          Jamp[ii], p.Uinds)
+                           for bb in basis.T]).T
+        else:
+            Nr0 = res0 / p.toaerrs**2.0
+            NB = (basis.T / p.toaerrs**2.0).T
+
+        lin_d0.append(np.dot(p.Te.T, Nr0))
+        lin_TNB.append(np.dot(p.Te.T, NB))
+        lin_r0Nr0.append(np.dot(res0, Nr0))
+        lin_BNr0.append(np.dot(basis.T, Nr0))
+        lin_BNB.append(np.dot(basis.T, NB))
+
+## Integrate the linear ephemeris parameters out of the likelihood:
+## they are shared by all pulsars, so they border Sigma as a global
+## block with a Gaussian prior, rather than being sampled.
+if args.margEphLinear:
+
+    lin_phiinv = np.array([])
+    if args.eph_quadratic:
+        lin_phiinv = np.append(lin_phiinv, np.ones(9) / args.ephQuadPriorSig**2.0)
+    if (args.eph_roemermix or args.eph_roemermix_dx) and num_ephs > 1:
+        lin_phiinv = np.append(lin_phiinv, np.ones(num_ephs) / args.ephRoemerPriorSig**2.0)
+
+    # the data now include the constant part of the signal
+    loglike1 = 0
+    for ii,p in enumerate(psr):
+        d[ii] = lin_d0[ii]
+        loglike1 += -0.5 * (logdet_N[ii] + lin_r0Nr0[ii])
+
+    lin_BNB_tot = np.sum(lin_BNB, axis=0)
+    lin_BNr0_tot = np.sum(lin_BNr0, axis=0)
+    lin_TNBstack = np.vstack(lin_TNB)
+
+##################################################################################
+
 ## If epochTOAs, interpolate all planet position vectors onto epoch-averaged TOAs
 if args.eph_physmodel and args.epochTOAs:
 
@@ -1763,6 +2137,185 @@ if args.eph_physmodel:
         sat_mjd = None
         sat_orbelxyz = None
 
+## Jacobian of each pulsar's Roemer-delay perturbation with respect to
+## the physical ephemeris parameters, on the TOAs or epoch-averaged TOAs
+if args.det_signal and args.eph_physmodel and args.ephPhysLinear:
+
+    eph_physjac = []
+    for ii,p in enumerate(psr):
+
+        if args.epochTOAs:
+            mjd_tmp = p.detsig_avetoas.copy()
+            planet_tmp = planet_epochposvecs[ii]
+            psrpos_tmp = psr_epochposvecs[ii]
+        elif not args.epochTOAs:
+            mjd_tmp = p.toas
+            planet_tmp = p.planet_ssb[p.ephemname]
+            psrpos_tmp = p.psrPos
+
+        eph_physjac.append(utils.ssephem_physical_jacobian(mjd_tmp,
+                                                           planet_tmp[:,2,:3], # earth
+                                                           planet_tmp[:,4,:3], # jupiter
+                                                           planet_tmp[:,5,:3], # saturn
+                                                           planet_tmp[:,6,:3], # uranus
+                                                           planet_tmp[:,7,:3], # neptune
+                                                           psrpos_tmp,
+                                                           args.incJuporb, args.jup_orbmodel, jup_orbelxyz, jup_mjd,
+                                                           args.incSatorb, args.sat_orbmodel, sat_orbelxyz, sat_mjd,
+                                                           equatorial=True))
+
+## Epoch index of every TOA, to expand epoch-averaged signals
+if args.det_signal and args.epochTOAs:
+
+    detsig_epind = [utils.ind2epoch(p.detsig_Uinds, len(p.toas)) for p in psr]
+
+## Time-ordering of the TOAs, for the BWM ramps
+if args.det_signal and args.bwm_search:
+
+    bwm_toa_order = [np.argsort(p.toas, kind='mergesort') for p in psr]
+
+## With fixed white noise and only epoch-averaged signals,
+## detres = res - U s, so we only need T^T N^-1 U, U^T N^-1 U
+## and U^T N^-1 r for each pulsar.
+if args.epochProject:
+
+    if not args.det_signal or not args.epochTOAs or args.varyWhite or \
+      args.linearDetSig or args.bwm_search or args.eph_quadratic or \
+      args.eph_planetdelta or args.eph_roemermix or args.eph_roemermix_dx or \
+      not (args.cgw_search or args.eph_physmodel):
+        raise ValueError('--epochProject needs --epochTOAs, fixed white noise '
+                         'and only cgw_search or eph_physmodel deterministic signals')
+
+    ep_d0 = []
+    ep_rNr = []
+    ep_TNU = []
+    ep_UNU = []
+    ep_UNr = []
+    for ii,p in enumerate(psr):
+
+        nep = len(p.detsig_avetoas)
+        ecorr_on = not args.noEcorr and p.ecorrs is not None and len(p.ecorrs)>0
+
+        if ecorr_on:
+            Nr = jitter.cython_block_shermor_0D(p.res, p.toaerrs**2.,
+                                                Jamp[ii], p.Uinds)
+        else:
+            Nr = p.res / p.toaerrs**2.0
+
+        TNU = np.zeros((p.Te.shape[1], nep))
+        UNU = np.zeros((nep, nep))
+        for cc, (start, stop) in enumerate(p.detsig_Uinds):
+            ucol = np.zeros(len(p.toas))
+            ucol[start:stop] = 1.0
+            if ecorr_on:
+                NU = jitter.cython_block_shermor_0D(ucol, p.toaerrs**2.,
+                                                    Jamp[ii], p.Uinds)
+            else:
+                NU = ucol / p.toaerrs**2.0
+            TNU[:,cc] = np.dot(p.Te.T, NU)
+            UNU[:,cc] = np.bincount(detsig_epind[ii], weights=NU, minlength=nep)
+
+        ep_d0.append(np.dot(p.Te.T, Nr))
+        ep_rNr.append(np.dot(p.res, Nr))
+        ep_TNU.append(TNU)
+        ep_UNU.append(UNU)
+        ep_UNr.append(np.bincount(detsig_epind[ii], weights=Nr, minlength=nep))
+
+## Scan a dense grid of BWM burst epochs at fixed noise, as a fast
+## first pass before (or instead of) sampling the burst epoch.
+if args.bwmScan:
+
+    if args.varyWhite or not args.fixRed or (args.incDM and not args.fixDM) or \
+      args.incGWB or args.incGWline or args.incEph or args.incClk or args.incBand or \
+      args.incCm or args.incDip or args.margTM or args.outOfCore or \
+      args.fromCompressed is not None:
+        raise ValueError('--bwmScan needs fixed white noise, --fixRed (and --fixDM), '
+                         'no common or correlated signals, and no --margTM, '
+                         '--outOfCore or --fromCompressed')
+
+    scan_epochs = np.linspace(np.min([p.toas.min() for p in psr]),
+                              np.max([p.toas.max() for p in psr]),
+                              args.bwmScanEpochs)
+
+    scan_ur = []
+    scan_uu = []
+    for ii,p in enumerate(psr):
+
+        # fixed red-noise (and DM) spectrum, as in lnprob
+        Ared_tmp = np.max([p.Redamp, p.parRedamp])
+        gam_red_tmp = np.max([p.Redind, p.parRedind])
+        kappa_tmp = np.repeat(Ared_tmp**2/12/np.pi**2 * f1yr**(gam_red_tmp-3) * \
+                              fqs_red**(-gam_red_tmp), 2)
+        if args.incDM:
+            Adm_tmp = np.max([p.DMamp, p.parDMamp])
+            gam_dm_tmp = np.max([p.DMind, p.parDMind])
+            kappa_tmp = np.append(kappa_tmp,
+                                  np.repeat(Adm_tmp**2 * f1yr**(gam_dm_tmp-3) * \
+                                            fqs_dm**(-gam_dm_tmp), 2))
+
+        phiinv_tmp = np.zeros(TtNT[ii].shape[0])
+        phiinv_tmp[tm_offset[ii]:tm_offset[ii]+len(kappa_tmp)] = 1.0 / kappa_tmp
+        cf = sl.cho_factor(TtNT[ii] + np.diag(phiinv_tmp))
+
+        tnorm = p.toas - p.toas.mean()
+        if not args.noEcorr and p.ecorrs is not None and len(p.ecorrs)>0:
+            Ninv = lambda x: jitter.cython_block_shermor_0D(np.ascontiguousarray(x),
+                                                            p.toaerrs**2.,
+                                                            Jamp[ii], p.Uinds)
+            NT = np.array([Ninv(col) for col in p.Te.T]).T
+        else:
+            Ninv = lambda x: x / p.toaerrs**2.0
+            NT = (p.Te.T / p.toaerrs**2.0).T
+
+        ur_tmp, uu_tmp = utils.bwmRampProducts(p.toas, scan_epochs, Ninv(p.res), NT,
+                                               Ninv(tnorm), Ninv(np.ones(len(p.toas))),
+                                               d[ii], cf)
+        scan_ur.append(ur_tmp)
+        scan_uu.append(uu_tmp)
+
+    # sky and polarization grid
+    scan_costh = -1.0 + (np.arange(args.bwmScanSky) + 0.5) * 2.0 / args.bwmScanSky
+    scan_phi = (np.arange(2*args.bwmScanSky) + 0.5) * np.pi / args.bwmScanSky
+    scan_pol = np.arange(args.bwmScanPol) * np.pi / args.bwmScanPol
+    scan_grid = np.array([[phi, costh, pol] for costh in scan_costh
+                          for phi in scan_phi for pol in scan_pol])
+
+    rajp = np.array([np.ravel(p.psr_locs[0])[0] for p in psr])
+    decjp = np.array([np.ravel(p.psr_locs[1])[0] for p in psr])
+    scan_pols = np.array([utils.BWMantennaPattern(rajp, decjp, phi,
+                                                  np.pi/2-np.arccos(costh), pol)
+                          for phi, costh, pol in scan_grid])
+    if args.bwm_antenna == 'mono':
+        scan_pols = np.ones((1,len(psr)))
+        scan_grid = scan_grid[:1]
+    elif args.bwm_antenna == 'absQuad':
+        scan_pols = np.absolute(scan_pols)
+
+    lnlam_max, best, hbest, lnlam_marg = \
+      utils.bwmScanStatistic(np.array(scan_ur), np.array(scan_uu),
+                             scan_pols, args.bwmScanHmax)
+
+    if rank == 0:
+
+        if args.shortFileTag is not None:
+            dir_name = args.dirExt+args.shortFileTag+'_bwmScan'
+        else:
+            dir_name = args.dirExt+file_tag+'_bwmScan'
+
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+
+        np.savetxt(dir_name+'/bwmscan.txt',
+                   np.column_stack((scan_epochs, lnlam_max, lnlam_marg,
+                                    scan_grid[best], hbest)),
+                   header='epoch lnlam_max lnlam_marg phi costheta pol h')
+
+        jj = np.argmax(lnlam_max)
+        print "\n Loudest BWM epoch: MJD {0}, ln(Lambda) = {1}\n".format(scan_epochs[jj],
+                                                                      lnlam_max[jj])
+
+    sys.exit()
+
 ##################################################################################
 
 def my_prior(xx):
@@ -1788,7 +2341,7 @@ def lnprob(xx):
         TtNT_tmp = list(TtNT)
         Jamp_tmp = list(Jamp)
         logdet_Ntmp = list(logdet_N)
-        bigTtNT_tmp = bigTtNT.copy()
+        tm_proj_tmp = list(tm_proj)
 
     mode_count = 2*nmodes_red
     if args.incDM:
@@ -1983,7 +2536,7 @@ def lnprob(xx):
     ###############################
     # Creating continuous GW signal
 
-    if args.det_signal:
+    if args.det_signal and not eph_marg_linear:
         if args.cgw_search:
             cgw_params = xx[param_ct:param_ct+11]
             param_ct += 11
@@ -1991,8 +2544,8 @@ def lnprob(xx):
                 cgw_params = np.append(cgw_params,xx[param_ct])
                 param_ct += 1
             if args.psrTerm:
-                cgw_params = np.append(cgw_params,xx[param_ct:param_ct+3*len(psr)])
-                param_ct += 3*len(psr)
+                cgw_params = np.append(cgw_params,xx[param_ct:param_ct+npterm*len(psr)])
+                param_ct += npterm*len(psr)
             if args.cgwModelSelect:
                 # '0' is noise-only, '1' is CGW
                 nmodel_cgw = int(np.rint(xx[param_ct]))
@@ -2155,8 +2708,34 @@ def lnprob(xx):
             TtNT_tmp = []
             dtmp = []
             Jamp_tmp = []
+            tm_proj_tmp = []
+            white_keys = []
             for ii,p in enumerate(psr):
 
+                if args.cacheFactors:
+                    # white-noise products only change with this pulsar's
+                    # EFAC, EQUAD and ECORR values
+                    white_key = np.append(EFAC[ii], EQUAD[ii])
+                    if not args.noEcorr and 'nano-f' in p.sysflagdict.keys() \
+                      and len(ECORR[ii])>0:
+                        white_key = np.append(white_key, ECORR[ii])
+                    white_keys.append(white_key)
+
+                    cached = white_cache.get(ii, white_key)
+                    if cached is not None:
+                        jamp_dummy, d_dummy, TtNT_dummy, logdet_N_dummy, \
+                          tm_dummy, loglike_dummy = cached
+                        if jamp_dummy is not None:
+                            Jamp_tmp.append(jamp_dummy)
+                        dtmp.append(d_dummy)
+                        TtNT_tmp.append(TtNT_dummy)
+                        logdet_Ntmp.append(logdet_N_dummy)
+                        if tm_dummy is not None:
+                            tm_proj_tmp.append(tm_dummy)
+                        loglike1_tmp += loglike_dummy
+                        continue
+
+                njamp = len(Jamp_tmp)
                 scaled_err = (p.toaerrs).copy()
                 systems = p.sysflagdict[args.sysflag_target]
                 for jj,sysname in enumerate(systems):
@@ -2220,14 +2799,88 @@ def lnprob(xx):
                     # triple product in likelihood function
                     dtNdt = np.sum(p.res**2.0/( new_err**2.0 ))
 
-                loglike1_tmp += -0.5 * (logdet_Ntmp[ii] + dtNdt)
+                loglike_dummy = -0.5 * (logdet_Ntmp[ii] + dtNdt)
 
+                tm_dummy = None
+                if args.margTM:
+                    # condition on the timing model (Schur complement)
+                    TtNT_tmp[ii], dtmp[ii], lnlike_tm, tm_dummy = \
+                      utils.marginalizeTimingModel(TtNT_tmp[ii], dtmp[ii], p.Gc.shape[1])
+                    tm_proj_tmp.append(tm_dummy)
+                    loglike_dummy += lnlike_tm
 
-        if args.det_signal:
+                loglike1_tmp += loglike_dummy
 
-            detres = []
+                if args.cacheFactors:
+                    if len(Jamp_tmp) > njamp:
+                        jamp_dummy = Jamp_tmp[-1]
+                    else:
+                        jamp_dummy = None
+                    white_cache.put(ii, white_key,
+                                    (jamp_dummy, dtmp[ii], TtNT_tmp[ii],
+                                     logdet_Ntmp[ii], tm_dummy, loglike_dummy))
+
+
+        if args.det_signal and args.linearDetSig:
+
+            # amplitudes of the precomputed linear signal bases
+            lin_amps = []
+            if args.eph_quadratic:
+                lin_amps.append(ephquad_params)
+
+            mass_perturb = None
+            if args.eph_planetdelta:
+                if args.eph_planetmassprior == 'official':
+                    mass_perturb = planet_delta_mass
+                elif args.eph_planetmassprior == 'loguniform':
+                    mass_perturb = np.sign(planet_delta_sign) * 10.0**planet_delta_amp
+                lin_amps.append(mass_perturb)
+
+            elif args.eph_roemermix:
+                if args.eph_roemerwgts_fix is not None:
+                    roemer_wgts = np.array(args.eph_roemerwgts_fix.split(',')).astype(np.float64)
+                    if len(roemer_wgts) != num_ephs:
+                        print 'Supplied ephemeris weights do not match number of ephemerides!'
+                        return -np.inf
+                elif args.eph_roemerwgts_fix is None:
+                    if num_ephs > 1:
+                        roemer_wgts = np.append(roemer_wgts, 1.0 - np.sum(roemer_wgts))
+                    else:
+                        roemer_wgts = [1.0]
+                lin_amps.append(roemer_wgts)
+
+            elif args.eph_roemermix_dx:
+                if num_ephs == 1:
+                    roemer_wgts = [1.0]
+                lin_amps.append(roemer_wgts)
+
+            lin_amps = np.concatenate(lin_amps)
+
+            loglike1_tmp = 0
+            dtNdt = []
             for ii,p in enumerate(psr):
-                detres.append(p.res.copy())
+
+                dtmp[ii] = lin_d0[ii] + np.dot(lin_TNB[ii], lin_amps)
+                dtNdt.append(lin_r0Nr0[ii] + 2.0*np.dot(lin_amps, lin_BNr0[ii]) +
+                             np.dot(lin_amps, np.dot(lin_BNB[ii], lin_amps)))
+
+                loglike1_tmp += -0.5 * (logdet_Ntmp[ii] + dtNdt[ii])
+
+                if args.margTM:
+                    dtmp[ii], dAd = utils.projectTimingModel(dtmp[ii], p.Gc.shape[1],
+                                                             tm_proj_tmp[ii])
+                    loglike1_tmp += -0.5 * tm_proj_tmp[ii][2] + 0.5 * dAd
+
+        elif args.det_signal and not eph_marg_linear:
+
+            detres = []
+            cgw_basis = [None]*npsr
+            if args.epochProject:
+                # epoch-averaged signal, with detres = res - U * epsig
+                epsig = [np.zeros(len(p.detsig_avetoas)) for p in psr]
+            elif not args.epochProject:
+                for ii,p in enumerate(psr):
+                    detres.append(p.res.copy())
 
             if args.cgw_search:
 
@@ -2250,8 +2903,12 @@ def lnprob(xx):
                 if args.psrTerm:
                     pterm_params = cgw_params[binary_params:]
                     psrdists = pterm_params[:npsr]
-                    psrgp0 = pterm_params[npsr:2*npsr]
-                    psrlp0 = pterm_params[2*npsr:]
+                    if args.cgwMargPhase:
+                        psrgp0 = np.array([None]*npsr)
+                        psrlp0 = np.array([None]*npsr)
+                    else:
+                        psrgp0 = pterm_params[npsr:2*npsr]
+                        psrlp0 = pterm_params[2*npsr:]
                 elif not args.psrTerm:
                     psrdists = np.array([None]*npsr)
                     psrgp0 = np.array([None]*npsr)
@@ -2295,6 +2952,33 @@ def lnprob(xx):
                 elif args.cgwPrior == 'mdloguniform':
                     hstrain_tmp = None
 
+                if (args.cgwModelSelect and nmodel_cgw == 1) or not args.cgwModelSelect:
+
+                    # source quantities and Earth term once for the whole array
+                    if ecc_tmp == 0.0:
+                        batch_res = utils.circ_cgw_signal_batch(psr, gwtheta_tmp, gwphi_tmp, mc,
+                                                                dist, hstrain_tmp, orbfreq_tmp,
+                                                                gwinc, gwpol, gwgamma_tmp,
+                                                                l0, qr, pd=psrdists,
+                                                                gpx=psrgp0, lpx=psrlp0,
+                                                                periEv=args.periEv,
+                                                                psrTerm=args.psrTerm, tref=tref,
+                                                                epochTOAs=args.epochTOAs,
+                                                                evolve=args.cgwFreqEvolve,
+                                                                margPhase=args.cgwMargPhase,
+                                                                noEccEvolve=args.noEccEvolve,
+                                                                evolveTable=args.cgwEvolveTable)
+                    elif ecc_tmp != 0.0:
+                        batch_res = utils.ecc_cgw_signal_batch(psr, gwtheta_tmp, gwphi_tmp, mc,
+                                                               dist, hstrain_tmp, orbfreq_tmp,
+                                                               gwinc, gwpol, gwgamma_tmp, ecc_tmp,
+                                                               l0, qr, nmax=10000, pd=psrdists,
+                                                               gpx=psrgp0, lpx=psrlp0,
+                                                               periEv=args.periEv, psrTerm=args.psrTerm,
+                                                               tref=tref, epochTOAs=args.epochTOAs,
+                                                               noEccEvolve=args.noEccEvolve,
+                                                               evolveTable=args.cgwEvolveTable)
+
                 for ii,p in enumerate(psr):
 
                     if args.cgwModelSelect and nmodel_cgw == 0:
@@ -2303,38 +2987,35 @@ def lnprob(xx):
 
                     elif (args.cgwModelSelect and nmodel_cgw == 1) or not args.cgwModelSelect:
 
-                        tmp_res = utils.ecc_cgw_signal(p, gwtheta_tmp, gwphi_tmp, mc,
-                                                    dist, hstrain_tmp, orbfreq_tmp,
-                                                    gwinc, gwpol, gwgamma_tmp, ecc_tmp,
-                                                    l0, qr, nmax=10000, pd=psrdists[ii],
-                                                    gpx=psrgp0[ii], lpx=psrlp0[ii],
-                                                    periEv=args.periEv, psrTerm=args.psrTerm,
-                                                    tref=tref, epochTOAs=args.epochTOAs,
-                                                    noEccEvolve=args.noEccEvolve)
-
-                        if args.epochTOAs:
-                            cgw_res.append(np.ones(len(p.toas)))
-                            for cc, swave in enumerate(tmp_res):
-                                cgw_res[ii][p.detsig_Uinds[cc,0]:p.detsig_Uinds[cc,1]] *= swave
+                        tmp_res = batch_res[ii]
+                        if args.cgwMargPhase:
+                            # only the Earth term is subtracted; the pulsar
+                            # term enters through its phase integral
+                            tmp_res, cgw_basis[ii] = tmp_res
+                            if args.epochTOAs:
+                                cgw_basis[ii] = np.take(cgw_basis[ii], detsig_epind[ii], axis=0)
+
+                        if args.epochProject:
+                            epsig[ii] += tmp_res
+                            cgw_res.append(tmp_res)
+                        elif args.epochTOAs:
+                            cgw_res.append(np.take(tmp_res, detsig_epind[ii]))
                         elif not args.epochTOAs:
                             cgw_res.append(tmp_res)
 
-                    detres[ii] -= cgw_res[ii]
+                    if not args.epochProject:
+                        detres[ii] -= cgw_res[ii]
 
 
             if args.bwm_search:
 
-                bwm_res = []
+                if args.bwm_model_select and nmodel_bwm == 0:
+                    bwm_res = [np.zeros(len(p.toas)) for p in psr]
+                else:
+                    bwm_res = utils.bwmsignal_batch(bwm_params, psr,
+                                                    antennaPattern=args.bwm_antenna,
+                                                    toa_order=bwm_toa_order)
                 for ii,p in enumerate(psr):
-                    if args.bwm_model_select:
-                        if nmodel_bwm == 0:
-                            bwm_res.append( np.zeros(len(p.toas)) )
-                        elif nmodel_bwm == 1:
-                            bwm_res.append( utils.bwmsignal(bwm_params,p,
-                                                            antennaPattern=args.bwm_antenna) )
-                    else:
-                        bwm_res.append( utils.bwmsignal(bwm_params,p,
-                                                        antennaPattern=args.bwm_antenna) )
                     detres[ii] -= bwm_res[ii]
 
             if args.eph_quadratic:
@@ -2368,45 +3049,35 @@ def lnprob(xx):
             mass_perturb = None
             if args.eph_planetdelta:
 
+                if args.eph_planetmass:
+
+                    if args.eph_planetmassprior == 'official':
+                        mass_perturb = np.array(planet_delta_mass)
+                    elif args.eph_planetmassprior == 'loguniform':
+                        mass_perturb = np.sign(planet_delta_sign) * 10.0**planet_delta_amp
+
+                    # per-planet weights of each ephemeris' orbit
+                    if num_ephs > 1:
+                        weights = np.hstack([planet_orbitwgts,
+                                             1.0 - np.sum(planet_orbitwgts,axis=1)[:,None]])
+                    else:
+                        weights = np.ones((num_planets,num_ephs))
+
+                if args.eph_planetoffset:
+                    # Pulsar positions must all be in same frame
+                    planet_offset = np.dot(planet_masses[:num_planets],
+                                           planet_orbitoffsets) * 1e3 / sc.c
+
                 for ii, p in enumerate(psr):
 
                     planet_delta_signal = np.zeros(p.toas.shape)
-                    # sum over planets
-                    dummy_tags = planet_tags - 1
-                    mass_perturb = []
-                    for jj,tag in enumerate(dummy_tags):
-
-                        if args.eph_planetmass:
-
-                            if args.eph_planetmassprior == 'official':
-                                mass_perturb.append(planet_delta_mass[jj])
-                            elif args.eph_planetmassprior == 'loguniform':
-                                mass_perturb.append(np.sign(planet_delta_sign[jj]) * 10.0**planet_delta_amp[jj])
-
-                            if num_ephs > 1:
-                                weights = np.append(planet_orbitwgts[jj,:],
-                                                    1.0 - np.sum(planet_orbitwgts[jj,:]))
-                                planet_posvec = np.zeros((p.toas.shape[0],3))
-                                for kk,key in enumerate(ephnames):
-                                    planet_posvec += weights[kk] * p.planet_ssb[key][:,tag,:3]
-                                planet_delta_signal += (mass_perturb[jj] * \
-                                                            np.array([np.dot(planet_posvec[aa,:], p.psrPos[aa,:]) \
-                                                                        for aa in range(p.toas.shape[0])]))
 
-                            else:
-                                planet_posvec = np.zeros((p.toas.shape[0],3))
-                                for kk,key in enumerate(ephnames):
-                                    planet_posvec += p.planet_ssb[key][:,tag,:3]
-                                planet_delta_signal += (mass_perturb[jj] * \
-                                                            np.array([np.dot(planet_posvec[aa,:], p.psrPos[aa,:]) \
-                                                                        for aa in range(p.toas.shape[0])]))
-
-                        if args.eph_planetoffset:
-                            # Pulsar positions must all be in same frame
-                            planet_offset = planet_orbitoffsets[jj,:] * 1e3 / sc.c
-                            planet_delta_signal += (planet_masses[jj] * \
-                                                            np.array([np.dot(planet_offset[aa,:], p.psrPos[aa,:]) \
-                                                                        for aa in range(p.toas.shape[0])]))
+                    if args.eph_planetmass:
+                        planet_delta_signal += np.einsum('tpk,pk,p->t', planet_proj[ii],
+                                                         weights, mass_perturb)
+
+                    if args.eph_planetoffset:
+                        planet_delta_signal += np.dot(p.psrPos, planet_offset)
 
                     detres[ii] -= planet_delta_signal
 
@@ -2467,7 +3138,11 @@ def lnprob(xx):
 
                 for ii, p in enumerate(psr):
 
-                    if args.epochTOAs:
+                    if args.ephPhysLinear:
+                        # linearized model, from the precomputed Jacobian
+                        tmp_detsig = np.dot(eph_physjac[ii], eph_physmodel_params)
+
+                    elif args.epochTOAs:
                         # first, construct the true geocenter to barycenter roemer
                         tmp_roemer = np.einsum('ij,ij->i',planet_epochposvecs[ii][:,2,:3],psr_epochposvecs[ii])
                         # now construct perturbation from physical model
@@ -2483,11 +3158,6 @@ def lnprob(xx):
                         # subtract off old roemer, add in new one
                         tmp_detsig = np.einsum('ij,ij->i',tmp_earth,psr_epochposvecs[ii]) - tmp_roemer
 
-                        dummy_roemer = np.ones(len(p.toas))
-                        for cc, roemer_perturb in enumerate(tmp_detsig):
-                            dummy_roemer[p.detsig_Uinds[cc,0]:p.detsig_Uinds[cc,1]] *= roemer_perturb
-                        detres[ii] += dummy_roemer
-
                     elif not args.epochTOAs:
                         # first, construct the true geocenter to barycenter roemer
                         tmp_roemer = np.einsum('ij,ij->i',p.planet_ssb[p.ephemname][:,2,:3],p.psrPos)
@@ -2502,8 +3172,14 @@ def lnprob(xx):
                                                                  args.incSatorb, args.sat_orbmodel, sat_orbelxyz, sat_mjd,
                                                                  equatorial=True)
                         # subtract off old roemer, add in new one
-                        detres[ii] -= tmp_roemer
-                        detres[ii] += np.einsum('ij,ij->i',tmp_earth,p.psrPos)
+                        tmp_detsig = np.einsum('ij,ij->i',tmp_earth,p.psrPos) - tmp_roemer
+
+                    if args.epochProject:
+                        epsig[ii] -= tmp_detsig
+                    elif args.epochTOAs:
+                        detres[ii] += np.take(tmp_detsig, detsig_epind[ii])
+                    elif not args.epochTOAs:
+                        detres[ii] += tmp_detsig
 
 
             #############################################################
@@ -2514,47 +3190,79 @@ def lnprob(xx):
             dtNdt = []
             for ii,p in enumerate(psr):
 
-                # compute ( T.T * N^-1 * T )
-                # & log determinant of N
+                if args.epochProject:
 
-                if args.varyWhite:
-                    scaled_err = (p.toaerrs).copy()
-                    systems = p.sysflagdict[args.sysflag_target]
-                    for jj,sysname in enumerate(systems):
-                        scaled_err[systems[sysname]] *= EFAC[ii][jj]
-                    ###
-                    white_noise = np.ones(len(scaled_err))
-                    for jj,sysname in enumerate(systems):
-                        white_noise[systems[sysname]] *= EQUAD[ii][jj]
+                    # the signal never leaves the epochs
+                    dtmp[ii] = ep_d0[ii] - np.dot(ep_TNU[ii], epsig[ii])
+                    dtNdt.append(ep_rNr[ii] - 2.0*np.dot(epsig[ii], ep_UNr[ii]) +
+                                 np.dot(epsig[ii], np.dot(ep_UNU[ii], epsig[ii])))
 
-                    new_err = np.sqrt( scaled_err**2.0 + white_noise**2.0 )
-                elif not args.varyWhite:
-                    new_err = (p.toaerrs).copy()
-
-                if not args.noEcorr:
+                else:
 
-                    if (args.varyWhite and len(ECORR[ii]>0)) or \
-                      (not args.varyWhite and p.ecorrs is not None and len(p.ecorrs)>0):
-                        Nx = jitter.cython_block_shermor_0D(detres[ii], new_err**2.,
+                    # compute ( T.T * N^-1 * T )
+                    # & log determinant of N
+
+                    if args.varyWhite:
+                        scaled_err = (p.toaerrs).copy()
+                        systems = p.sysflagdict[args.sysflag_target]
+                        for jj,sysname in enumerate(systems):
+                            scaled_err[systems[sysname]] *= EFAC[ii][jj]
+                        ###
+                        white_noise = np.ones(len(scaled_err))
+                        for jj,sysname in enumerate(systems):
+                            white_noise[systems[sysname]] *= EQUAD[ii][jj]
+
+                        new_err = np.sqrt( scaled_err**2.0 + white_noise**2.0 )
+                    elif not args.varyWhite:
+                        new_err = (p.toaerrs).copy()
+
+                    if not args.noEcorr:
+
+                        if (args.varyWhite and len(ECORR[ii]>0)) or \
+                          (not args.varyWhite and p.ecorrs is not None and len(p.ecorrs)>0):
+                            Nx = jitter.cython_block_shermor_0D(detres[ii], new_err**2.,
+                                                                Jamp_tmp[ii], p.Uinds)
+                            dtmp[ii] = np.dot(p.Te.T, Nx)
+                            det_dummy, dtNdt_dummy = \
+                            jitter.cython_block_shermor_1D(detres[ii], new_err**2.,
                                                             Jamp_tmp[ii], p.Uinds)
-                        dtmp[ii] = np.dot(p.Te.T, Nx)
-                        det_dummy, dtNdt_dummy = \
-                        jitter.cython_block_shermor_1D(detres[ii], new_err**2.,
-                                                        Jamp_tmp[ii], p.Uinds)
-                        dtNdt.append(dtNdt_dummy)
+                            dtNdt.append(dtNdt_dummy)
+
+                            if cgw_basis[ii] is not None:
+                                NB = np.array([jitter.cython_block_shermor_0D(bb, new_err**2.,
+                                                                              Jamp_tmp[ii], p.Uinds)
+                                               for bb in cgw_basis[ii].T]).T
+
+                        else:
+
+                            dtmp[ii] = np.dot(p.Te.T, detres[ii]/( new_err**2.0 ))
+                            dtNdt.append(np.sum(detres[ii]**2.0/( new_err**2.0 )))
+
+                            if cgw_basis[ii] is not None:
+                                NB = cgw_basis[ii] / (new_err**2.0)[:,None]
 
                     else:
 
                         dtmp[ii] = np.dot(p.Te.T, detres[ii]/( new_err**2.0 ))
                         dtNdt.append(np.sum(detres[ii]**2.0/( new_err**2.0 )))
 
-                else:
+                        if cgw_basis[ii] is not None:
+                            NB = cgw_basis[ii] / (new_err**2.0)[:,None]
 
-                    dtmp[ii] = np.dot(p.Te.T, detres[ii]/( new_err**2.0 ))
-                    dtNdt.append(np.sum(detres[ii]**2.0/( new_err**2.0 )))
+                    if cgw_basis[ii] is not None:
+                        # B^T N^-1 r, B^T N^-1 B and T^T N^-1 B of
+                        # the pulsar-term basis
+                        cgw_basis[ii] = (np.dot(NB.T, detres[ii]),
+                                         np.dot(cgw_basis[ii].T, NB),
+                                         np.dot(p.Te.T, NB))
 
                 loglike1_tmp += -0.5 * (logdet_Ntmp[ii] + dtNdt[ii])
 
+                if args.margTM:
+                    dtmp[ii], dAd = utils.projectTimingModel(dtmp[ii], p.Gc.shape[1],
+                                                             tm_proj_tmp[ii])
+                    loglike1_tmp += -0.5 * tm_proj_tmp[ii][2] + 0.5 * dAd
+
 
         if args.incGWB and args.incCorr:
             ## (option to de-restrict clms by phys prior)... and gwb_modindex==1:
@@ -3608,37 +4316,83 @@ def lnprob(xx):
 
         if not args.incGWB and not args.incGWline and not args.incClk and not args.incDip:
 
+            if args.margEphLinear:
+                lin_CSC = np.zeros(lin_BNB_tot.shape)
+                lin_CSd = np.zeros(lin_BNr0_tot.shape)
+
             for ii,p in enumerate(psr):
 
-                # compute Phi inverse
-                red_phi = np.diag(1./sigdiag[ii])
-                logdet_Phi = np.sum(np.log(sigdiag[ii]))
+                cached = None
+                if args.cacheFactors:
+                    # Sigma only changes with this pulsar's spectrum
+                    # (and white noise, if that is varied)
+                    factor_key = sigdiag[ii]
+                    if args.varyWhite:
+                        factor_key = np.append(factor_key, white_keys[ii])
+                    cached = factor_cache.get(ii, factor_key)
 
-                # now fill in real covariance matrix
-                Phi = np.zeros( TtNT_tmp[ii].shape )
-                for kk in range(0,mode_count):
-                    Phi[kk+p.Gc.shape[1],kk+p.Gc.shape[1]] = red_phi[kk,kk]
+                if cached is None:
 
-                # symmeterize Phi
-                Phi = Phi + Phi.T - np.diag(np.diag(Phi))
+                    # compute Phi inverse
+                    red_phi = np.diag(1./sigdiag[ii])
+                    logdet_Phi = np.sum(np.log(sigdiag[ii]))
 
-                # compute sigma
-                Sigma = TtNT_tmp[ii] + Phi
+                    # now fill in real covariance matrix
+                    Phi = np.zeros( TtNT_tmp[ii].shape )
+                    for kk in range(0,mode_count):
+                        Phi[kk+tm_offset[ii],kk+tm_offset[ii]] = red_phi[kk,kk]
 
-                # cholesky decomp
-                try:
-                    cf = sl.cho_factor(Sigma)
-                    expval2 = sl.cho_solve(cf, dtmp[ii])
-                    logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+                    # symmeterize Phi
+                    Phi = Phi + Phi.T - np.diag(np.diag(Phi))
 
-                except np.linalg.LinAlgError:
+                    # compute sigma
+                    Sigma = TtNT_tmp[ii] + Phi
 
+                    # cholesky decomp
+                    try:
+                        cf = sl.cho_factor(Sigma)
+                        logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+
+                    except np.linalg.LinAlgError:
+
+                        print 'Cholesky Decomposition Failed!!'
+                        return -np.inf
+
+                    cached = [cf, logdet_Phi + logdet_Sigma, None, None]
+                    if args.cacheFactors:
+                        factor_cache.put(ii, factor_key, cached)
+
+                cf, logdet_PhiSigma, dSd = cached[:3]
+                if dSd is None or (args.det_signal and not eph_marg_linear):
+                    # the data vector changes with a deterministic signal
+                    dSd = np.dot(dtmp[ii], sl.cho_solve(cf, dtmp[ii]))
+                    if not args.det_signal or eph_marg_linear:
+                        cached[2] = dSd
+
+                logLike += -0.5 * logdet_PhiSigma + 0.5 * dSd
+
+                if args.cgwMargPhase and cgw_basis[ii] is not None:
+                    BNr, BNB, TNB = cgw_basis[ii]
+                    SiC = sl.cho_solve(cf, TNB)
+                    logLike += utils.marginalizePulsarPhase(BNr - np.dot(SiC.T, dtmp[ii]),
+                                                            BNB - np.dot(TNB.T, SiC),
+                                                            args.cgwMargPhaseGrid)
+
+                if args.margEphLinear:
+                    if cached[3] is None:
+                        SiC = sl.cho_solve(cf, lin_TNB[ii])
+                        cached[3] = (np.dot(lin_TNB[ii].T, SiC), np.dot(SiC.T, dtmp[ii]))
+                    lin_CSC += cached[3][0]
+                    lin_CSd += cached[3][1]
+
+            if args.margEphLinear:
+                try:
+                    logLike += utils.marginalizeLinearSignal(lin_BNB_tot, lin_BNr0_tot,
+                                                             lin_CSC, lin_CSd, lin_phiinv)
+                except np.linalg.LinAlgError:
                     print 'Cholesky Decomposition Failed!!'
                     return -np.inf
 
-                logLike += -0.5 * (logdet_Phi + logdet_Sigma) + \
-                0.5 * (np.dot(dtmp[ii], expval2))
-
             logLike += loglike1_tmp
 
 
@@ -3647,38 +4401,84 @@ def lnprob(xx):
             if not args.incCorr or (args.incCorr and args.incGWB and gwb_modindex==0
                                     and not args.incGWline and not args.incClk and not args.incDip):
 
+                if args.margEphLinear:
+                    lin_CSC = np.zeros(lin_BNB_tot.shape)
+                    lin_CSd = np.zeros(lin_BNr0_tot.shape)
+
                 for ii,p in enumerate(psr):
 
-                    # compute Phi inverse
-                    red_phi = np.diag(1./sigdiag[ii])
-                    logdet_Phi = np.sum(np.log(sigdiag[ii]))
+                    cached = None
+                    if args.cacheFactors:
+                        # Sigma only changes with this pulsar's spectrum
+                        # (and white noise, if that is varied)
+                        factor_key = sigdiag[ii]
+                        if args.varyWhite:
+                            factor_key = np.append(factor_key, white_keys[ii])
+                        cached = factor_cache.get(ii, factor_key)
 
-                    # now fill in real covariance matrix
-                    Phi = np.zeros( TtNT_tmp[ii].shape )
-                    for kk in range(0,mode_count):
-                        Phi[kk+p.Gc.shape[1],kk+p.Gc.shape[1]] = red_phi[kk,kk]
+                    if cached is None:
 
-                    # symmeterize Phi
-                    Phi = Phi + Phi.T - np.diag(np.diag(Phi))
+                        # compute Phi inverse
+                        red_phi = np.diag(1./sigdiag[ii])
+                        logdet_Phi = np.sum(np.log(sigdiag[ii]))
 
-                    # compute sigma
-                    Sigma = TtNT_tmp[ii] + Phi
+                        # now fill in real covariance matrix
+                        Phi = np.zeros( TtNT_tmp[ii].shape )
+                        for kk in range(0,mode_count):
+                            Phi[kk+tm_offset[ii],kk+tm_offset[ii]] = red_phi[kk,kk]
 
-                    # cholesky decomp
-                    try:
+                        # symmeterize Phi
+                        Phi = Phi + Phi.T - np.diag(np.diag(Phi))
 
-                        cf = sl.cho_factor(Sigma)
-                        expval2 = sl.cho_solve(cf, dtmp[ii])
-                        logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+                        # compute sigma
+                        Sigma = TtNT_tmp[ii] + Phi
 
-                    except np.linalg.LinAlgError:
+                        # cholesky decomp
+                        try:
 
+                            cf = sl.cho_factor(Sigma)
+                            logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+
+                        except np.linalg.LinAlgError:
+
+                            print 'Cholesky Decomposition Failed!!'
+                            return -np.inf
+
+                        cached = [cf, logdet_Phi + logdet_Sigma, None, None]
+                        if args.cacheFactors:
+                            factor_cache.put(ii, factor_key, cached)
+
+                    cf, logdet_PhiSigma, dSd = cached[:3]
+                    if dSd is None or (args.det_signal and not eph_marg_linear):
+                        # the data vector changes with a deterministic signal
+                        dSd = np.dot(dtmp[ii], sl.cho_solve(cf, dtmp[ii]))
+                        if not args.det_signal or eph_marg_linear:
+                            cached[2] = dSd
+
+                    logLike += -0.5 * logdet_PhiSigma + 0.5 * dSd
+
+                    if args.cgwMargPhase and cgw_basis[ii] is not None:
+                        BNr, BNB, TNB = cgw_basis[ii]
+                        SiC = sl.cho_solve(cf, TNB)
+                        logLike += utils.marginalizePulsarPhase(BNr - np.dot(SiC.T, dtmp[ii]),
+                                                                BNB - np.dot(TNB.T, SiC),
+                                                                args.cgwMargPhaseGrid)
+
+                    if args.margEphLinear:
+                        if cached[3] is None:
+                            SiC = sl.cho_solve(cf, lin_TNB[ii])
+                            cached[3] = (np.dot(lin_TNB[ii].T, SiC), np.dot(SiC.T, dtmp[ii]))
+                        lin_CSC += cached[3][0]
+                        lin_CSd += cached[3][1]
+
+                if args.margEphLinear:
+                    try:
+                        logLike += utils.marginalizeLinearSignal(lin_BNB_tot, lin_BNr0_tot,
+                                                                 lin_CSC, lin_CSd, lin_phiinv)
+                    except np.linalg.LinAlgError:
                         print 'Cholesky Decomposition Failed!!'
                         return -np.inf
 
-                    logLike += -0.5 * (logdet_Phi + logdet_Sigma) + \
-                    0.5 * (np.dot(dtmp[ii], expval2))
-
                 logLike += loglike1_tmp
 
             elif args.incCorr:
@@ -3703,45 +4503,41 @@ def lnprob(xx):
                                 smallMatrix[:,ii,jj] += DipoleCorr[ii,jj] * sig_dipoffdiag[jj]
                             smallMatrix[:,jj,ii] = smallMatrix[:,ii,jj]
 
-                ###################################
-                # invert Phi matrix frequency-wise
+                cached = None
+                if args.cacheFactors and not args.use_gpu:
+                    # the correlated Sigma changes with the spectrum of
+                    # any pulsar (and white noise, if that is varied)
+                    corr_key = smallMatrix.copy()
+                    if args.varyWhite:
+                        corr_key = np.append(corr_key, np.concatenate(white_keys))
+                    cached = corr_cache.get(0, corr_key)
 
-                logdet_Phi = 0
-                for ii in range(mode_count):
+                if cached is None:
 
-                    try:
+                    ###################################
+                    # invert Phi matrix frequency-wise
 
-                        L = sl.cho_factor(smallMatrix[ii,:,:])
-                        smallMatrix[ii,:,:] = sl.cho_solve(L, np.eye(npsr))
-                        logdet_Phi += np.sum(2*np.log(np.diag(L[0])))
+                    logdet_Phi = 0
+                    for ii in range(mode_count):
 
-                    except np.linalg.LinAlgError:
+                        try:
 
-                        ###################################################
-                        # Break if we have non-positive-definiteness of Phi
+                            L = sl.cho_factor(smallMatrix[ii,:,:])
+                            smallMatrix[ii,:,:] = sl.cho_solve(L, np.eye(npsr))
+                            logdet_Phi += np.sum(2*np.log(np.diag(L[0])))
 
-                        print 'Cholesky Decomposition Failed!! Rejecting...'
-                        return -np.inf
+                        except np.linalg.LinAlgError:
 
-                if not args.varyWhite:
-                    Sigma = bigTtNT_tmp
-                elif args.varyWhite:
-                    Sigma = sl.block_diag(*TtNT_tmp)
-                Phi = np.zeros(bigTtNT_shape)
-
-                # now fill in real covariance matrix
-                ind = [0]
-                ind = np.append(ind,np.cumsum([TtNT_tmp[ii].shape[0]
-                                            for ii in range(npsr)]))
-                ind = [np.arange(ind[ii]+psr[ii].Gc.shape[1],
-                                ind[ii]+psr[ii].Gc.shape[1]+mode_count)
-                                for ii in range(len(ind)-1)]
-                for ii in range(npsr):
-                    for jj in range(npsr):
-                        Phi[ind[ii],ind[jj]] = smallMatrix[:,ii,jj]
+                            ###################################################
+                            # Break if we have non-positive-definiteness of Phi
+
+                            print 'Cholesky Decomposition Failed!! Rejecting...'
+                            return -np.inf
 
-                # compute sigma
-                Sigma += Phi
+                    # compute sigma from the per-pulsar blocks
+                    # and the inverse of Phi
+                    if not args.sparse_cholesky or args.use_gpu:
+                        Sigma = sigma_layout.dense(TtNT_tmp, smallMatrix)
 
                 # cholesky decomp for second term in exponential
                 if args.use_gpu:
@@ -3769,15 +4565,47 @@ def lnprob(xx):
                     try:
 
                         dtmp = np.concatenate(dtmp)
-                        if args.sparse_cholesky:
-                            sparseSigma = sps.csc_matrix(Sigma)
-                            cf = sks.cholesky(sparseSigma)
-                            expval2 = cf(dtmp)
-                            logdet_Sigma = cf.logdet()
+                        if cached is None:
+                            if args.sparse_cholesky:
+                                # refactorizes on the fixed sparsity pattern
+                                cf = sigma_layout.cholmod(TtNT_tmp, smallMatrix)
+                                logdet_Sigma = cf.logdet()
+                                if args.cacheFactors:
+                                    # the layout's factor is overwritten
+                                    # by the next refactorization
+                                    cf = cf.copy()
+                            else:
+                                cf = sl.cho_factor(Sigma)
+                                logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+
+                            cached = [cf, logdet_Phi + logdet_Sigma, None, None]
+                            if args.cacheFactors:
+                                corr_cache.put(0, corr_key, cached)
+
+                        cf, logdet_PhiSigma, dSd = cached[:3]
+                        if dSd is None or (args.det_signal and not eph_marg_linear):
+                            # the data vector changes with a deterministic signal
+                            if args.sparse_cholesky:
+                                expval2 = cf(dtmp)
+                            else:
+                                expval2 = sl.cho_solve(cf, dtmp)
+                            dSd = np.dot(dtmp, expval2)
+                            if not args.det_signal or eph_marg_linear:
+                                cached[2] = dSd
+
+                        if args.margEphLinear:
+                            if cached[3] is None:
+                                if args.sparse_cholesky:
+                                    SiC = cf(lin_TNBstack)
+                                else:
+                                    SiC = sl.cho_solve(cf, lin_TNBstack)
+                                cached[3] = (np.dot(lin_TNBstack.T, SiC), SiC)
+                            lnlike_lin = utils.marginalizeLinearSignal(lin_BNB_tot, lin_BNr0_tot,
+                                                                       cached[3][0],
+                                                                       np.dot(cached[3][1].T, dtmp),
+                                                                       lin_phiinv)
                         else:
-                            cf = sl.cho_factor(Sigma)
-                            expval2 = sl.cho_solve(cf, dtmp)
-                            logdet_Sigma = np.sum(2*np.log(np.diag(cf[0])))
+                            lnlike_lin = 0.0
 
                     except np.linalg.LinAlgError or sks.CholmodError:
 
@@ -3785,9 +4613,8 @@ def lnprob(xx):
                         return -np.inf
 
 
-                    logLike = -0.5 * (logdet_Phi + logdet_Sigma) + \
-                      0.5 * (np.dot(dtmp, expval2)) + \
-                      loglike1_tmp
+                    logLike = -0.5 * logdet_PhiSigma + 0.5 * dSd + \
+                      loglike1_tmp + lnlike_lin
 
 
 
@@ -4133,7 +4960,8 @@ def lnprob(xx):
         priorfac_ephphysmodel = 0.0
 
     priorfac_roemermix = 0.0
-    if args.det_signal and args.eph_roemermix and (args.eph_roemerwgts_fix is None):
+    if args.det_signal and args.eph_roemermix and (args.eph_roemerwgts_fix is None) \
+      and not eph_marg_linear:
         rmixprior = scistats.dirichlet( (args.eph_dirichlet_alpha * np.ones(num_ephs,dtype=int)).tolist() )
         priorfac_roemermix += np.log(rmixprior.pdf(roemer_wgts))
     else:
@@ -4375,8 +5203,9 @@ if args.det_signal:
             parameters.append("ecc")
         if args.psrTerm:
             [parameters.append('pdist_'+p.name) for p in psr]
-            [parameters.append('gp0_'+p.name) for p in psr]
-            [parameters.append('lp0_'+p.name) for p in psr]
+            if not args.cgwMargPhase:
+                [parameters.append('gp0_'+p.name) for p in psr]
+                [parameters.append('lp0_'+p.name) for p in psr]
         if args.cgwModelSelect:
             parameters.append("nmodel_cgw")
     if args.bwm_search:
@@ -4384,7 +5213,7 @@ if args.det_signal:
                        "phi", "costheta", "gwpol"]
         if args.bwm_model_select:
             parameters.append("nmodel_bwm")
-    if args.eph_quadratic:
+    if args.eph_quadratic and not eph_marg_linear:
         parameters += ["eph_xquad0amp", "eph_xquad1amp", "eph_xquad2amp",
                        "eph_yquad0amp", "eph_yquad1amp", "eph_yquad2amp",
                        "eph_zquad0amp", "eph_zquad1amp", "eph_zquad2amp"]
@@ -4407,7 +5236,7 @@ if args.det_signal:
             for ii in planet_tags:
                 for axis in ['x','y','z']:
                     parameters.append("planet{0}_orbitoffsetaxis{1}".format(ii,axis))
-    elif args.eph_roemermix:
+    elif args.eph_roemermix and not eph_marg_linear:
         for key in ephnames[:-1]:
             parameters.append("roemerweight_{0}".format(key))
     elif args.eph_physmodel:
@@ -4427,7 +5256,7 @@ if args.det_signal:
             elif args.sat_orbmodel == 'orbelements':
                 parameters += ["saturn_orbel1", "saturn_orbel2", "saturn_orbel3",
                                "saturn_orbel4", "saturn_orbel5", "saturn_orbel6"]
-    elif args.eph_roemermix_dx:
+    elif args.eph_roemermix_dx and not eph_marg_linear:
         for key in ephnames:
             parameters.append("roemerweight_dx_{0}".format(key))
 
@@ -4691,7 +5520,7 @@ elif args.sampler == 'ptmcmc':
                 x0 = np.append(x0,0.2)
     if args.incGWline:
         x0 = np.append(x0,np.array([-6.0,-8.0,0.5,0.5]))
-    if args.det_signal:
+    if args.det_signal and not eph_marg_linear:
         if args.cgw_search:
             x0 = np.append(x0,np.array([9.0, 0.5, 1.5, -15.0, -8.0,
                                         0.5, 0.5, 0.5, 0.5, 0.5, 0.5]))
@@ -4700,8 +5529,9 @@ elif args.sampler == 'ptmcmc':
             if args.psrTerm:
                 x0 = np.append(x0,np.array([p.h5Obj['pdist'].value
                                             for p in psr]))
-                x0 = np.append(x0,np.random.uniform(0.0,2.0*np.pi,len(psr)))
-                x0 = np.append(x0,np.random.uniform(0.0,2.0*np.pi,len(psr)))
+                if not args.cgwMargPhase:
+                    x0 = np.append(x0,np.random.uniform(0.0,2.0*np.pi,len(psr)))
+                    x0 = np.append(x0,np.random.uniform(0.0,2.0*np.pi,len(psr)))
             if args.cgwModelSelect:
                 x0 = np.append(x0,0.4)
         if args.bwm_search:
@@ -4855,7 +5685,7 @@ elif args.sampler == 'ptmcmc':
     if args.incGWline:
         cov_diag = np.append(cov_diag,np.array([0.1,0.1,0.1,0.1]))
         param_ephquad += 4
-    if args.det_signal:
+    if args.det_signal and not eph_marg_linear:
         if args.cgw_search:
             cov_diag = np.append(cov_diag,0.2*np.ones(11))
             param_ephquad += 11
@@ -4865,9 +5695,10 @@ elif args.sampler == 'ptmcmc':
             if args.psrTerm:
                 cov_diag = np.append(cov_diag,np.array([p.h5Obj['pdistErr'].value
                                                         for p in psr])**2.0)
-                cov_diag = np.append(cov_diag,0.2*np.ones(len(psr)))
-                cov_diag = np.append(cov_diag,0.2*np.ones(len(psr)))
-                param_ephquad += 3*len(psr)
+                if not args.cgwMargPhase:
+                    cov_diag = np.append(cov_diag,0.2*np.ones(len(psr)))
+                    cov_diag = np.append(cov_diag,0.2*np.ones(len(psr)))
+                param_ephquad += npterm*len(psr)
             if args.cgwModelSelect:
                 cov_diag = np.append(cov_diag,0.1)
                 param_ephquad += 1
@@ -4916,7 +5747,7 @@ elif args.sampler == 'ptmcmc':
 
     cov_diag = np.diag(cov_diag)
     # now including covariance in ephemeris quadratic parameters
-    if args.det_signal and args.eph_quadratic:
+    if args.det_signal and args.eph_quadratic and not eph_marg_linear:
         cov_diag[param_ephquad:param_ephquad+9,param_ephquad:param_ephquad+9] = ephem_fisher / ephem_norm**2.0
 
     if rank==0:
@@ -5137,7 +5968,7 @@ elif args.sampler == 'ptmcmc':
         [ind.append(id) for id in ids]
 
     ##### DET SIGNAL #####
-    if args.det_signal:
+    if args.det_signal and not eph_marg_linear:
         ##### CW #####
         if args.cgw_search:
             ids = [np.arange(param_ct,param_ct+5),
@@ -5154,10 +5985,9 @@ elif args.sampler == 'ptmcmc':
                 param_ct += 11
             [ind.append(id) for id in ids]
             if args.psrTerm:
-                ids = [np.arange(param_ct,param_ct+len(psr)),
-                       np.arange(param_ct+len(psr),param_ct+2*len(psr)),
-                       np.arange(param_ct+2*len(psr),param_ct+3*len(psr))]
-                param_ct += 3*len(psr)
+                ids = [np.arange(param_ct+kk*len(psr),param_ct+(kk+1)*len(psr))
+                       for kk in range(npterm)]
+                param_ct += npterm*len(psr)
                 [ind.append(id) for id in ids]
         ##### BWM #####
         if args.bwm_search:
@@ -7312,12 +8142,8 @@ elif args.sampler == 'ptmcmc':
             pct += 11
 
         if args.psrTerm:
-            # psr distances
-            pct += len(psr)
-            # psrterm gamma0
-            pct += len(psr)
-            # psrterm l0
-            pct += len(psr)
+            # psr distances (and psrterm gamma0, l0)
+            pct += npterm*len(psr)
 
         q[pct] = np.random.uniform(pmin[pct], pmax[pct])
         qxy += 0
@@ -7414,7 +8240,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
 
@@ -7516,7 +8342,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
 
@@ -7616,7 +8442,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -7721,7 +8547,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -7830,7 +8656,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -7950,7 +8776,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -8066,7 +8892,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -8184,7 +9010,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -8299,7 +9125,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -8448,7 +9274,7 @@ elif args.sampler == 'ptmcmc':
             if args.ecc_search:
                 pct += 1
             if args.psrTerm:
-                pct += 3*len(psr)
+                pct += npterm*len(psr)
             if args.cgwModelSelect:
                 pct += 1
         if args.bwm_search:
@@ -8527,15 +9353,16 @@ elif args.sampler == 'ptmcmc':
         sampler.addProposalToCycle(drawFromCWPrior, 10)
         if args.psrTerm:
             sampler.addProposalToCycle(drawFromPsrDistPrior, 10)
-            sampler.addProposalToCycle(drawFromPtermGamPrior, 10)
-            sampler.addProposalToCycle(drawFromPtermEllPrior, 10)
+            if not args.cgwMargPhase:
+                sampler.addProposalToCycle(drawFromPtermGamPrior, 10)
+                sampler.addProposalToCycle(drawFromPtermEllPrior, 10)
         if args.cgwModelSelect:
             sampler.addProposalToCycle(drawFromCGWModelIndexPrior, 5)
     if args.det_signal and args.bwm_search:
         sampler.addProposalToCycle(drawFromBWMPrior, 10)
         if args.bwm_model_select:
             sampler.addProposalToCycle(drawFromBWMModelIndexPrior, 5)
-    if args.det_signal and args.eph_quadratic:
+    if args.det_signal and args.eph_quadratic and not eph_marg_linear:
         sampler.addProposalToCycle(drawFromEphemQuadPrior, 10)
         sampler.addProposalToCycle(drawFromEphemQuadFisherPrior, 20)
     if args.det_signal and args.eph_planetdelta:
@@ -8545,11 +9372,11 @@ elif args.sampler == 'ptmcmc':
                 sampler.addProposalToCycle(drawFromEphPlanetOrbitPrior, 10)
         if args.eph_planetoffset:
             sampler.addProposalToCycle(drawFromEphPlanetOffsetPrior, 10)
-    elif args.det_signal and args.eph_roemermix and num_ephs > 1:
+    elif args.det_signal and args.eph_roemermix and num_ephs > 1 and not eph_marg_linear:
         sampler.addProposalToCycle(drawFromEphRoemerMixPrior, 10)
     elif args.det_signal and args.eph_physmodel:
         sampler.addProposalToCycle(drawFromEphPhysModelPrior, 10)
-    elif args.det_signal and args.eph_roemermix_dx and num_ephs > 1:
+    elif args.det_signal and args.eph_roemermix_dx and num_ephs > 1 and not eph_marg_linear:
         sampler.addProposalToCycle(drawFromEphRoemerMixDXPrior, 10)
 
 
@@ -0,0 +1,749 @@
+#!/usr/bin/env python
+
+"""
+NX01_optstat.py
+
+Rank-reduced (Fourier-domain) optimal statistic for the GWB, as in
+Chamberlin et al. (2015). The noise covariance of each pulsar,
+P = N + T Phi T^T, is only ever applied through the Woodbury
+identity, to get X = F^T P^-1 r and Z = F^T P^-1 F on the GW
+Fourier basis F. Each pulsar pair then costs O(nmodes^2), rather
+than the dense (nTOA x nTOA) products of NX01_utils.optStat.
+
+Pulsars come from hdf5 files, with their single-pulsar noise held
+fixed as in NX01_fstat.
+
+"""
+
+from __future__ import division
+import numpy as np
+import os, optparse, time
+from multiprocessing import Pool
+import h5py as h5
+from scipy import linalg as sl
+
+import NX01_psr
+import NX01_AnisCoefficients as anis
+import rankreduced as rr
+from NX01_fstat import noiseModel
+
+f1yr = 1.0/(365.25*86400.0)
+
+
+class OSPulsar(object):
+    """
+    Noise-weighted products of one pulsar for the optimal statistic.
+    The parts of the noise model that stay fixed (white noise, ECORR
+    and the timing model) are folded in once, leaving
+    F^T P0^-1 F and F^T P0^-1 r on the Fourier columns whose prior
+    can change (red noise, DM variations, a common process). X and Z
+    then follow for any such prior from a Cholesky decomposition
+    of size 2*nmodes only.
+
+    @param psr: pulsar object, after makeTe
+    @param T: noise basis
+    @param phiinv: inverse prior variances of the noise basis
+    @param gwcols: slice of the columns of T that hold the GW basis
+    @param fcols: slice of the columns of T whose prior can change,
+                  containing gwcols (default = gwcols)
+
+    """
+
+    def __init__(self, psr, T, phiinv, gwcols, fcols=None):
+
+        self.name = psr.name
+
+        if fcols is None:
+            fcols = gwcols
+        self.fcols = fcols
+        self.gwcols = slice(gwcols.start - fcols.start, gwcols.stop - fcols.start)
+
+        TN = T.T / psr.toaerrs**2.0
+        TNT = np.dot(TN, T)
+        TNr = np.dot(TN, psr.res)
+
+        # fold in the fixed columns
+        ff = np.arange(T.shape[1])[fcols]
+        xx = np.setdiff1d(np.arange(T.shape[1]), ff)
+
+        cf = sl.cho_factor(TNT[np.ix_(xx,xx)] + np.diag(phiinv[xx]))
+        AiB = sl.cho_solve(cf, TNT[np.ix_(xx,ff)])
+        self.FPF = TNT[np.ix_(ff,ff)] - np.dot(TNT[np.ix_(ff,xx)], AiB)
+        self.FPr = TNr[ff] - np.dot(AiB.T, TNr[xx])
+
+        # pulsar unit vector
+        ptheta = np.pi/2 - psr.psr_locs[1]
+        pphi = psr.psr_locs[0]
+        self.phat = np.array([np.sin(ptheta)*np.cos(pphi),
+                              np.sin(ptheta)*np.sin(pphi),
+                              np.cos(ptheta)])
+
+        self.update(phiinv[fcols])
+
+    def update(self, phiinv):
+        """
+        Recompute X = F^T P^-1 r and Z = F^T P^-1 F for a new prior
+        on the Fourier columns.
+
+        @param phiinv: inverse prior variances of the columns fcols
+
+        """
+
+        cf = sl.cho_factor(self.FPF + np.diag(phiinv))
+
+        PF = self.FPF[:,self.gwcols]
+        SiPF = sl.cho_solve(cf, PF)
+
+        self.X = self.FPr[self.gwcols] - np.dot(SiPF.T, self.FPr)
+        self.Z = PF[self.gwcols] - np.dot(PF.T, SiPF)
+
+
+def gwSpectrum(freqs, gam_gwb=13./3.):
+    """
+    Power-law GWB spectrum with unit amplitude, on the (cos, sin)
+    columns of the Fourier basis, as in NX01_master.
+
+    @param freqs: sampling frequencies [Hz]
+    @param gam_gwb: spectral index
+
+    @return: prior variances of the basis columns
+
+    """
+
+    return np.repeat(1/12/np.pi**2 * f1yr**(gam_gwb-3) * \
+                     freqs**(-gam_gwb), 2)
+
+
+def hdOrf(phat):
+    """
+    Hellings and Downs overlap reduction function of all pairs,
+    with the normalization of 2*sqrt(pi)*CorrBasis(positions, 0)[0].
+
+    @param phat: pulsar unit vectors, (npsr x 3), or a stack of
+                 sky positions (... x npsr x 3)
+
+    @return: ORF of each pair, in the order of np.triu_indices(npsr, 1)
+
+    """
+
+    ia, ib = np.triu_indices(phat.shape[-2], 1)
+    x = 0.5 * (1.0 - np.sum(phat[...,ia,:] * phat[...,ib,:], axis=-1))
+
+    return 1.5 * x * np.log(x) - 0.25 * x + 0.5
+
+
+def orfBasis(phat, names=['hd']):
+    """
+    Overlap reduction functions of all pairs for a list of
+    correlation patterns: 'hd' (Hellings and Downs), 'monopole'
+    (e.g. clock errors) and 'dipole' (e.g. ephemeris errors).
+
+    @param phat: pulsar unit vectors, (npsr x 3), or a stack of
+                 sky positions (... x npsr x 3)
+    @param names: correlation patterns
+
+    @return: ORFs, (len(names) x ... x npairs)
+
+    """
+
+    ia, ib = np.triu_indices(phat.shape[-2], 1)
+    cosMu = np.sum(phat[...,ia,:] * phat[...,ib,:], axis=-1)
+
+    orfs = []
+    for name in names:
+        if name == 'hd':
+            orfs.append(hdOrf(phat))
+        elif name == 'monopole':
+            orfs.append(np.ones(cosMu.shape))
+        elif name == 'dipole':
+            orfs.append(cosMu)
+        else:
+            raise ValueError("Unknown ORF '{0}'".format(name))
+
+    return np.array(orfs)
+
+
+def pairProducts(X, Z, phi):
+    """
+    Cross-correlation numerators X_a^T phi X_b and normalizations
+    tr(Z_a phi Z_b phi) of all pulsar pairs a < b, for one GW
+    spectrum or a stack of them (e.g. a grid of spectral indices).
+    The numerators of every spectrum come from one matrix product.
+
+    @param X: F^T P^-1 r of each pulsar, (npsr x nbasis)
+    @param Z: F^T P^-1 F of each pulsar, (npsr x nbasis x nbasis)
+    @param phi: GW spectrum on the basis, (nbasis) or (nspec x nbasis)
+
+    @return: num, den: (npairs) or (nspec x npairs), pairs in the
+             order of np.triu_indices(npsr, 1)
+
+    """
+
+    npsr = len(X)
+    ia, ib = np.triu_indices(npsr, 1)
+
+    num = np.dot(phi, (X[ia] * X[ib]).T)
+
+    # Z is symmetric, so tr(Z_a phi Z_b phi) = sum(phi Z_a phi * Z_b)
+    Zflat = Z.reshape(npsr,-1).T
+    den = np.array([np.dot((pp[None,:,None] * Z * pp[None,None,:]).reshape(npsr,-1),
+                           Zflat)[ia,ib] for pp in np.atleast_2d(phi)])
+
+    return num, den.reshape(num.shape)
+
+
+def optStat(num, den, orf):
+    """
+    Optimal statistic of a correlated GWB from the pair products,
+    with the same outputs as NX01_utils.optStat. Leading axes of
+    num, den and orf broadcast, so that e.g. num[:,None,:] with
+    (norf x npairs) ORFs gives every (spectrum, ORF) combination.
+
+    @param num: pair numerators from pairProducts
+    @param den: pair normalizations from pairProducts
+    @param orf: overlap reduction function of each pair
+
+    @return: Opt: Optimal statistic value (A_gw^2)
+    @return: sigma: 1-sigma uncertanty on Optimal statistic
+    @return: snr: signal-to-noise ratio of cross correlations
+    @return: amplitude estimate of each pair
+    @return: 1-sigma uncertainty of each pair
+
+    """
+
+    top = np.sum(orf * num, axis=-1)
+    bot = np.sum(orf**2.0 * den, axis=-1)
+
+    return top/bot, 1/np.sqrt(bot), top/np.sqrt(bot), \
+      num / (orf * den), 1/np.sqrt(orf**2.0 * den)
+
+
+def anisOptStat(num, den, CorrCoeff):
+    """
+    Generalised optimal statistic for the coefficients of a set of
+    correlation basis functions, fitted jointly, as
+    NX01_utils.AnisOptStat. Leading axes of num and den (e.g. a
+    grid of spectral indices) carry through to the outputs.
+
+    @param num: pair numerators from pairProducts
+    @param den: pair normalizations from pairProducts
+    @param CorrCoeff: correlation basis functions, (nbasis x npsr x npsr),
+                      or already per pair, (nbasis x npairs)
+
+    @return: P: maximum-likelihood coefficients
+    @return: invFisher: their covariance
+    @return: slogdet of the Fisher matrix
+
+    """
+
+    C = np.array(CorrCoeff)
+    if C.ndim == 3:
+        ia, ib = np.triu_indices(C.shape[1], 1)
+        C = C[:,ia,ib]
+
+    X = np.dot(num, C.T)
+    fisher = np.einsum('ai,...i,bi->...ab', C, den, C)
+
+    invFisher = np.linalg.pinv(fisher)
+    P = np.einsum('...ab,...b->...a', invFisher, X)
+
+    return P, invFisher, np.linalg.slogdet(fisher)
+
+
+def chainNoiseDraws(chaindir, ndraws, manualburn=0, seed=None):
+    """
+    Random posterior draws from the PTMCMC chain of an NX01_master run.
+
+    @param chaindir: directory with chain_1.txt (or chain_1.0.txt)
+                     and parameter_list.txt
+    @param ndraws: number of draws (at most the length of the chain)
+    @param manualburn: number of samples to cut as burn-in
+    @param seed: random seed
+
+    @return: dict of parameter name -> samples, (ndraws)
+
+    """
+
+    try:
+        chain = np.loadtxt(chaindir+'/chain_1.0.txt')
+    except IOError:
+        chain = np.loadtxt(chaindir+'/chain_1.txt')
+    param_list = np.genfromtxt(chaindir+'/parameter_list.txt', dtype=str)
+
+    chain = chain[manualburn:]
+    inds = np.random.RandomState(seed).choice(len(chain), np.min([ndraws, len(chain)]),
+                                              replace=False)
+
+    return dict((name, chain[inds,int(ii)]) for ii,name in param_list)
+
+
+def noiseParams(draws, psr, gam_gwb=13./3.):
+    """
+    Power-law noise parameters of every pulsar for each draw. Red
+    noise and DM parameters missing from the chain keep the values
+    of the single-pulsar noise analysis, as in noiseModel; the common
+    process is only included if the chain has an Agwb.
+
+    @param draws: output of chainNoiseDraws
+    @param psr: list of pulsar objects
+    @param gam_gwb: common-process spectral index, if not in the chain
+
+    @return: dict of Ared, gam_red, Adm, gam_dm (ndraws x npsr) and
+             Agwb, gam_gwb (ndraws)
+
+    """
+
+    ndraws = len(draws.values()[0])
+
+    pars = {}
+    for key, attr in [('Ared', 'Redamp'), ('gam_red', 'Redind'),
+                      ('Adm', 'DMamp'), ('gam_dm', 'DMind')]:
+        vals = []
+        for p in psr:
+            if key+'_'+p.name in draws:
+                val = draws[key+'_'+p.name]
+                if key.startswith('A'):
+                    val = 10.0**val
+            else:
+                val = np.max([getattr(p, attr), getattr(p, 'par'+attr)])
+            vals.append(val * np.ones(ndraws))
+        pars[key] = np.array(vals).T
+
+    if 'Agwb' in draws:
+        pars['Agwb'] = 10.0**draws['Agwb']
+    else:
+        pars['Agwb'] = np.zeros(ndraws)
+    pars['gam_gwb'] = draws.get('gam_gwb', gam_gwb * np.ones(ndraws))
+
+    return pars
+
+
+# pulsars and noise draws of a noise-marginalized run,
+# inherited by forked workers
+marg_data = {}
+
+def noiseMargChunk(inds):
+    """
+    Optimal statistic for a chunk of noise draws, using the
+    pulsars, draws and ORFs in marg_data.
+
+    @return: (Opt, sigma, snr) of each draw, (ndraws x 3 x norf)
+
+    """
+
+    fqs = marg_data['fqs']
+    pars = marg_data['pars']
+
+    out = []
+    for jj in inds:
+        common = pars['Agwb'][jj]**2.0 * gwSpectrum(fqs, pars['gam_gwb'][jj])
+        for ii,sp in enumerate(marg_data['psrs']):
+            kappa = pars['Ared'][jj,ii]**2.0 * \
+              gwSpectrum(fqs, pars['gam_red'][jj,ii]) + common
+            if marg_data['incDM']:
+                kappa = np.append(kappa, np.repeat(pars['Adm'][jj,ii]**2.0 * \
+                                                   f1yr**(pars['gam_dm'][jj,ii]-3) * \
+                                                   fqs**(-pars['gam_dm'][jj,ii]), 2))
+            sp.update(1.0/kappa)
+
+        X = np.array([sp.X for sp in marg_data['psrs']])
+        Z = np.array([sp.Z for sp in marg_data['psrs']])
+        num, den = pairProducts(X, Z, marg_data['phi'])
+        out.append(optStat(num, den, marg_data['orfs'])[:3])
+
+    return np.array(out)
+
+
+def noiseMargOptStat(ospsrs, pars, fqs, phi, orfs, incDM=False, nproc=1, chunk=50):
+    """
+    Noise-marginalized optimal statistic: the statistic for each
+    posterior draw of the noise, with only the (2*nmodes)-sized
+    Fourier block of each pulsar refactorized per draw.
+
+    @param ospsrs: list of OSPulsar objects, with fcols covering the
+                   red-noise (and DM) columns
+    @param pars: output of noiseParams
+    @param fqs: red-noise (and DM) sampling frequencies [Hz]
+    @param phi: GW spectrum of the cross-correlations
+    @param orfs: ORFs, (norf x npairs)
+    @param incDM: the pulsars have DM columns
+    @param nproc: number of processes, each taking chunks of draws
+    @param chunk: number of draws per chunk
+
+    @return: Opt, sigma, snr, each (ndraws x norf)
+
+    """
+
+    marg_data['psrs'] = ospsrs
+    marg_data['pars'] = pars
+    marg_data['fqs'] = fqs
+    marg_data['phi'] = phi
+    marg_data['orfs'] = orfs
+    marg_data['incDM'] = incDM
+
+    ndraws = len(pars['Agwb'])
+    chunks = [range(ii, np.min([ii+chunk, ndraws])) for ii in range(0, ndraws, chunk)]
+
+    if nproc > 1:
+        pool = Pool(nproc)
+        out = pool.map(noiseMargChunk, chunks)
+        pool.close()
+        pool.join()
+    else:
+        out = [noiseMargChunk(cc) for cc in chunks]
+
+    out = np.concatenate(out, axis=0)
+
+    return out[:,0], out[:,1], out[:,2]
+
+
+def skyScramble(npsr, nscr, orf=None, maxmatch=None, rstate=np.random):
+    """
+    Random isotropic pulsar positions. With maxmatch, scrambles whose
+    correlations match the true ones too closely are redrawn.
+
+    @param npsr: number of pulsars
+    @param nscr: number of scrambles
+    @param orf: true HD correlations of the array, from hdOrf
+    @param maxmatch: largest allowed match sum(G G') / |G| |G'|
+    @param rstate: numpy random state
+
+    @return: pulsar unit vectors, (nscr x npsr x 3)
+
+    """
+
+    phat = np.zeros((0,npsr,3))
+    while len(phat) < nscr:
+        costh = rstate.uniform(-1.0, 1.0, (nscr,npsr))
+        phi = rstate.uniform(0.0, 2.0*np.pi, (nscr,npsr))
+        sinth = np.sqrt(1.0 - costh**2.0)
+        trial = np.array([sinth*np.cos(phi), sinth*np.sin(phi), costh]).transpose(1,2,0)
+
+        if maxmatch is not None:
+            scr = hdOrf(trial)
+            match = np.dot(scr, orf) / np.sqrt(np.sum(scr**2.0, axis=1) * np.sum(orf**2.0))
+            trial = trial[np.abs(match) < maxmatch]
+
+        phat = np.append(phat, trial, axis=0)
+
+    return phat[:nscr]
+
+
+def phaseShift(X, Z, phases):
+    """
+    Whitened Fourier products of a phase-shifted basis: shifting the
+    phase of frequency k by theta_k (as makeTe with pshift_vals)
+    rotates each (cos, sin) column pair, F' = F R, so that
+    X' = R^T X and Z' = R^T Z R. The red-noise prior is the same on
+    both columns of a pair, so P is unchanged.
+
+    @param X: F^T P^-1 r of each pulsar, (npsr x nbasis)
+    @param Z: F^T P^-1 F of each pulsar, (npsr x nbasis x nbasis)
+    @param phases: phase shift of each frequency, (npsr x nbasis/2)
+
+    @return: X', Z'
+
+    """
+
+    npsr, nbasis = X.shape
+    cs, sn = np.cos(phases), np.sin(phases)
+
+    R = np.zeros((npsr,nbasis,nbasis))
+    ii = np.arange(0,nbasis,2)
+    R[:,ii,ii] = cs
+    R[:,ii,ii+1] = sn
+    R[:,ii+1,ii] = -sn
+    R[:,ii+1,ii+1] = cs
+
+    RT = R.transpose(0,2,1)
+    return np.einsum('pij,pj->pi', RT, X), np.matmul(np.matmul(RT, Z), R)
+
+
+# Fourier products and ORFs of a null-distribution run,
+# inherited by forked workers
+null_data = {}
+
+def nullChunk(task):
+    """
+    Optimal statistic of a chunk of sky scrambles ('scramble') or
+    phase shifts ('shift'), using the products and ORFs in null_data.
+
+    @param task: (null type, random seed, number of realizations)
+
+    @return: (Opt, sigma, snr) of each realization, (n x 3 x norf)
+
+    """
+
+    kind, seed, nreal = task
+    rstate = np.random.RandomState(seed)
+
+    X, Z, phi = null_data['X'], null_data['Z'], null_data['phi']
+    npsr = len(X)
+
+    if kind == 'scramble':
+        # one pass over pairs, the ORFs change
+        num, den = null_data['num'], null_data['den']
+        phat = skyScramble(npsr, nreal, orf=null_data['hd'],
+                           maxmatch=null_data['maxmatch'], rstate=rstate)
+        orfs = orfBasis(phat, null_data['names']).transpose(1,0,2)
+        return np.array(optStat(num, den, orfs)[:3]).transpose(1,0,2)
+
+    elif kind == 'shift':
+        # the ORFs are fixed, the pair products change
+        out = []
+        for jj in range(nreal):
+            Xs, Zs = phaseShift(X, Z, rstate.uniform(0.0, 2.0*np.pi,
+                                                     (npsr,X.shape[1]//2)))
+            num, den = pairProducts(Xs, Zs, phi)
+            out.append(optStat(num, den, null_data['orfs'])[:3])
+        return np.array(out)
+
+    else:
+        raise ValueError("Unknown null distribution '{0}'".format(kind))
+
+
+def nullOptStat(kind, X, Z, phat, phi, names=['hd'], nreal=1000,
+                maxmatch=None, nproc=1, chunk=50, seed=None):
+    """
+    Null distribution of the optimal statistic from sky scrambles or
+    phase shifts of the whitened Fourier products, without rebuilding
+    any pulsar's noise model.
+
+    @param kind: 'scramble' or 'shift'
+    @param X: F^T P^-1 r of each pulsar, (npsr x nbasis)
+    @param Z: F^T P^-1 F of each pulsar, (npsr x nbasis x nbasis)
+    @param phat: pulsar unit vectors, (npsr x 3)
+    @param phi: GW spectrum on the basis
+    @param names: correlation patterns, as in orfBasis
+    @param nreal: number of realizations
+    @param maxmatch: largest match of scrambled and true HD correlations
+    @param nproc: number of processes, each taking chunks of realizations
+    @param chunk: number of realizations per chunk
+    @param seed: random seed
+
+    @return: Opt, sigma, snr, each (nreal x len(names))
+
+    """
+
+    null_data['X'] = X
+    null_data['Z'] = Z
+    null_data['phi'] = phi
+    null_data['names'] = names
+    null_data['orfs'] = orfBasis(phat, names)
+    null_data['hd'] = hdOrf(phat)
+    null_data['maxmatch'] = maxmatch
+    null_data['num'], null_data['den'] = pairProducts(X, Z, phi)
+
+    # independent streams for the workers
+    sizes = [np.min([chunk, nreal-ii]) for ii in range(0, nreal, chunk)]
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, len(sizes))
+    tasks = [(kind, ss, nn) for ss,nn in zip(seeds, sizes)]
+
+    if nproc > 1:
+        pool = Pool(nproc)
+        out = pool.map(nullChunk, tasks)
+        pool.close()
+        pool.join()
+    else:
+        out = [nullChunk(tt) for tt in tasks]
+
+    out = np.concatenate(out, axis=0)
+
+    return out[:,0], out[:,1], out[:,2]
+
+
+def falseAlarmProb(snr_null, snr):
+    """
+    Fraction of null realizations at least as significant as the data.
+
+    @param snr_null: null SNRs, (nreal x ...)
+    @param snr: observed SNR
+
+    @return: false-alarm probability
+
+    """
+
+    return np.mean(snr_null >= snr, axis=0)
+
+
+if __name__ == '__main__':
+
+    parser = optparse.OptionParser(description = "NX01 - Fourier-domain optimal statistic for the GWB")
+
+    parser.add_option('--psrlist', dest='psrlist', action='store', type=str, default=None,
+                      help='Provide path to file containing list of pulsars and their respective hdf5 files (default = None)')
+    parser.add_option('--psrStartIndex', dest='psrStartIndex', action='store', type=int, default=0,
+                      help='From your pulsar list, which pulsar index do you want to start with? (default = 0)')
+    parser.add_option('--psrEndIndex', dest='psrEndIndex', action='store', type=int, default=18,
+                      help='From your pulsar list, which pulsar index do you want to end with? (default = 18)')
+    parser.add_option('--psrIndices', dest='psrIndices', action='store', type=str, default=None,
+                      help='Provide a sequence of indices from your pulsar list as a comma delimited string (default = None)')
+    parser.add_option('--sysflag_target', dest='sysflag_target', action='store', type=str, default=None,
+                      help='If you are supplying pulsar noise files, then specify which system flag you want to target (default = None)')
+    parser.add_option('--nmodes', dest='nmodes', action='store', type=int, default=30,
+                      help='Number of red-noise and GWB Fourier modes (default = 30)')
+    parser.add_option('--incDM', dest='incDM', action='store_true', default=False,
+                      help='Do you want to include DM variations in the noise model? (default = False)')
+    parser.add_option('--noEcorr', dest='noEcorr', action='store_true', default=False,
+                      help='Do you want to ignore correlated white noise terms in noise matrix? (default = False)')
+    parser.add_option('--gam_gwb', dest='gam_gwb', action='store', type=float, default=13./3.,
+                      help='Spectral index of the GWB (default = 13/3)')
+    parser.add_option('--LMAX', dest='LMAX', action='store', type=int, default=0,
+                      help='Maximum multipole of an anisotropic optimal statistic (default = 0)')
+    parser.add_option('--orfs', dest='orfs', action='store', type=str, default='hd',
+                      help='Comma delimited list of correlation patterns to fit: hd, monopole, dipole (default = hd)')
+    parser.add_option('--nlims', dest='nlims', action='store', type=int, default=60,
+                      help='Number of spectral indices between 1.01 and 6.99 for the optimal-statistic bounds (default = 60)')
+    parser.add_option('--ulList', dest='ulList', action='store', type=str, default='0.95,0.90',
+                      help='Comma delimited list of upper-limit levels for the bounds plot (default = 0.95,0.90)')
+    parser.add_option('--makePlot', dest='makePlot', action='store_true', default=False,
+                      help='Do you want to plot the optimal-statistic bounds and cross-power? (default = False)')
+    parser.add_option('--chaindir', dest='chaindir', action='store', type=str, default=None,
+                      help='Directory of an NX01_master chain whose noise draws the optimal statistic is marginalized over; white noise stays fixed (default = None)')
+    parser.add_option('--manualburn', dest='manualburn', action='store', type=int, default=0,
+                      help='Number of chain samples to cut as burn-in (default = 0)')
+    parser.add_option('--ndraws', dest='ndraws', action='store', type=int, default=1000,
+                      help='Number of noise draws from the chain (default = 1000)')
+    parser.add_option('--seed', dest='seed', action='store', type=int, default=None,
+                      help='Random seed of the noise draws (default = None)')
+    parser.add_option('--nproc', dest='nproc', action='store', type=int, default=1,
+                      help='Number of processes for the noise draws (default = 1)')
+    parser.add_option('--chunk', dest='chunk', action='store', type=int, default=50,
+                      help='Number of noise draws per process task (default = 50)')
+    parser.add_option('--nullType', dest='nullType', action='store', type=str, default=None,
+                      help='Null distribution of the optimal statistic: scramble (sky scrambles) or shift (phase shifts) (default = None)')
+    parser.add_option('--nnull', dest='nnull', action='store', type=int, default=1000,
+                      help='Number of sky scrambles or phase shifts (default = 1000)')
+    parser.add_option('--maxMatch', dest='maxMatch', action='store', type=float, default=None,
+                      help='Redraw sky scrambles whose HD correlations match the true ones above this value (default = None)')
+    parser.add_option('--dirExt', dest='dirExt', action='store', type=str, default='./optstat_results/',
+                      help='Where do you want to put the results? (default = ./optstat_results/)')
+
+    (args, x) = parser.parse_args()
+
+    psr_pathinfo = np.genfromtxt(args.psrlist, dtype=str, skip_header=2)
+
+    if args.psrIndices is not None:
+        psr_inds = [int(item) for item in args.psrIndices.split(',')]
+    else:
+        psr_inds = range(args.psrStartIndex, args.psrEndIndex)
+
+    psr = [NX01_psr.PsrObjFromH5(h5.File(psr_pathinfo[ii,1], 'r')[psr_pathinfo[ii,0]])
+           for ii in psr_inds]
+    [p.grab_all_vars(rescale=True, sysflag_target=args.sysflag_target) for p in psr]
+
+    Tmax = (np.max([p.toas.max() for p in psr]) -
+            np.min([p.toas.min() for p in psr])) * 86400.0
+    fqs_red, wgts_red = rr.linBinning(Tmax, 0, 1/Tmax, args.nmodes, 0)
+
+    tstart = time.time()
+    ospsrs = []
+    for p in psr:
+        T, phiinv = noiseModel(p, Tmax, args.nmodes, incDM=args.incDM,
+                               noEcorr=args.noEcorr)
+        ntm = p.Gc.shape[1]
+        # red noise and DM are updated per noise draw
+        nfcols = 2*args.nmodes
+        if args.incDM:
+            nfcols *= 2
+        ospsrs.append(OSPulsar(p, T, phiinv, slice(ntm, ntm+2*args.nmodes),
+                               fcols=slice(ntm, ntm+nfcols)))
+
+    X = np.array([sp.X for sp in ospsrs])
+    Z = np.array([sp.Z for sp in ospsrs])
+    phat = np.array([sp.phat for sp in ospsrs])
+
+    orf_names = args.orfs.split(',')
+    orfs = orfBasis(phat, orf_names)
+
+    # the spectral index of interest, then the grid of the bounds plot
+    gam_bkgrd = np.linspace(1.01,6.99,args.nlims)
+    gams = np.append(args.gam_gwb, gam_bkgrd)
+
+    # one pass over pairs for all spectral indices and ORFs
+    num, den = pairProducts(X, Z, np.array([gwSpectrum(fqs_red, gg) for gg in gams]))
+    stats = optStat(num[:,None,:], den[:,None,:], orfs)
+    print "\n Done in {0} seconds\n".format(time.time() - tstart)
+
+    for jj,name in enumerate(orf_names):
+        print "\n {0}: A^2 = {1}, std = {2}, SNR = {3}\n".format(name, stats[0][0,jj],
+                                                               stats[1][0,jj], stats[2][0,jj])
+
+    if not os.path.exists(args.dirExt):
+        os.makedirs(args.dirExt)
+
+    ia, ib = np.triu_indices(len(psr), 1)
+    cosMu = np.sum(phat[ia] * phat[ib], axis=1)
+    np.savetxt(args.dirExt+'/optstat_pairs.txt',
+               np.column_stack([cosMu] + [np.column_stack((orfs[jj], stats[3][0,jj], stats[4][0,jj]))
+                                          for jj in range(len(orf_names))]),
+               header='cos(angsep) ' + ' '.join(['orf_{0} Asqr_{0} sigma_{0}'.format(name)
+                                                 for name in orf_names]))
+    np.savetxt(args.dirExt+'/optstat_gamgrid.txt',
+               np.column_stack([gams] + [np.column_stack((stats[0][:,jj], stats[1][:,jj], stats[2][:,jj]))
+                                         for jj in range(len(orf_names))]),
+               header='gamma ' + ' '.join(['Asqr_{0} sigma_{0} snr_{0}'.format(name)
+                                           for name in orf_names]))
+
+    if args.chaindir is not None:
+        tstart = time.time()
+        draws = chainNoiseDraws(args.chaindir, args.ndraws,
+                                manualburn=args.manualburn, seed=args.seed)
+        pars = noiseParams(draws, psr, gam_gwb=args.gam_gwb)
+        margStats = noiseMargOptStat(ospsrs, pars, fqs_red, gwSpectrum(fqs_red, args.gam_gwb),
+                                     orfs, incDM=args.incDM, nproc=args.nproc, chunk=args.chunk)
+        print "\n {0} noise draws done in {1} seconds\n".format(len(margStats[0]),
+                                                                time.time() - tstart)
+
+        for jj,name in enumerate(orf_names):
+            print "\n {0}: noise-marginalized A^2 = {1} +/- {2}, SNR = {3} +/- {4}\n".format(
+                name, np.mean(margStats[0][:,jj]), np.std(margStats[0][:,jj]),
+                np.mean(margStats[2][:,jj]), np.std(margStats[2][:,jj]))
+
+        np.savetxt(args.dirExt+'/optstat_noisemarg.txt',
+                   np.column_stack([np.column_stack((margStats[0][:,jj], margStats[1][:,jj],
+                                                     margStats[2][:,jj]))
+                                    for jj in range(len(orf_names))]),
+                   header=' '.join(['Asqr_{0} sigma_{0} snr_{0}'.format(name)
+                                    for name in orf_names]))
+
+    if args.nullType is not None:
+        tstart = time.time()
+        nullStats = nullOptStat(args.nullType, X, Z, phat, gwSpectrum(fqs_red, args.gam_gwb),
+                                names=orf_names, nreal=args.nnull, maxmatch=args.maxMatch,
+                                nproc=args.nproc, chunk=args.chunk, seed=args.seed)
+        fap = falseAlarmProb(nullStats[2], stats[2][0])
+        print "\n {0} {1} realizations done in {2} seconds\n".format(args.nnull, args.nullType,
+                                                                      time.time() - tstart)
+
+        for jj,name in enumerate(orf_names):
+            print "\n {0}: SNR = {1}, false-alarm probability = {2}\n".format(name, stats[2][0,jj],
+                                                                              fap[jj])
+
+        np.savetxt(args.dirExt+'/optstat_null_{0}.txt'.format(args.nullType),
+                   np.column_stack([np.column_stack((nullStats[0][:,jj], nullStats[1][:,jj],
+                                                     nullStats[2][:,jj]))
+                                    for jj in range(len(orf_names))]),
+                   header='FAP ' + ' '.join(['{0}={1}'.format(name, fap[jj])
+                                             for jj,name in enumerate(orf_names)]) + '\n' + \
+                   ' '.join(['Asqr_{0} sigma_{0} snr_{0}'.format(name) for name in orf_names]))
+
+    if args.LMAX!=0:
+        positions = np.array([[p.psr_locs[0], np.pi/2. - p.psr_locs[1]] for p in psr])
+        CorrCoeff = np.array(anis.CorrBasis(positions,args.LMAX))
+        anisStat = anisOptStat(num[0], den[0], CorrCoeff)
+
+        print "\n The ML coefficients of an l={0} search are {1}\n".format(args.LMAX,anisStat[0])
+        print "\n The full covariance matrix is {0}\n".format(anisStat[1])
+
+        np.save(args.dirExt+'/mlcoeff_lmax{0}'.format(args.LMAX),anisStat[0])
+        np.save(args.dirExt+'/invfisher_lmax{0}'.format(args.LMAX),anisStat[1])
+
+    if args.makePlot:
+        import NX01_bayesutils as bu
+
+        # bounds and cross-power for the first ORF
+        optStatList = np.column_stack((stats[0][1:,0], stats[1][1:,0], stats[2][1:,0]))
+        bu.OSboundsPlot(gam_bkgrd, optStatList, (stats[0][0,0], stats[1][0,0]),
+                        ul_list=[float(item) for item in args.ulList.split(',')])
+        bu.OScrossPower(np.dot(phat, phat.T), stats[3][0,0], stats[4][0,0])
@@ -9,7 +9,7 @@ Code contributions by Rutger van Haasteren (piccard) and Justin Ellis (PAL/PAL2)
 """
 
 import numpy as np
-import sys, os, glob
+import sys, os, glob, hashlib
 import libstempo as T2
 import ephem
 import NX01_utils as utils
@@ -669,31 +669,96 @@ class PsrObjFromH5(object):
         self.planet_ssb = None
 
     """
-    Read data from hdf5 file into pulsar object
+    Read the name and sky position of the pulsar, which
+    compressed pulsar files store as well
     """
-    def grab_all_vars(self, rescale=True, sysflag_target=None):
+    def grab_metadata(self):
 
-        print "--> Extracting {0} from hdf5 file".format(self.h5Obj['name'].value)
-
-        # basic quantities
         self.name = self.h5Obj['name'].value
-        self.parfile = self.h5Obj['parfilepath'].value
-        self.timfile = self.h5Obj['timfilepath'].value
+
+        self.psr_locs = self.h5Obj['psrlocs'].value
+        self.raj = self.h5Obj['raj'].value
+        self.decj = self.h5Obj['decj'].value
+        self.elong = self.h5Obj['elong'].value
+        self.elat = self.h5Obj['elat'].value
+
+    """
+    Read the single-pulsar noise values (EFACS, EQUADS, ECORRS and
+    red/DM noise) from the noise file stored in the hdf5 file
+    """
+    def grab_noise_vars(self):
+
         try:
             self.noisefile = self.h5Obj['noisefilepath'].value
         except:
             self.noisefile = None
 
+        self.Redamp = 1e-20
+        self.Redind = 0.0
+        self.DMamp = 1e-20
+        self.DMind = 0.0
+        if self.noisefile is not None:
+            noiselines = self.h5Obj['noisefile'].value.split('\n')
+            efacs = []
+            equads = []
+            ecorrs = []
+            for ll in noiselines:
+                if 'efac' in ll:
+                    efacs.append([ll.split()[0].split('efac-')[1], np.double(ll.split()[1])])
+                if 'equad' in ll:
+                    equads.append([ll.split()[0].split('equad-')[1], 10.0**np.double(ll.split()[1])])
+                if 'jitter' in ll:
+                    ecorrs.append([ll.split()[0].split('jitter_q-')[1], 10.0**np.double(ll.split()[1])])
+
+            self.efacs = OrderedDict(efacs)
+            self.equads = OrderedDict(equads)
+            self.ecorrs = OrderedDict(ecorrs)
+
+            # Let's get the red noise properties from single-pulsar analysis
+            for ll in noiselines:
+                if 'RN-Amplitude' in ll:
+                    self.Redamp = 10.0**np.double(ll.split()[1]) # 1e-6 * f1yr * np.sqrt(12.0*np.pi**2.0) * np.double(ll.split()[1])
+                if 'RN-spectral-index' in ll:
+                    self.Redind = np.double(ll.split()[1])
+                if 'DM-Amplitude' in ll:
+                    # DM-amps use TempoNest convention
+                    self.DMamp = 10.0**np.double(ll.split()[1])
+                if 'DM-spectral-index' in ll:
+                    self.DMind = np.double(ll.split()[1])
+
+    """
+    Digest of the pulsar data (timing solution, number of TOAs and
+    timing-model columns), from the hdf5 meta-data only
+    """
+    def data_digest(self):
+
+        h = hashlib.sha1()
+        h.update(str(self.h5Obj['name'].value))
+        h.update(self.h5Obj['parfile'].value)
+        h.update(str(self.h5Obj['TOAs'].shape))
+        h.update(str(self.h5Obj['GCmatrix'].shape))
+
+        return h.hexdigest()
+
+    """
+    Read data from hdf5 file into pulsar object. With lowmem, the
+    design, G and quantization matrices are left on disk (Gc is then
+    the hdf5 dataset itself) for use with accumulateTtNT.
+    """
+    def grab_all_vars(self, rescale=True, sysflag_target=None, lowmem=False):
+
+        print "--> Extracting {0} from hdf5 file".format(self.h5Obj['name'].value)
+
+        # basic quantities
+        self.grab_metadata()
+        self.parfile = self.h5Obj['parfilepath'].value
+        self.timfile = self.h5Obj['timfilepath'].value
+
         self.toas = self.h5Obj['TOAs'].value
         self.res = self.h5Obj['postfitRes'].value
         self.toaerrs = self.h5Obj['toaErr'].value
         self.obs_freqs = self.h5Obj['freq'].value
 
-        self.psr_locs = self.h5Obj['psrlocs'].value
-        self.raj = self.h5Obj['raj'].value
-        self.decj = self.h5Obj['decj'].value
-        self.elong = self.h5Obj['elong'].value
-        self.elat = self.h5Obj['elat'].value
         self.psrPos = self.h5Obj['psrPos'].value
 
         self.ephemeris = self.h5Obj['ephemeris'].value
@@ -706,16 +771,25 @@ class PsrObjFromH5(object):
         except:
             self.planet_ssb = None
 
-        self.Mmat = self.h5Obj['designmatrix'].value
-        try:
-            self.G = self.h5Obj['Gmatrix'].value
-            self.Gres = self.h5Obj['Gres'].value
-        except:
+        if lowmem:
+            self.Mmat = None
             self.G = None
             self.Gres = None
-        self.Gc = self.h5Obj['GCmatrix'].value
+            self.Gc = self.h5Obj['GCmatrix']
+        else:
+            self.Mmat = self.h5Obj['designmatrix'].value
+            try:
+                self.G = self.h5Obj['Gmatrix'].value
+                self.Gres = self.h5Obj['Gres'].value
+            except:
+                self.G = None
+                self.Gres = None
+            self.Gc = self.h5Obj['GCmatrix'].value
         try:
-            self.Umat = self.h5Obj['QuantMat'].value
+            if lowmem:
+                self.Umat = None
+            else:
+                self.Umat = self.h5Obj['QuantMat'].value
             self.Uinds = self.h5Obj['QuantInds'].value
             self.epflags = self.h5Obj['EpochFlags'].value
             self.detsig_avetoas = self.h5Obj['DetSigAveToas'].value
@@ -781,42 +855,8 @@ class PsrObjFromH5(object):
                 self.parDMind = np.double(ll.split()[1])
 
         # Let's also find single pulsar analysis EFACS, EQUADS, ECORRS
-        self.Redamp = 1e-20
-        self.Redind = 0.0
-        self.DMamp = 1e-20
-        self.DMind = 0.0
+        self.grab_noise_vars()
         if self.noisefile is not None:
-            noiselines = self.h5Obj['noisefile'].value.split('\n')
-            efacs = []
-            equads = []
-            ecorrs = []
-            for ll in noiselines:
-                if 'efac' in ll:
-                    efacs.append([ll.split()[0].split('efac-')[1], np.double(ll.split()[1])])
-                if 'equad' in ll:
-                    equads.append([ll.split()[0].split('equad-')[1], 10.0**np.double(ll.split()[1])])
-                if 'jitter' in ll:
-                    ecorrs.append([ll.split()[0].split('jitter_q-')[1], 10.0**np.double(ll.split()[1])])
-
-            self.efacs = OrderedDict(efacs)
-            self.equads = OrderedDict(equads)
-            self.ecorrs = OrderedDict(ecorrs)
-
-            # Let's get the red noise properties from single-pulsar analysis
-            self.Redamp = 1e-20
-            self.Redind = 0.0
-            self.DMamp = 1e-20
-            self.DMind = 0.0
-            for ll in noiselines:
-                if 'RN-Amplitude' in ll:
-                    self.Redamp = 10.0**np.double(ll.split()[1]) # 1e-6 * f1yr * np.sqrt(12.0*np.pi**2.0) * np.double(ll.split()[1])
-                if 'RN-spectral-index' in ll:
-                    self.Redind = np.double(ll.split()[1])
-                if 'DM-Amplitude' in ll:
-                    # DM-amps use TempoNest convention
-                    self.DMamp = 10.0**np.double(ll.split()[1])
-                if 'DM-spectral-index' in ll:
-                    self.DMind = np.double(ll.split()[1])
 
             # Time to rescale the TOA uncertainties by single-pulsar EFACS and EQUADS
             if sysflag_target is not None:
@@ -953,3 +993,183 @@ class PsrObjFromH5(object):
                 self.Ftot = np.append(self.Ftot, Fband_dummy, axis=1)
 
         self.Te = np.append(self.Gc, self.Ftot, axis=1)
+
+    """
+    Accumulate T^T N^-1 T, T^T N^-1 r, log|N| and r^T N^-1 r chunk by
+    chunk, reading the timing-model columns from the hdf5 file and
+    building the Fourier columns on the fly, so that the full basis is
+    never held in memory. Chunk edges are moved to ECORR epoch edges,
+    so that each epoch's Sherman-Morrison update stays within a chunk.
+    Keyword arguments are passed on to makeTe.
+
+    @param Jamp: ECORR variance of each epoch in Uinds (None for no ECORR)
+    @param chunksize: approximate number of TOAs per chunk
+    """
+    def accumulateTtNT(self, Jamp=None, chunksize=10000, **makeTe_args):
+
+        ntoa = len(self.toas)
+        Nvec = self.toaerrs**2.0
+
+        TtNT = 0.0
+        d = 0.0
+        logdet_N = 0.0
+        dtNdt = 0.0
+
+        start = 0
+        while start < ntoa:
+
+            stop = min(start + chunksize, ntoa)
+            if Jamp is not None:
+                # don't split an epoch
+                kk = np.searchsorted(self.Uinds[:,1], stop)
+                if kk < len(self.Uinds) and self.Uinds[kk,0] < stop:
+                    stop = self.Uinds[kk,1]
+
+            # basis for this chunk of TOAs
+            chunk = PsrObjFromH5(self.h5Obj)
+            chunk.toas = self.toas[start:stop]
+            chunk.obs_freqs = self.obs_freqs[start:stop]
+            chunk.psrPos = self.psrPos[start:stop,:]
+            chunk.elong = self.elong
+            chunk.elat = self.elat
+            chunk.Gc = self.Gc[start:stop,:]
+            chunk.makeTe(**makeTe_args)
+
+            T = chunk.Te
+            res = self.res[start:stop]
+            wgt = 1.0 / Nvec[start:stop]
+
+            Tw = (wgt * T.T).T
+            TtNT = TtNT + np.dot(T.T, Tw)
+            d = d + np.dot(Tw.T, res)
+            dtNdt += np.sum(wgt * res**2.0)
+            logdet_N += np.sum(np.log(Nvec[start:stop]))
+
+            if Jamp is not None:
+                # Sherman-Morrison update for the epochs in this chunk
+                eps = np.flatnonzero((self.Uinds[:,0] >= start) &
+                                     (self.Uinds[:,1] <= stop))
+                if len(eps) > 0:
+                    ep_start = self.Uinds[eps,0] - start
+                    ep_stop = self.Uinds[eps,1] - start
+
+                    cum_T = np.vstack([np.zeros(T.shape[1]), np.cumsum(Tw, axis=0)])
+                    cum_r = np.append(0.0, np.cumsum(wgt * res))
+                    cum_w = np.append(0.0, np.cumsum(wgt))
+
+                    sT = cum_T[ep_stop,:] - cum_T[ep_start,:]
+                    sr = cum_r[ep_stop] - cum_r[ep_start]
+                    sw = cum_w[ep_stop] - cum_w[ep_start]
+
+                    beta = Jamp[eps] / (1.0 + Jamp[eps] * sw)
+
+                    TtNT -= np.dot(sT.T, (beta * sT.T).T)
+                    d -= np.dot(sT.T, beta * sr)
+                    dtNdt -= np.sum(beta * sr**2.0)
+                    logdet_N += np.sum(np.log(1.0 + Jamp[eps] * sw))
+
+            start = stop
+
+        # empty placeholder that only carries the column layout of the basis
+        self.Te = np.zeros((0, TtNT.shape[0]))
+
+        return TtNT, d, logdet_N, dtNdt
+
+
+######################
+######################
+
+class PsrObjCompressed(PsrObjFromH5):
+    TtNT = None
+    d = None
+    logdet_N = None
+    dtNdt = None
+    ntoa = None
+    ntm = None
+    nbasis = None
+    tmin = None
+    tmax = None
+
+    def __init__(self, h5Obj):
+        PsrObjFromH5.__init__(self, h5Obj)
+        self.TtNT = None
+        self.d = None
+        self.logdet_N = None
+        self.dtNdt = None
+        self.ntoa = None
+        self.ntm = None
+        self.nbasis = None
+        self.tmin = None
+        self.tmax = None
+
+    """
+    Read pulsar meta-data from compressed hdf5 file. Arguments
+    mirror PsrObjFromH5; the white noise is already folded into
+    the stored products, so they are ignored. No TOAs are stored,
+    only their number and the first and last TOA (for the Tspan).
+    """
+    def grab_all_vars(self, rescale=True, sysflag_target=None, lowmem=False):
+
+        print "--> Extracting {0} from compressed hdf5 file".format(self.h5Obj['name'].value)
+
+        self.grab_metadata()
+
+        self.ntoa = int(self.h5Obj['ntoa'].value)
+        self.tmin = self.h5Obj['tmin'].value
+        self.tmax = self.h5Obj['tmax'].value
+
+        self.parRedamp = self.h5Obj['parRedamp'].value
+        self.parRedind = self.h5Obj['parRedind'].value
+        self.parDMamp = self.h5Obj['parDMamp'].value
+        self.parDMind = self.h5Obj['parDMind'].value
+        self.Redamp = self.h5Obj['Redamp'].value
+        self.Redind = self.h5Obj['Redind'].value
+        self.DMamp = self.h5Obj['DMamp'].value
+        self.DMind = self.h5Obj['DMind'].value
+
+        print "--> Done extracting pulsar from compressed hdf5 file :-) \n"
+
+    """
+    Read the white-noise sufficient statistics for a given model
+    configuration (see DataFile.addCompressedPulsar), after checking
+    that they were computed with the current noise values and data
+
+    @param configkey:   Name of the basis configuration
+    @param srcPsr:      PsrObjFromH5 of the pulsar file, with grab_noise_vars done
+    @param pshift_vals: Random phase shifts of the red-noise basis
+    """
+    def grab_compressed_vars(self, configkey, srcPsr, pshift_vals=None):
+
+        if configkey not in self.h5Obj:
+            raise KeyError("No compressed products for {0} with model "
+                           "configuration {1}".format(self.name, configkey))
+
+        group = self.h5Obj[configkey]
+
+        stale = []
+        for field in ['efacs', 'equads', 'ecorrs']:
+            current = getattr(srcPsr, field)
+            if current is None:
+                current = OrderedDict()
+            if list(group[field+'_sys'].value) != current.keys() or \
+              not np.array_equal(group[field].value, current.values()):
+                stale.append(field)
+        if pshift_vals is not None and \
+          not np.array_equal(group['pshift_vals'].value, pshift_vals):
+            stale.append('pshift_vals')
+        if group['datadigest'].value != srcPsr.data_digest():
+            stale.append('data')
+
+        if len(stale) > 0:
+            raise ValueError("Compressed products for {0} were computed with "
+                             "different {1} than in the current pulsar "
+                             "files".format(self.name, ', '.join(stale)))
+
+        self.TtNT = group['TtNT'].value
+        self.d = group['d'].value
+        self.logdet_N = group['logdet_N'].value
+        self.dtNdt = group['dtNdt'].value
+
+        # columns of the basis [Gc | Ftot] used to build the products
+        self.ntm = int(group['ntm'].value)
+        self.nbasis = self.TtNT.shape[0]
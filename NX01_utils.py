@@ -12,6 +12,7 @@ import numpy as np
 from numpy import *
 import os
 import math
+import hashlib
 from scipy import integrate
 from scipy.integrate import odeint
 from scipy import optimize
@@ -19,7 +20,9 @@ from scipy import constants as sc
 from numpy import random
 from scipy import special as ss
 from scipy import linalg as sl
+from scipy import sparse as sps
 from scipy.interpolate import interp1d
+from collections import OrderedDict
 from pkg_resources import resource_filename, Requirement
 import numexpr as ne
 import optparse
@@ -200,6 +203,58 @@ def ssephem_physical_model(x, mjd, earth, jupiter, saturn,
     return earth
 
 
+def ssephem_physical_jacobian(mjd, earth, jupiter, saturn,
+                              uranus, neptune, psrpos,
+                              incJuporb=False, jup_orbmodel='orbelements', jup_orbelxyz=None, jup_mjd=None,
+                              incSatorb=False, sat_orbmodel='orbelements', sat_orbelxyz=None, sat_mjd=None,
+                              equatorial=True):
+    """
+    Jacobian of the projected Roemer-delay perturbation of
+    ssephem_physical_model, taken at zero perturbation. The mass
+    and orbital-element terms are exactly linear; the frame-rate
+    and orbit-angle rotations are linearized.
+
+    @param mjd: TOAs (or epochs) [MJD]
+    @param earth, jupiter, ...: (n,3) SSB position arrays
+    @param psrpos: (n,3) pulsar position unit vectors
+
+    @return: (n, nparams) matrix, such that the change in
+             Roemer delay is np.dot(jacobian, x)
+
+    """
+
+    # generators of infinitesimal rotations about x, y, z
+    Gx = np.array([[0.,0.,0.],[0.,0.,-1.],[0.,1.,0.]])
+    Gy = np.array([[0.,0.,1.],[0.,0.,0.],[-1.,0.,0.]])
+    Gz = np.array([[0.,-1.,0.],[1.,0.,0.],[0.,0.,0.]])
+
+    cols = []
+
+    # frame rotation rate
+    if equatorial:
+        dearth = ecl2eq_vec(np.einsum('jk,ik->ij', Gz, eq2ecl_vec(earth)))
+    else:
+        dearth = np.einsum('jk,ik->ij', Gz, earth)
+    cols.append(dearth * ((mjd - t_offset) / 365.25)[:,None])
+
+    # planet masses
+    cols += [jupiter, saturn, uranus, neptune]
+
+    for incOrb, orbmodel, planet, orbelxyz, orb_mjd, mass in \
+      [(incJuporb, jup_orbmodel, jupiter, jup_orbelxyz, jup_mjd, 0.0009547918983127075),
+       (incSatorb, sat_orbmodel, saturn, sat_orbelxyz, sat_mjd, 0.00028588567008942334)]:
+        if incOrb:
+            if orbmodel == 'angles':
+                cols += [mass * np.einsum('jk,ik->ij', G, planet)
+                         for G in [Gx, Gy, Gz]]
+            elif orbmodel == 'orbelements':
+                cols += [mass * np.array([np.interp(mjd, orb_mjd, orbelxyz[kk,:,aa])
+                                          for aa in range(3)]).T
+                         for kk in range(6)]
+
+    return np.array([np.einsum('ij,ij->i', col, psrpos) for col in cols]).T
+
+
 def sumTermCovarianceMatrix_fast(tm, fL, gam):
     """
     Calculate the power series expansion for the Hypergeometric
@@ -442,6 +497,310 @@ def createFourierDesignmatrix_eph(t, fqs, wgts, psrPos,
     else:
         return Fx, Fy, Fz
 
+
+def marginalizeTimingModel(TtNT, d, ntm):
+    """
+    Analytically marginalize the timing-model block of the
+    basis T = [M | F] by taking the Schur complement of
+    M^T N^-1 M. Only the stochastic block then needs to be
+    factorized in the likelihood.
+
+    @param TtNT: T^T N^-1 T with the first ntm columns of T
+                 being the timing-model design matrix
+    @param d: T^T N^-1 r
+    @param ntm: number of timing-model columns
+
+    @return: TtNT_red: F^T N^-1 F conditioned on the timing model
+    @return: d_red: F^T N^-1 r conditioned on the timing model
+    @return: lnlike_tm: additive log-likelihood term
+    @return: tm_proj: (cholesky of M^T N^-1 M, (M^T N^-1 M)^-1 M^T N^-1 F,
+                       log determinant of M^T N^-1 M) for reuse
+                       with new residuals
+
+    """
+
+    A = TtNT[:ntm,:ntm]
+    B = TtNT[:ntm,ntm:]
+
+    cfA = sl.cho_factor(A)
+    AinvB = sl.cho_solve(cfA, B)
+    logdet_A = np.sum(2*np.log(np.diag(cfA[0])))
+
+    TtNT_red = TtNT[ntm:,ntm:] - np.dot(B.T, AinvB)
+
+    tm_proj = (cfA, AinvB, logdet_A)
+    d_red, dAd = projectTimingModel(d, ntm, tm_proj)
+
+    return TtNT_red, d_red, -0.5*logdet_A + 0.5*dAd, tm_proj
+
+
+def projectTimingModel(d, ntm, tm_proj):
+    """
+    Condition T^T N^-1 r on the timing model, reusing the
+    products from marginalizeTimingModel.
+
+    @param d: T^T N^-1 r
+    @param ntm: number of timing-model columns
+    @param tm_proj: last output of marginalizeTimingModel
+
+    @return: d_red: F^T N^-1 r conditioned on the timing model
+    @return: dAd: r^T N^-1 M (M^T N^-1 M)^-1 M^T N^-1 r
+
+    """
+
+    cfA, AinvB = tm_proj[0], tm_proj[1]
+
+    dM = d[:ntm]
+    d_red = d[ntm:] - np.dot(AinvB.T, dM)
+    dAd = np.dot(dM, sl.cho_solve(cfA, dM))
+
+    return d_red, dAd
+
+
+def marginalizeLinearSignal(BNB, BNr, CSC, CSd, phiinv):
+    """
+    Extra log-likelihood from a linear signal B*a shared by all
+    pulsars, with Gaussian prior a ~ N(0, diag(1/phiinv)), given
+    the already-factorized Sigma of the stochastic basis
+    (Schur complement of the bordered Sigma).
+
+    @param BNB: B^T N^-1 B summed over pulsars
+    @param BNr: B^T N^-1 r summed over pulsars
+    @param CSC: C^T Sigma^-1 C, with C = T^T N^-1 B
+    @param CSd: C^T Sigma^-1 d
+    @param phiinv: inverse prior variances of a
+
+    @return: log-likelihood increment
+
+    """
+
+    S = BNB + np.diag(phiinv) - CSC
+    u = BNr - CSd
+
+    cf = sl.cho_factor(S)
+    logdet_S = np.sum(2*np.log(np.diag(cf[0])))
+
+    return -0.5 * (logdet_S - np.sum(np.log(phiinv))) + \
+      0.5 * np.dot(u, sl.cho_solve(cf, u))
+
+
+def marginalizePulsarPhase(rB, BB, ngrid=64):
+    """
+    Extra log-likelihood from a pulsar-term signal
+    B[:,0]*cos(psi) + B[:,1]*sin(psi), averaged over a uniform
+    phase psi in [0, 2pi). The integrand is periodic and smooth,
+    so the trapezoid rule on a regular grid converges exponentially.
+
+    @param rB: (r|B), noise-weighted inner products of the residuals
+               with the two basis vectors
+    @param BB: (B|B), 2x2 matrix of noise-weighted inner products
+    @param ngrid: number of phase samples
+
+    @return: log-likelihood increment
+
+    """
+
+    psi = np.linspace(0.0, 2.0*np.pi, ngrid, endpoint=False)
+    x = np.array([np.cos(psi), np.sin(psi)])
+
+    lnl = np.dot(rB, x) - 0.5 * np.sum(x * np.dot(BB, x), axis=0)
+    lnl_max = np.max(lnl)
+
+    return lnl_max + np.log(np.mean(np.exp(lnl - lnl_max)))
+
+
+class BlockSigma(object):
+    """
+    Block-sparse layout of Sigma = T^T N^-1 T + Phi^-1 for processes
+    correlated between pulsars. Each pulsar contributes a dense block
+    along the diagonal, and pulsars are only coupled through the same
+    stochastic mode, so no dense block_diag of T^T N^-1 T is needed.
+    The sparsity pattern is fixed, so it is set up (along with the
+    CHOLMOD symbolic analysis) only once.
+
+    @param sizes: number of columns of each pulsar's basis
+    @param offsets: column of the first stochastic mode in each basis
+    @param mode_count: number of stochastic modes in each basis
+
+    """
+
+    def __init__(self, sizes, offsets, mode_count):
+
+        self.npsr = len(sizes)
+        self.mode_count = mode_count
+        self.starts = np.append(0, np.cumsum(sizes)).astype(int)
+        self.shape = (self.starts[-1], self.starts[-1])
+
+        # global index of each pulsar's stochastic modes
+        self.ind = np.array([np.arange(self.starts[ii]+offsets[ii],
+                                       self.starts[ii]+offsets[ii]+mode_count)
+                             for ii in range(self.npsr)])
+
+        # (row, col) of every entry of the pulsar blocks...
+        self.block_rows = []
+        self.block_cols = []
+        for ii in range(self.npsr):
+            rr_tmp, cc_tmp = np.meshgrid(np.arange(self.starts[ii], self.starts[ii+1]),
+                                         np.arange(self.starts[ii], self.starts[ii+1]),
+                                         indexing='ij')
+            self.block_rows.append(rr_tmp.ravel())
+            self.block_cols.append(cc_tmp.ravel())
+        self.block_rows = np.concatenate(self.block_rows)
+        self.block_cols = np.concatenate(self.block_cols)
+
+        # ...and of Phi^-1, laid out as (npsr, npsr, mode_count)
+        self.phi_rows = np.broadcast_to(self.ind[:,None,:],
+                                        (self.npsr, self.npsr, mode_count))
+        self.phi_cols = np.broadcast_to(self.ind[None,:,:],
+                                        (self.npsr, self.npsr, mode_count))
+
+        # compressed-sparse-column pattern, where entry k of
+        # the concatenated (blocks, Phi^-1) values ends up
+        rows = np.concatenate([self.block_rows, self.phi_rows.ravel()])
+        cols = np.concatenate([self.block_cols, self.phi_cols.ravel()])
+        keys, self.csc_map = np.unique(cols * self.shape[0] + rows,
+                                       return_inverse=True)
+        self.csc_indices = keys % self.shape[0]
+        self.csc_indptr = np.searchsorted(keys // self.shape[0],
+                                          np.arange(self.shape[1]+1))
+
+        self.factor = None
+
+    def dense(self, blocks, phiinv):
+        """
+        Assemble dense Sigma.
+
+        @param blocks: list of per-pulsar T^T N^-1 T
+        @param phiinv: (mode_count, npsr, npsr) inverse of Phi per mode
+
+        """
+
+        Sigma = np.zeros(self.shape)
+        for ii in range(self.npsr):
+            Sigma[self.starts[ii]:self.starts[ii+1],
+                  self.starts[ii]:self.starts[ii+1]] = blocks[ii]
+
+        Sigma[self.phi_rows, self.phi_cols] += phiinv.transpose(1,2,0)
+
+        return Sigma
+
+    def sparse(self, blocks, phiinv):
+        """
+        Assemble Sigma in compressed sparse column format,
+        without any dense intermediate.
+
+        @param blocks: list of per-pulsar T^T N^-1 T
+        @param phiinv: (mode_count, npsr, npsr) inverse of Phi per mode
+
+        """
+
+        data = np.concatenate([np.ravel(blk) for blk in blocks] +
+                              [phiinv.transpose(1,2,0).ravel()])
+
+        # duplicate entries are summed
+        data = np.bincount(self.csc_map, weights=data,
+                           minlength=len(self.csc_indices))
+
+        return sps.csc_matrix((data, self.csc_indices, self.csc_indptr),
+                              shape=self.shape)
+
+    def cholmod(self, blocks, phiinv):
+        """
+        Sparse (CHOLMOD) Cholesky factor of Sigma. The fill-reducing
+        ordering and symbolic analysis are done on the first call;
+        later calls only refactorize numerically.
+
+        @param blocks: list of per-pulsar T^T N^-1 T
+        @param phiinv: (mode_count, npsr, npsr) inverse of Phi per mode
+
+        """
+
+        import sksparse.cholmod as sks
+
+        Sigma = self.sparse(blocks, phiinv)
+        if self.factor is None:
+            self.factor = sks.analyze(Sigma)
+
+        try:
+            self.factor.cholesky_inplace(Sigma)
+        except sks.CholmodError:
+            raise np.linalg.LinAlgError('Sigma is not positive definite')
+
+        return self.factor
+
+
+class PsrFactorCache(object):
+    """
+    Per-pulsar memory of expensive likelihood products, keyed on the
+    parameter sub-vector they were computed from. A few entries are
+    kept per pulsar so that both the current chain position and the
+    last (possibly rejected) proposal are remembered.
+
+    """
+
+    def __init__(self, npsr, size=2):
+
+        self.size = size
+        self.keys = [[] for ii in range(npsr)]
+        self.vals = [[] for ii in range(npsr)]
+
+    def get(self, ii, key):
+        """
+        Return the stored products of pulsar ii for this parameter
+        sub-vector, or None if they have to be recomputed.
+
+        """
+
+        key = np.ascontiguousarray(key, dtype=np.float64).tostring()
+        for kk, stored in enumerate(self.keys[ii]):
+            if stored == key:
+                # most recently used goes to the front
+                self.keys[ii].insert(0, self.keys[ii].pop(kk))
+                self.vals[ii].insert(0, self.vals[ii].pop(kk))
+                return self.vals[ii][0]
+
+        return None
+
+    def put(self, ii, key, val):
+
+        key = np.ascontiguousarray(key, dtype=np.float64).tostring()
+        self.keys[ii].insert(0, key)
+        self.vals[ii].insert(0, val)
+        del self.keys[ii][self.size:]
+        del self.vals[ii][self.size:]
+
+
+def whiteNoiseHash(psr, configkey, pshift_vals=None):
+    """
+    Hash all inputs that determine a pulsar's basis matrix and
+    fixed white-noise products, to key a persistent cache.
+
+    @param psr: pulsar object
+    @param configkey: string describing the basis configuration
+                      (number of modes, Tspan, etc.)
+    @param pshift_vals: random phase shifts of the red-noise basis
+
+    @return: hex digest
+
+    """
+
+    h = hashlib.sha1()
+    h.update(str(psr.name))
+    h.update(configkey)
+
+    # TOAs, residuals, (rescaled) errors and timing model
+    for arr in [psr.toas, psr.res, psr.toaerrs, psr.obs_freqs,
+                psr.psrPos, psr.Gc, pshift_vals]:
+        if arr is not None:
+            h.update(np.ascontiguousarray(arr).tostring())
+
+    ecorrs = getattr(psr, 'ecorrs', None)
+    if ecorrs is not None:
+        h.update(str(sorted(ecorrs.items())))
+
+    return h.hexdigest()
+
+
 def quantize_fast(times, dt=1.0, calci=False):
     """
     Adapted from libstempo: produce the quantisation matrix fast
@@ -708,6 +1067,27 @@ def quant2ind(U):
     return inds
 
 
+def ind2epoch(inds, ntoa):
+
+    """
+    Epoch index of every TOA, so that epoch-averaged quantities are
+    expanded to the TOAs with a single np.take
+    :param inds:    Index version of the quantization matrix (quant2ind)
+    :param ntoa:    Number of TOAs
+
+    :return:        Integer array of length ntoa
+
+    Every TOA is assumed to belong to one epoch, as for the full
+    (un-reduced) quantization matrix
+    """
+
+    epind = np.zeros(ntoa, dtype=np.int)
+    for cc, (start, stop) in enumerate(inds):
+        epind[start:stop] = cc
+
+    return epind
+
+
 def quantreduce(U, eat, flags, calci=False):
 
     """
@@ -800,8 +1180,12 @@ def make_ecc_interpolant():
 
     return interp1d(fil[:,0], fil[:,1])
 
-# get interpolant for eccentric binaries
-ecc_interp = make_ecc_interpolant()
+# interpolant for eccentric binaries, built on first use
+ecc_interp = None
+
+# most recently used harmonic shapes, keyed on (e, nharm)
+harm_cache = OrderedDict()
+harm_cache_size = 64
 
 def get_edot(F, mc, e):
 
@@ -990,6 +1374,108 @@ def solve_coupled_ecc_solution(F0, e0, gamma0, phase0, mc, q, t):
     return ret
 
 
+# table of the Peters (1964) eccentricity integral, built on first use
+peters_table = None
+
+def make_peters_table(emin=1e-6, emax=0.999, npts=2000):
+
+    """
+    Tabulate the integral I(e) that maps eccentricity onto
+    dimensionless time along a Peters (1964) inspiral. Along an
+    inspiral x = 2 pi mc F and e are tied by x = K sigma(e)^(-3/2),
+    and tau = t / mc changes by -(15/304) K^(-8/3) dI. The table
+    is the same for every binary.
+
+    :param emin: Smallest tabulated eccentricity
+    :param emax: Largest tabulated eccentricity
+    :param npts: Number of table points
+
+    :returns: interpolants log I(log e) and log e(log I), and the
+              range of log I covered
+    """
+
+    integrand = lambda e: peters_sigma(e)**4 * (1-e**2)**(5/2) / \
+      (e * (1 + 121/304*e**2))
+
+    egrid = np.logspace(np.log10(emin), np.log10(emax), npts)
+
+    # leading-order behaviour below emin
+    Igrid = np.zeros(npts)
+    Igrid[0] = 19/48 * emin**(48/19)
+    for ii in range(1,npts):
+        Igrid[ii] = Igrid[ii-1] + integrate.quad(integrand, egrid[ii-1], egrid[ii],
+                                                 epsabs=0.0, epsrel=1e-12)[0]
+
+    logI = interp1d(np.log(egrid), np.log(Igrid), kind='cubic')
+    loge = interp1d(np.log(Igrid), np.log(egrid), kind='cubic')
+
+    return logI, loge, (np.log(Igrid[0]), np.log(Igrid[-1]))
+
+
+def peters_sigma(e):
+
+    """
+    Eccentricity dependence of the semi-major axis along a
+    Peters (1964) inspiral.
+
+    :param e: Orbital eccentricity
+
+    :returns: a / c0
+    """
+
+    return e**(12/19) / (1-e**2) * (1 + 121/304*e**2)**(870/2299)
+
+
+def evolve_binary_table(F0, e0, mc, t, noEccEvolve=False):
+
+    """
+    Orbital frequency and eccentricity a time t away from (F0, e0),
+    from the closed-form circular / constant-eccentricity solution or
+    the tabulated Peters integral. Phases are not evolved.
+
+    :param F0: Initial orbital frequency [Hz]
+    :param e0: Initial orbital eccentricity
+    :param mc: Chirp mass of binary [Solar Mass]
+    :param t: Time offset [s]
+    :param noEccEvolve: Keep the eccentricity fixed
+
+    :returns: (F(t), e(t)), or None if outside the table
+              (use solve_coupled_ecc_solution instead)
+    """
+
+    global peters_table
+
+    mc = mc * SOLAR2S
+    x0 = 2*np.pi*mc*F0
+    tau = t / mc
+
+    if noEccEvolve or e0 == 0.0:
+
+        fe = (1 + 73/24*e0**2 + 37/96*e0**4) / ((1-e0**2)**(7/2))
+        val = x0**(-8/3) - 256/5 * fe * tau
+        if val <= 0.0:
+            return None
+
+        return val**(-3/8) / (2*np.pi*mc), e0
+
+    if peters_table is None:
+        peters_table = make_peters_table()
+    logI, loge, logIrange = peters_table
+
+    if np.log(e0) < logI.x[0] or np.log(e0) > logI.x[-1]:
+        return None
+
+    K = x0 * peters_sigma(e0)**(3/2)
+    Ip = np.exp(logI(np.log(e0))) - 304/15 * K**(8/3) * tau
+    if Ip <= 0.0 or np.log(Ip) < logIrange[0] or np.log(Ip) > logIrange[1]:
+        return None
+
+    ep = np.exp(loge(np.log(Ip)))
+    xp = K * peters_sigma(ep)**(-3/2)
+
+    return xp / (2*np.pi*mc), ep
+
+
 def get_an(n, mc, dl, h0, F, e):
 
     """
@@ -1082,13 +1568,90 @@ def get_cn(n, mc, dl, h0, F, e):
 
     return ret
 
-def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc):
+def get_harmonic_shapes(e, nharm):
+
+    """
+    Eccentricity dependence of the harmonic amplitudes of
+    Eq. 22 of Taylor et al. (2015), for harmonics 1..nharm-1.
+    With A = mc^(5/3) omega^(2/3) / dl (or h0/2),
+    a_n = n A ahat_n, b_n = n A bhat_n and c_n = 2 A chat_n / omega.
+    Results are memoized on (e, nharm).
+
+    :param e: Orbital Eccentricity
+    :param nharm: Total number of harmonics to use
+
+    :returns: ahat, bhat, chat
+
+    """
+
+    key = (float(e), int(nharm))
+    if key in harm_cache:
+        shapes = harm_cache.pop(key)
+        harm_cache[key] = shapes
+        return shapes
+
+    n = np.arange(1, nharm)
+    jm2, jm1, j0, jp1, jp2 = [ss.jn(n+kk, n*e) for kk in [-2, -1, 0, 1, 2]]
+
+    ahat = -(jm2 - 2*e*jm1 + (2/n)*j0 + 2*e*jp1 - jp2)
+    bhat = -np.sqrt(1-e**2) * (jm2 - 2*j0 + jp2)
+    chat = j0 / n
+
+    shapes = (ahat, bhat, chat)
+    for arr in shapes:
+        arr.flags.writeable = False
+
+    harm_cache[key] = shapes
+    if len(harm_cache) > harm_cache_size:
+        harm_cache.popitem(last=False)
+
+    return shapes
+
+
+def get_nharm(e, nmax, useFile=True):
+
+    """
+    Number of harmonics needed to describe a binary of
+    eccentricity e.
+
+    :param e: Orbital eccentricity
+    :param nmax: Maximum number of harmonics
+    :param useFile: Use pre-computed table of number of harmonics vs eccentricity
+
+    :returns: number of harmonics (+1, as used by calculate_splus_scross)
+
+    """
+
+    global ecc_interp
+
+    if useFile:
+        if e > 0.001 and e < 0.999:
+            if ecc_interp is None:
+                ecc_interp = make_ecc_interpolant()
+            nharm = min(int(ecc_interp(e)), nmax) + 1
+        elif e <= 0.001:
+            nharm = 3
+        else:
+            nharm = nmax
+    else:
+        nharm = nmax
+
+    return nharm
+
+
+def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc,
+                           chunk=4096, nblock=64):
 
     """
     Calculate splus and scross summed over all harmonics.
     This waveform differs slightly from that in Taylor et al (2015)
     in that it includes the time dependence of the advance of periastron.
 
+    The harmonic sums are polynomials in exp(i*l(t)); powers are
+    generated by complex rotation in blocks of nblock harmonics, and
+    the TOAs are processed in chunks, so that no (nTOA x nharm)
+    array is formed.
+
     :param nmax: Total number of harmonics to use
     :param mc: Chirp mass of binary [Solar Mass]
     :param dl: Luminosity distance [Mpc]
@@ -1099,49 +1662,63 @@ def calculate_splus_scross(nmax, mc, dl, h0, F, e, t, l0, gamma, gammadot, inc):
     :param gamma: Angle of periastron advance [rad]
     :param gammadot: Time derivative of angle of periastron advance [rad/s]
     :param inc: Inclination angle [rad]
+    :param chunk: Number of TOAs processed at once
+    :param nblock: Number of harmonics per block of powers
 
     """
     n = np.arange(1, nmax)
+    omega = 2*np.pi*F
 
     # time dependent amplitudes
-    an = get_an(n, mc, dl, h0, F, e)
-    bn = get_bn(n, mc, dl, h0, F, e)
-    cn = get_cn(n, mc, dl, h0, F, e)
+    if h0 is None:
+        amp = (mc*SOLAR2S)**(5/3) * omega**(2/3) / (dl*MPC2S)
+    elif h0 is not None:
+        amp = h0 / 2.0
 
-    # time dependent terms
-    omega = 2*np.pi*F
-    gt = gamma + gammadot * t
-    lt = l0 + omega * t
+    ahat, bhat, chat = get_harmonic_shapes(e, nmax)
+    an = amp * n * ahat
+    bn = amp * n * bhat
+    cn = 2 * amp * chat / omega
+
+    # coefficients of exp(i*n*l) in the (l - 2g), (l + 2g)
+    # and periastron-independent sums
+    coeffs = np.array([(an - bn) / (n*omega - 2*gammadot),
+                       (an + bn) / (n*omega + 2*gammadot),
+                       cn]).T
+
+    cosinc = np.cos(inc)
+    nharm = len(n)
+
+    t = np.atleast_1d(t)
+    splus = np.zeros(len(t))
+    scross = np.zeros(len(t))
+    for start in range(0, len(t), chunk):
 
-    # tiled phase
-    phase1 = n * np.tile(lt, (nmax-1,1)).T
-    phase2 = np.tile(gt, (nmax-1,1)).T
+        tt = t[start:start+chunk]
 
-    sinp1 = np.sin(phase1)
-    cosp1 = np.cos(phase1)
-    sinp2 = np.sin(2*phase2)
-    cosp2 = np.cos(2*phase2)
+        # time dependent terms
+        zl = np.exp(1j*(l0 + omega * tt))
+        z2g = np.exp(2j*(gamma + gammadot * tt))
 
-    sinpp = sinp1*cosp2 + cosp1*sinp2
-    cospp = cosp1*cosp2 - sinp1*sinp2
-    sinpm = sinp1*cosp2 - cosp1*sinp2
-    cospm = cosp1*cosp2 + sinp1*sinp2
+        # exp(i*k*l) for k = 1..nblock, and the step between blocks
+        zpow = np.cumprod(np.repeat(zl[:,None], min(nblock, nharm), axis=1), axis=1)
+        zstep = zpow[:,-1]
 
-    # intermediate terms
-    sp = sinpm/(n*omega-2*gammadot) + \
-      sinpp/(n*omega+2*gammadot)
-    sm = sinpm/(n*omega-2*gammadot) - \
-      sinpp/(n*omega+2*gammadot)
-    cp = cospm/(n*omega-2*gammadot) + \
-      cospp/(n*omega+2*gammadot)
-    cm = cospm/(n*omega-2*gammadot) - \
-      cospp/(n*omega+2*gammadot)
+        sums = np.zeros((len(tt),3), dtype=np.complex128)
+        zshift = np.ones(len(tt), dtype=np.complex128)
+        for jj in range(0, nharm, nblock):
+            kk = min(nblock, nharm-jj)
+            sums += zshift[:,None] * np.dot(zpow[:,:kk], coeffs[jj:jj+kk])
+            zshift *= zstep
 
-    splus_n = -0.5 * (1+np.cos(inc)**2) * (an*sp - bn*sm) + \
-            (1-np.cos(inc)**2)*cn * sinp1
-    scross_n = np.cos(inc) * (an*cm - bn*cp)
+        sm2g = sums[:,0] * np.conj(z2g)
+        sp2g = sums[:,1] * z2g
 
-    return np.sum(splus_n, axis=1), np.sum(scross_n, axis=1)
+        splus[start:start+chunk] = -0.5 * (1+cosinc**2) * (sm2g.imag + sp2g.imag) + \
+          (1-cosinc**2) * sums[:,2].imag
+        scross[start:start+chunk] = cosinc * (sm2g.real - sp2g.real)
+
+    return splus, scross
 
 
 def fplus_fcross(psr, gwtheta, gwphi):
@@ -1276,15 +1853,8 @@ def ecc_cgw_signal(psr, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
 
     if nset is not None:
         nharm = nset
-    elif useFile:
-        if e0 > 0.001 and e0 < 0.999:
-            nharm = min(int(ecc_interp(e0)), nmax) + 1
-        elif e0 <= 0.001:
-            nharm = 3
-        else:
-            nharm = nmax
     else:
-        nharm = nmax
+        nharm = get_nharm(e0, nmax, useFile)
 
     ##### earth term #####
     splus, scross = calculate_splus_scross(nharm, mc, dist, h0, F, e0,
@@ -1296,10 +1866,67 @@ def ecc_cgw_signal(psr, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
         # convert units
         if pd is None:
             pd = p.h5Obj['pdist'].value
-        pd *= KPC2S   # convert from kpc to seconds
 
-        # get pulsar time
-        tp = toas - pd * (1-cosMu)
+        pterm = cgw_pulsar_term(toas, cosMu, pd, mc, dist, h0, F, inc,
+                                gamma0, e0, l0, q, nmax=nmax, gpx=gpx, lpx=lpx,
+                                periEv=periEv, useFile=useFile,
+                                noEccEvolve=noEccEvolve)
+
+        if pterm is not None:
+            splusp, scrossp = pterm
+
+            rr = (fplus*cos2psi - fcross*sin2psi) * (splusp - splus) + \
+                    (fplus*sin2psi + fcross*cos2psi) * (scrossp - scross)
+
+        else:
+            rr = np.zeros(len(toas))
+
+    else:
+
+        rr = - (fplus*cos2psi - fcross*sin2psi) * splus - \
+                (fplus*sin2psi + fcross*cos2psi) * scross
+
+    return rr
+
+
+def cgw_pulsar_term(toas, cosMu, pd, mc, dist, h0, F, inc, gamma0,
+                    e0, l0, q, nmax=100, gpx=None, lpx=None, periEv=True,
+                    useFile=True, noEccEvolve=False, evolveTable=False):
+
+    """
+    Pulsar-term splus and scross of an eccentric SMBHB, with the
+    binary evolved back by the Earth-pulsar light-travel time.
+
+    :param toas: TOAs relative to the reference time [s]
+    :param cosMu: Cosine of the angle between the pulsar and the GW source
+    :param pd: Pulsar distance [kpc]
+    :param evolveTable: Look up the pulsar-term frequency and eccentricity
+                        (evolve_binary_table) when gpx and lpx are given,
+                        instead of integrating the ODEs
+
+    (other parameters as in ecc_cgw_signal)
+
+    :returns: (splus, scross), or None if the binary
+              could not be evolved to the pulsar term
+
+    """
+
+    pd = pd * KPC2S   # convert from kpc to seconds
+
+    # get pulsar time
+    tp = toas - pd * (1-cosMu)
+
+    y = None
+    if evolveTable and gpx is not None and lpx is not None:
+        y = evolve_binary_table(F, e0, mc, tp.min(), noEccEvolve=noEccEvolve)
+
+    if y is not None:
+
+        # the pulsar-term phases are free parameters
+        Fp, ep = y
+        gp, lp = gpx, lpx
+
+    else:
 
         # solve coupled system of equations to get pulsar term values
         if noEccEvolve:
@@ -1310,55 +1937,338 @@ def ecc_cgw_signal(psr, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
                                            np.array([0.0, tp.min()]))
 
         # get pulsar term values
-        if np.any(y):
-            if noEccEvolve:
-                Fp, lp = y[-1,:]
-                ep = e0
-                gp = gamma0
-            elif not noEccEvolve:
-                Fp, ep, gp, lp = y[-1,:]
-
-            # get gammadot at pulsar term
-            if not periEv:
-                gammadotp = 0.0
-            else:
-                gammadotp = get_gammadot(Fp, mc, q, ep)
+        if not np.any(y):
+            return None
 
-            if useFile:
-                if ep > 0.001 and ep < 0.999:
-                    nharm = min(int(ecc_interp(ep)), nmax) + 1
-                elif ep <= 0.001:
-                    nharm = 3
-                else:
-                    nharm = nmax
-            else:
-                nharm = nmax
+        if noEccEvolve:
+            Fp, lp = y[-1,:]
+            ep = e0
+            gp = gamma0
+        elif not noEccEvolve:
+            Fp, ep, gp, lp = y[-1,:]
 
+    # get gammadot at pulsar term
+    if not periEv:
+        gammadotp = 0.0
+    else:
+        gammadotp = get_gammadot(Fp, mc, q, ep)
 
-            if gpx is None:
-                gp_tmp = gp
-            elif gpx is not None:
-                gp_tmp = gpx
+    nharm = get_nharm(ep, nmax, useFile)
 
-            if lpx is None:
-                lp_tmp = lp
-            elif lpx is not None:
-                lp_tmp = lpx
+    if gpx is None:
+        gp_tmp = gp
+    elif gpx is not None:
+        gp_tmp = gpx
 
-            splusp, scrossp = calculate_splus_scross(nharm, mc, dist, h0, Fp, ep,
-                                                     toas, lp_tmp, gp_tmp,
-                                                     gammadotp, inc)
+    if lpx is None:
+        lp_tmp = lp
+    elif lpx is not None:
+        lp_tmp = lpx
 
-            rr = (fplus*cos2psi - fcross*sin2psi) * (splusp - splus) + \
-                    (fplus*sin2psi + fcross*cos2psi) * (scrossp - scross)
+    return calculate_splus_scross(nharm, mc, dist, h0, Fp, ep,
+                                  toas, lp_tmp, gp_tmp,
+                                  gammadotp, inc)
+
+
+def ecc_cgw_signal_batch(psrs, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
+                         e0, l0, q, nmax=100, nset=None, pd=None, gpx=None, lpx=None,
+                         periEv=True, psrTerm=False, tref=0, useFile=True,
+                         epochTOAs=False, noEccEvolve=False, evolveTable=False):
+
+    """
+    Residuals of an eccentric SMBHB in all pulsars at once. The
+    source geometry, harmonic amplitudes and the Earth term are
+    computed once on the concatenated TOAs of the array; only the
+    pulsar term is done pulsar by pulsar.
+
+    :param psrs: list of pulsar objects
+    :param pd: Pulsar distances [kpc], one per pulsar
+    :param gpx: Pulsar-term gamma0 [radians], one per pulsar (or None)
+    :param lpx: Pulsar-term l0 [radians], one per pulsar (or None)
+    :param evolveTable: Use the tabulated binary evolution for the pulsar term
+
+    (other parameters as in ecc_cgw_signal)
+
+    :returns: list of induced residuals, one per pulsar
+    """
+
+    npsr = len(psrs)
+
+    # define variable for later use
+    cosgwtheta, cosgwphi = np.cos(gwtheta), np.cos(gwphi)
+    singwtheta, singwphi = np.sin(gwtheta), np.sin(gwphi)
+    sin2psi, cos2psi = np.sin(2*psi), np.cos(2*psi)
+
+    # unit vectors to GW source
+    m = np.array([singwphi, -cosgwphi, 0.0])
+    n = np.array([-cosgwtheta*cosgwphi, -cosgwtheta*singwphi, singwtheta])
+    omhat = np.array([-singwtheta*cosgwphi, -singwtheta*singwphi, -cosgwtheta])
+
+    # pulsar locations, (npsr,3)
+    ptheta = np.array([np.pi/2 - p.psr_locs[1] for p in psrs])
+    pphi = np.array([p.psr_locs[0] for p in psrs])
+    phat = np.array([np.sin(ptheta)*np.cos(pphi), np.sin(ptheta)*np.sin(pphi),
+                     np.cos(ptheta)]).T
+
+    mp, nph, omp = np.dot(phat, m), np.dot(phat, n), np.dot(phat, omhat)
+    fplus = 0.5 * (mp**2 - nph**2) / (1+omp)
+    fcross = (mp*nph) / (1+omp)
+    cosMu = -omp
+
+    rplus = fplus*cos2psi - fcross*sin2psi
+    rcross = fplus*sin2psi + fcross*cos2psi
+
+    # concatenated TOAs of the array
+    if epochTOAs:
+        toas = [(p.detsig_avetoas - tref)*86400.0 for p in psrs]
+    elif not epochTOAs:
+        toas = [(p.toas - tref)*86400.0 for p in psrs]
+    splits = np.cumsum([len(t) for t in toas])[:-1]
+
+    # get gammadot for earth term
+    if not periEv:
+        gammadot = 0.0
+    else:
+        gammadot = get_gammadot(F, mc, q, e0)
+
+    if nset is not None:
+        nharm = nset
+    else:
+        nharm = get_nharm(e0, nmax, useFile)
+
+    ##### earth term, whole array in one pass #####
+    splus, scross = calculate_splus_scross(nharm, mc, dist, h0, F, e0,
+                                           np.concatenate(toas), l0, gamma0,
+                                           gammadot, inc)
+    splus = np.split(splus, splits)
+    scross = np.split(scross, splits)
+
+    rr = []
+    for ii in range(npsr):
+
+        if psrTerm:
+
+            pterm = cgw_pulsar_term(toas[ii], cosMu[ii], pd[ii], mc, dist, h0,
+                                    F, inc, gamma0, e0, l0, q, nmax=nmax,
+                                    gpx=None if gpx is None else gpx[ii],
+                                    lpx=None if lpx is None else lpx[ii],
+                                    periEv=periEv, useFile=useFile,
+                                    noEccEvolve=noEccEvolve,
+                                    evolveTable=evolveTable)
+
+            if pterm is not None:
+                splusp, scrossp = pterm
+                rr.append(rplus[ii] * (splusp - splus[ii]) +
+                          rcross[ii] * (scrossp - scross[ii]))
+            else:
+                rr.append(np.zeros(len(toas[ii])))
 
         else:
-            rr = np.zeros(len(toas))
 
+            rr.append(- rplus[ii] * splus[ii] - rcross[ii] * scross[ii])
+
+    return rr
+
+
+def circ_orbital_phase(F, mc, t):
+
+    """
+    Closed-form leading-order orbital frequency and accumulated
+    orbital phase of a circular SMBHB.
+
+    :param F: Orbital frequency at t = 0 [Hz]
+    :param mc: Chirp mass of binary [Solar Mass]
+    :param t: Times [s]
+
+    :returns: (orbital angular frequency [rad/s], orbital phase
+              accumulated since t = 0 [rad]), or None if the
+              binary has merged by max(t)
+    """
+
+    mc = mc * SOLAR2S
+    omega0 = 2*np.pi*F
+
+    val = omega0**(-8/3) - 256/5 * mc**(5/3) * t
+    if np.any(val <= 0.0):
+        return None
+
+    omega = val**(-3/8)
+    phase = (omega0**(-5/3) - omega**(-5/3)) / (32 * mc**(5/3))
+
+    return omega, phase
+
+
+def circ_cgw_signal_batch(psrs, gwtheta, gwphi, mc, dist, h0, F, inc, psi, gamma0,
+                          l0, q, pd=None, gpx=None, lpx=None, periEv=True,
+                          psrTerm=False, tref=0, epochTOAs=False, evolve=False,
+                          margPhase=False, noEccEvolve=False, evolveTable=False):
+
+    """
+    Residuals of a circular SMBHB in all pulsars at once. This is
+    the e = 0 limit of ecc_cgw_signal_batch, where only the
+    second harmonic survives, so splus and scross are single
+    sinusoids in the phase l + gamma.
+
+    :param psrs: list of pulsar objects
+    :param pd: Pulsar distances [kpc], one per pulsar
+    :param gpx: Pulsar-term gamma0 [radians], one per pulsar (or None)
+    :param lpx: Pulsar-term l0 [radians], one per pulsar (or None)
+    :param evolve: Evolve the orbital frequency across the TOAs with the
+                   leading-order chirp, rather than holding it fixed
+    :param margPhase: With psrTerm, leave the pulsar-term phase
+                      psi = 2*(lp + gp) free (gpx and lpx are ignored)
+    :param evolveTable: Use the tabulated binary evolution for the pulsar term
+
+    (other parameters as in ecc_cgw_signal)
+
+    :returns: list of induced residuals, one per pulsar. With margPhase,
+              one (earth-term residuals, B) pair per pulsar instead,
+              where the pulsar term is B[:,0]*cos(psi) + B[:,1]*sin(psi)
+    """
+
+    npsr = len(psrs)
+
+    # define variable for later use
+    cosgwtheta, cosgwphi = np.cos(gwtheta), np.cos(gwphi)
+    singwtheta, singwphi = np.sin(gwtheta), np.sin(gwphi)
+    sin2psi, cos2psi = np.sin(2*psi), np.cos(2*psi)
+    cosinc = np.cos(inc)
+
+    # unit vectors to GW source
+    m = np.array([singwphi, -cosgwphi, 0.0])
+    n = np.array([-cosgwtheta*cosgwphi, -cosgwtheta*singwphi, singwtheta])
+    omhat = np.array([-singwtheta*cosgwphi, -singwtheta*singwphi, -cosgwtheta])
+
+    # pulsar locations, (npsr,3)
+    ptheta = np.array([np.pi/2 - p.psr_locs[1] for p in psrs])
+    pphi = np.array([p.psr_locs[0] for p in psrs])
+    phat = np.array([np.sin(ptheta)*np.cos(pphi), np.sin(ptheta)*np.sin(pphi),
+                     np.cos(ptheta)]).T
+
+    mp, nph, omp = np.dot(phat, m), np.dot(phat, n), np.dot(phat, omhat)
+    fplus = 0.5 * (mp**2 - nph**2) / (1+omp)
+    fcross = (mp*nph) / (1+omp)
+    cosMu = -omp
+
+    rplus = fplus*cos2psi - fcross*sin2psi
+    rcross = fplus*sin2psi + fcross*cos2psi
+
+    # concatenated TOAs of the array
+    if epochTOAs:
+        toas = [(p.detsig_avetoas - tref)*86400.0 for p in psrs]
+    elif not epochTOAs:
+        toas = [(p.toas - tref)*86400.0 for p in psrs]
+    splits = np.cumsum([len(t) for t in toas])[:-1]
+
+    omega0 = 2*np.pi*F
+
+    def amplitude(omega):
+        # a_2 = b_2 = -2A in the notation of get_an, get_bn
+        if h0 is None:
+            return (mc*SOLAR2S)**(5/3) * omega**(2/3) / (dist*MPC2S)
+        elif h0 is not None and not evolve:
+            return h0 / 2.0
+        elif h0 is not None and evolve:
+            return h0 / 2.0 * (omega/omega0)**(2/3)
+
+    def polarizations(amp, omega, gammadot, phase):
+        fac = amp / (omega + gammadot)
+        return (1+cosinc**2) * fac * np.sin(2*phase), \
+          2 * cosinc * fac * np.cos(2*phase)
+
+    # get gammadot for earth term
+    if not periEv:
+        gammadot = 0.0
+    else:
+        gammadot = get_gammadot(F, mc, q, 0.0)
+
+    ##### earth term, whole array in one pass #####
+    tt = np.concatenate(toas)
+    orb = circ_orbital_phase(F, mc, tt) if evolve else None
+    if orb is not None:
+        omega, lphase = orb
+        phase = l0 + lphase + gamma0 + gammadot*tt
     else:
+        omega = omega0
+        phase = l0 + gamma0 + (omega0 + gammadot)*tt
 
-        rr = - (fplus*cos2psi - fcross*sin2psi) * splus - \
-                (fplus*sin2psi + fcross*cos2psi) * scross
+    splus, scross = polarizations(amplitude(omega), omega, gammadot, phase)
+    splus = np.split(splus, splits)
+    scross = np.split(scross, splits)
+
+    rr = []
+    for ii in range(npsr):
+
+        if psrTerm:
+
+            if margPhase:
+                # reference the pulsar-term phase to zero
+                gp, lp = 0.0, 0.0
+            else:
+                gp = None if gpx is None else gpx[ii]
+                lp = None if lpx is None else lpx[ii]
+
+            # without a sampled pulsar-term gamma0, evolve gamma
+            # over the light-travel time with the ODE
+            if gp is None:
+                pterm = cgw_pulsar_term(toas[ii], cosMu[ii], pd[ii], mc, dist, h0,
+                                        F, inc, gamma0, 0.0, l0, q, nmax=3,
+                                        lpx=lp, periEv=periEv, useFile=False,
+                                        noEccEvolve=noEccEvolve,
+                                        evolveTable=evolveTable)
+            else:
+                # pulsar time
+                tp = toas[ii] - pd[ii] * KPC2S * (1-cosMu[ii])
+
+                if evolve:
+                    # phase referenced to the pulsar time at Earth t = 0
+                    tp0 = - pd[ii] * KPC2S * (1-cosMu[ii])
+                    orb = circ_orbital_phase(F, mc, np.append(tp, tp0))
+                    if orb is not None:
+                        omegap, lphasep = orb[0][:-1], orb[1][:-1] - orb[1][-1]
+                        if lp is None:
+                            lp = l0 + orb[1][-1]
+                else:
+                    # frequency held at its value at the earliest pulsar time
+                    orb = circ_orbital_phase(F, mc, np.array([tp.min()]))
+                    if orb is not None:
+                        omegap, lphasep = orb[0][0], orb[0][0] * toas[ii]
+                        if lp is None:
+                            lp = l0 + orb[1][0]
+
+                if orb is not None:
+                    if not periEv:
+                        gammadotp = 0.0
+                    else:
+                        gammadotp = get_gammadot(omegap/(2*np.pi), mc, q, 0.0)
+
+                    phasep = lp + lphasep + gp + gammadotp*toas[ii]
+                    pterm = polarizations(amplitude(omegap), omegap,
+                                          gammadotp, phasep)
+                    if margPhase:
+                        # shifting 2*phase by pi/2 gives the sin(psi) partner
+                        pterm_q = polarizations(amplitude(omegap), omegap,
+                                                gammadotp, phasep + np.pi/4)
+                else:
+                    pterm = None
+
+            if margPhase:
+                if pterm is not None:
+                    basis = np.array([rplus[ii] * pterm[0] + rcross[ii] * pterm[1],
+                                      rplus[ii] * pterm_q[0] + rcross[ii] * pterm_q[1]]).T
+                    rr.append((- rplus[ii] * splus[ii] - rcross[ii] * scross[ii], basis))
+                else:
+                    rr.append((np.zeros(len(toas[ii])), np.zeros((len(toas[ii]),2))))
+            elif pterm is not None:
+                splusp, scrossp = pterm
+                rr.append(rplus[ii] * (splusp - splus[ii]) +
+                          rcross[ii] * (scrossp - scross[ii]))
+            else:
+                rr.append(np.zeros(len(toas[ii])))
+
+        else:
+
+            rr.append(- rplus[ii] * splus[ii] - rcross[ii] * scross[ii])
 
     return rr
 
@@ -1371,8 +2281,12 @@ def BWMantennaPattern(rajp, decjp, raj, decj, pol):
     :param raj:     Right ascension source (rad) [0,2pi]
     :param dec:     Declination source (rad) [-pi/2,pi/2]
     :param pol:     Polarization angle (rad) [0,pi]
+
+    rajp and decjp may be arrays, to get all pulsars in one call.
     """
 
+    raj, decj = np.ravel(raj)[0], np.ravel(decj)[0]
+
     Omega = np.array([-np.cos(decj)*np.cos(raj), \
                       -np.cos(decj)*np.sin(raj), \
                       -np.sin(decj)]).flatten()
@@ -1382,18 +2296,45 @@ def BWMantennaPattern(rajp, decjp, raj, decj, pol):
                      -np.sin(decj)*np.sin(raj), \
                      np.cos(decj)]).flatten()
 
+    rajp = np.atleast_1d(rajp).flatten()
+    decjp = np.atleast_1d(decjp).flatten()
     p = np.array([np.cos(rajp)*np.cos(decjp), \
                   np.sin(rajp)*np.cos(decjp), \
-                  np.sin(decjp)]).flatten()
-
+                  np.sin(decjp)])
 
+    np_, mp, op = np.dot(nhat, p), np.dot(mhat, p), np.dot(Omega, p)
 
-    Fp = 0.5 * (np.dot(nhat, p)**2 - np.dot(mhat, p)**2) / (1 + np.dot(Omega, p))
-    Fc = np.dot(mhat, p) * np.dot(nhat, p) / (1 + np.dot(Omega, p))
+    Fp = 0.5 * (np_**2 - mp**2) / (1 + op)
+    Fc = mp * np_ / (1 + op)
 
     return np.cos(2*pol)*Fp + np.sin(2*pol)*Fc
 
 
+def ramp_signal(t, epoch, order=None):
+    """
+    Unit ramp (t - epoch) after the epoch and zero before it, in the
+    units of t. The TOAs after the epoch are found by bisection of
+    the time-sorted TOAs, and only those are written.
+
+    :param t:       timestamps
+    :param epoch:   start of the ramp
+    :param order:   np.argsort(t), if already known
+
+    :returns: ramp at the timestamps
+    """
+
+    if order is None:
+        order = np.argsort(t, kind='mergesort')
+
+    tsort = t[order]
+    start = np.searchsorted(tsort, epoch, side='right')
+
+    ramp = np.zeros(len(t))
+    ramp[order[start:]] = tsort[start:] - epoch
+
+    return ramp
+
+
 def bwmsignal(parameters, psr, antennaPattern='quad'):
     """
     Function that calculates the earth-term gravitational-wave burst-with-memory
@@ -1426,16 +2367,151 @@ def bwmsignal(parameters, psr, antennaPattern='quad'):
         pol = np.absolute(BWMantennaPattern(psr.psr_locs[0].flatten(), psr.psr_locs[1].flatten(),
                                        gwphi, gwdec, gwpol))
 
-    # Define the heaviside function
-    heaviside = lambda x: 0.5 * (np.sign(x) + 1)
-
     # Return the time-series for the pulsar
-    bwm = pol * (10**parameters[1]) * heaviside(psr.toas - parameters[0]) * \
-            (psr.toas - parameters[0]) * 86400
+    bwm = pol * (10**parameters[1]) * ramp_signal(psr.toas, parameters[0]) * 86400
 
     return bwm
 
 
+def bwmsignal_batch(parameters, psrs, antennaPattern='quad', toa_order=None):
+    """
+    Earth-term burst-with-memory signal in all pulsars, with the
+    antenna patterns of the whole array computed in one call.
+    Parameters as in bwmsignal.
+
+    :param psrs: list of pulsar objects
+    :param antennaPattern: 'quad', 'mono' or 'absQuad'
+    :param toa_order: per-pulsar np.argsort of the TOAs (optional)
+
+    :returns: list of induced residuals (seconds), one per pulsar
+    """
+
+    gwphi = np.array([parameters[2]])
+    gwdec = np.array([np.pi/2-np.arccos(parameters[3])])
+    gwpol = np.array([parameters[4]])
+
+    if antennaPattern == 'mono':
+        pol = np.ones(len(psrs))
+    else:
+        rajp = np.array([np.ravel(p.psr_locs[0])[0] for p in psrs])
+        decjp = np.array([np.ravel(p.psr_locs[1])[0] for p in psrs])
+        pol = BWMantennaPattern(rajp, decjp, gwphi, gwdec, gwpol)
+        if antennaPattern == 'absQuad':
+            pol = np.absolute(pol)
+
+    amp = (10**parameters[1]) * 86400
+
+    return [pol[ii] * amp * ramp_signal(p.toas, parameters[0],
+                                        None if toa_order is None else toa_order[ii])
+            for ii,p in enumerate(psrs)]
+
+
+def bwmRampProducts(toas, epochs, Nr, NT, Nt, N1, d, cf):
+    """
+    Noise-weighted inner products of a unit BWM ramp with the data and
+    with itself, for a grid of burst epochs, after marginalizing over
+    the Gaussian-process basis T (Woodbury). With the ramp
+    u = (t - t0) * 86400 for t > t0, the sums over TOAs after t0 are
+    tail sums over the time-sorted TOAs, so every epoch costs a
+    bisection and a few lookups rather than a pass over the TOAs.
+
+    With ECORR, the ramp-ramp product is exact as long as t0 does
+    not split an observing epoch.
+
+    @param toas: TOAs [MJD]
+    @param epochs: trial burst epochs [MJD]
+    @param Nr: N^-1 applied to the residuals
+    @param NT: N^-1 applied to the basis, (nTOA x nbasis)
+    @param Nt: N^-1 applied to the TOAs (in days, relative to toas.mean())
+    @param N1: N^-1 applied to a vector of ones
+    @param d: T^T N^-1 r
+    @param cf: Cholesky factor of Sigma = T^T N^-1 T + Phi^-1
+
+    @return: (u|r) and (u|u) for every epoch
+
+    """
+
+    tref = toas.mean()
+    order = np.argsort(toas, kind='mergesort')
+    tt = toas[order] - tref
+
+    # tail sums, with a trailing zero for epochs after the last TOA
+    def tailsum(x):
+        x = x[order]
+        return np.append(np.cumsum(x[::-1], axis=0)[::-1], np.zeros((1,)+x.shape[1:]), axis=0)
+
+    sNr, stNr = tailsum(Nr), tailsum((toas-tref)*Nr)
+    sNT, stNT = tailsum(NT), tailsum(((toas-tref)*NT.T).T)
+    sNt, stNt = tailsum(Nt), tailsum((toas-tref)*Nt)
+    sN1, stN1 = tailsum(N1), tailsum((toas-tref)*N1)
+
+    t0 = epochs - tref
+    kk = np.searchsorted(tt, t0, side='right')
+
+    uNr = 86400.0 * (stNr[kk] - t0*sNr[kk])
+    TNu = 86400.0 * (stNT[kk] - (t0*sNT[kk].T).T)
+    uNu = 86400.0**2.0 * (stNt[kk] - t0*sNt[kk] - t0*(stN1[kk] - t0*sN1[kk]))
+
+    # remove the part absorbed by the noise basis
+    SiTNu = sl.cho_solve(cf, TNu.T)
+    ur = uNr - np.dot(SiTNu.T, d)
+    uu = uNu - np.sum(TNu.T * SiTNu, axis=0)
+
+    return ur, uu
+
+
+def bwmScanStatistic(ur, uu, pols, hmax):
+    """
+    Combine the per-pulsar ramp products of bwmRampProducts into a
+    likelihood ratio for an Earth-term BWM of strain h, on a grid of
+    sky and polarization directions,
+
+        ln Lambda = h sum_a F_a (u|r)_a - h^2/2 sum_a F_a^2 (u|u)_a
+
+    @param ur: (u|r), (npsr x nepoch)
+    @param uu: (u|u), (npsr x nepoch)
+    @param pols: antenna patterns F_a, (ndirection x npsr)
+    @param hmax: upper limit of the uniform strain prior used for
+                 the marginalized statistic
+
+    @return: ln Lambda maximized over strain and direction, the index of
+             the best direction, the best strain, and ln Lambda
+             marginalized over strain in [0, hmax] and the direction grid,
+             all per epoch
+
+    """
+
+    A = np.dot(pols, ur)
+    B = np.dot(pols**2.0, uu)
+
+    # ramps absorbed entirely by the timing model carry no information
+    valid = B > 0.0
+    A = np.where(valid, A, 0.0)
+    B = np.where(valid, B, 1.0)
+
+    # strain is positive; the sign is carried by the polarization
+    hbest = np.clip(A / B, 0.0, hmax)
+    lnlam = hbest * A - 0.5 * hbest**2.0 * B
+
+    best = np.argmax(lnlam, axis=0)
+    cols = np.arange(lnlam.shape[1])
+    lnlam_max = lnlam[best, cols]
+    hbest = hbest[best, cols]
+
+    # int_0^hmax exp(h A - h^2 B / 2) dh / hmax, via the normal cdf
+    mu, sig = A / B, 1.0 / np.sqrt(B)
+    lo, hi = -mu / sig, (hmax - mu) / sig
+    flip = lo > 0.0
+    lo[flip], hi[flip] = -hi[flip], -lo[flip]
+    lncdf = ss.log_ndtr(hi) + np.log1p(-np.exp(ss.log_ndtr(lo) - ss.log_ndtr(hi)))
+    lnint = 0.5 * A * mu + np.log(sig * np.sqrt(2.0*np.pi)) + lncdf - np.log(hmax)
+
+    lnmax = np.max(lnint, axis=0)
+    lnlam_marg = lnmax + np.log(np.mean(np.exp(lnint - lnmax), axis=0))
+
+    return lnlam_max, best, hbest, lnlam_marg
+
+
 def bwmsignal_psr(parameters, t):
     """
     Function that calculates the earth-term gravitational-wave burst-with-memory
@@ -1454,15 +2530,12 @@ def bwmsignal_psr(parameters, t):
     returns the waveform as induced timing residuals (seconds)
 
     """
-    # Define the heaviside function
-    heaviside = lambda x: 0.5 * (np.sign(x) + 1)
-
     s = np.sign(parameters[2])
     amp = 10**parameters[1]
     epoch = (parameters[0] - pic_T0) * pic_spd
 
     # Return the time-series for the pulsar
-    return amp * s * heaviside(t - epoch) * (t - epoch)
+    return amp * s * ramp_signal(t, epoch)
 
 
 def glitch_signal(psr, epoch, amp):
@@ -1475,14 +2548,10 @@ def glitch_signal(psr, epoch, amp):
     :param amp: amplitude of the glitch
     """
 
-    # Define the heaviside function
-    heaviside = lambda x: 0.5 * (np.sign(x) + 1)
-
     # Glitches are spontaneous spin-up events.
     # Thus TOAs will be advanced, and resiudals will be negative.
 
-    return  -10.0**amp * heaviside(psr.toas - epoch) * \
-      (psr.toas - epoch)*86400.0
+    return  -10.0**amp * ramp_signal(psr.toas, epoch)*86400.0
 
 
 def real_sph_harm(ll, mm, phi, theta):